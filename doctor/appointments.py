@@ -0,0 +1,112 @@
+from datetime import date, time, timedelta
+from django.conf import settings
+from django.utils import timezone
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from user.models import Appointment
+
+
+ACTIVE_STATUSES = ['scheduled', 'confirmed']
+
+# Feeds a doctor can page through; upcoming runs forwards in time, the others backwards
+FEEDS = ('upcoming', 'past', 'cancelled')
+
+
+def encode_cursor(appointment):
+    """Opaque keyset cursor pointing just past `appointment` in its feed"""
+    return urlsafe_base64_encode(
+        f"{appointment.appointment_date.isoformat()}|{appointment.appointment_time.isoformat()}|{appointment.id}".encode()
+    )
+
+
+def decode_cursor(cursor):
+    """(date, time, id) of a cursor from encode_cursor; ValueError if it is not one"""
+    try:
+        day, at, appointment_id = urlsafe_base64_decode(cursor).decode().split('|')
+        return date.fromisoformat(day), time.fromisoformat(at), int(appointment_id)
+    except (TypeError, UnicodeDecodeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+
+def feed_ranges(feed, today):
+    """
+    The (status, first day, last day) ranges making up a feed, None meaning
+    unbounded. Each is a single range of the (doctor, status,
+    appointment_date, appointment_time) index.
+    """
+    if feed == 'upcoming':
+        return [(status, today, None) for status in ACTIVE_STATUSES]
+    if feed == 'past':
+        return [('completed', None, None)] + [
+            (status, None, today - timedelta(days=1)) for status in ACTIVE_STATUSES
+        ]
+    return [('cancelled', None, None)]
+
+
+def appointment_feed(doctor_id, feed='upcoming', start=None, end=None, cursor=None, limit=None):
+    """
+    One page of a doctor's appointments and the cursor of the next page
+    (None on the last).
+
+    upcoming:  scheduled and confirmed appointments from `start` (default
+               today) onwards, soonest first
+    past:      completed appointments, and scheduled or confirmed ones whose
+               day has gone, latest first
+    cancelled: cancelled appointments, latest first
+
+    `start` and `end` (inclusive dates) narrow any feed to a window. A feed is
+    made of one date range per status (see feed_ranges); each is paged on its
+    own along the (doctor, status, appointment_date, appointment_time) index,
+    limit + 1 rows at most, and the short lists are merged. A page costs the
+    same however many appointments the doctor has had.
+    """
+    if feed not in FEEDS:
+        raise ValueError(f"Unknown feed {feed!r}")
+    limit = limit or settings.DOCTOR_APPOINTMENTS_PAGE_SIZE
+    forwards = feed == 'upcoming'
+    order = ['appointment_date', 'appointment_time', 'id']
+    if not forwards:
+        order = [f'-{field}' for field in order]
+
+    merged = []
+    for status, first_day, last_day in feed_ranges(feed, timezone.localdate()):
+        if start:
+            first_day = max(first_day or start, start)
+        if end:
+            last_day = min(last_day or end, end)
+        appointments = Appointment.objects.filter(doctor_id=doctor_id, status=status)
+        if first_day:
+            appointments = appointments.filter(appointment_date__gte=first_day)
+        if last_day:
+            appointments = appointments.filter(appointment_date__lte=last_day)
+        if cursor is not None:
+            day, at, last_id = cursor
+            # The index seeks on the date bound; time and id only drop the rest of that day
+            if forwards:
+                appointments = appointments.filter(appointment_date__gte=day).exclude(
+                    appointment_date=day, appointment_time__lt=at,
+                ).exclude(appointment_date=day, appointment_time=at, id__lte=last_id)
+            else:
+                appointments = appointments.filter(appointment_date__lte=day).exclude(
+                    appointment_date=day, appointment_time__gt=at,
+                ).exclude(appointment_date=day, appointment_time=at, id__gte=last_id)
+        merged += appointments.select_related('user').order_by(*order)[:limit + 1]
+
+    merged.sort(key=lambda appointment: (appointment.appointment_date, appointment.appointment_time, appointment.id), reverse=not forwards)
+    page = merged[:limit + 1]
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
+
+
+def appointment_summary(appointment):
+    """What the doctor dashboard shows of an appointment, as JSON"""
+    return {
+        'id': appointment.id,
+        'patient_name': appointment.user.name,
+        'date': appointment.appointment_date.isoformat(),
+        'time': appointment.appointment_time.strftime('%H:%M'),
+        'date_display': appointment.appointment_date.strftime('%b %d, %Y'),
+        'time_display': appointment.appointment_time.strftime('%I:%M %p').lstrip('0'),
+        'reason': appointment.reason or '',
+        'status': appointment.status,
+        'status_display': appointment.get_status_display(),
+    }
@@ -0,0 +1,106 @@
+import csv
+import io
+import tempfile
+import zipfile
+from django.conf import settings
+from .models import Prescription
+from .pdf import prescription_pdf_data, stored_pdf
+
+
+MANIFEST_FIELDS = [
+    'prescription_id', 'file', 'patient_name', 'patient_email', 'age',
+    'diagnosis', 'medications', 'created_at', 'sent_via_email', 'content_hash',
+]
+
+
+class ZipStream:
+    """
+    Write-only, non-seekable sink for ZipFile. Without seek() zipfile writes
+    each entry's sizes in a trailing data descriptor, so finished bytes can
+    be handed to the client straight away instead of building the archive.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_prescriptions(doctor_id=None, batch_size=None):
+    """Every prescription (of one doctor, if given) in id order, fetched in keyset-paginated batches"""
+    batch_size = batch_size or settings.PRESCRIPTION_EXPORT_BATCH_SIZE
+    prescriptions = Prescription.objects.select_related('doctor').order_by('id')
+    if doctor_id is not None:
+        prescriptions = prescriptions.filter(doctor_id=doctor_id)
+    last_id = 0
+    while True:
+        batch = list(prescriptions.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return
+        yield from batch
+        last_id = batch[-1].id
+
+
+def archive_filename(prescription):
+    return f"prescriptions/prescription_{prescription.id}_{prescription.created_at:%Y%m%d}.pdf"
+
+
+def prescription_archive(doctor_id, batch_size=None):
+    """
+    Yield a ZIP archive of a doctor's prescriptions piece by piece: one PDF
+    per prescription, then manifest.csv. Everything comes from one pass over
+    the prescriptions, and each manifest row carries the content hash of the
+    very PDF stored next to it, so rows written or edited during the export
+    cannot make the two disagree. Only one batch of rows and one PDF are held
+    in memory at a time; the manifest is spooled to a temporary file until
+    the PDFs are done. PDFs come from (and fill) the content-addressed store.
+    """
+    stream = ZipStream()
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024, mode='w+', encoding='utf-8', newline='') as manifest, \
+            zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        writer = csv.writer(manifest)
+        writer.writerow(MANIFEST_FIELDS)
+        for prescription in iter_prescriptions(doctor_id, batch_size):
+            data = prescription_pdf_data(prescription)
+            digest, path = stored_pdf(data)
+            filename = archive_filename(prescription)
+            # PDF streams are already deflated; storing them saves CPU for no size cost
+            archive.write(path, filename, compress_type=zipfile.ZIP_STORED)
+            writer.writerow([
+                prescription.id,
+                filename,
+                prescription.patient_name,
+                prescription.patient_email,
+                prescription.age,
+                prescription.diagnosis or '',
+                '; '.join(med.get('name', '') for med in prescription.medications if isinstance(med, dict)),
+                prescription.created_at.isoformat(),
+                prescription.sent_via_email,
+                digest,
+            ])
+            yield stream.drain()
+
+        manifest.seek(0)
+        with archive.open('manifest.csv', 'w', force_zip64=True) as raw_manifest:
+            entry = io.TextIOWrapper(raw_manifest, encoding='utf-8', newline='')
+            for chunk in iter(lambda: manifest.read(64 * 1024), ''):
+                entry.write(chunk)
+                entry.flush()
+                yield stream.drain()
+            entry.detach()
+    yield stream.drain()
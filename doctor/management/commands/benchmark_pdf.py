@@ -0,0 +1,63 @@
+import time
+from django.core.management.base import BaseCommand
+from doctor.pdf import render_prescription_pdf
+
+
+def sample_pdf_data(medication_count):
+    """A prescription_pdf_data()-shaped record with `medication_count` medications"""
+    return {
+        'doctor_name': 'Asha Rao',
+        'doctor_specialty': 'General Medicine',
+        'doctor_email': 'asha@example.com',
+        'patient_name': 'Ravi Kumar',
+        'age': 42,
+        'weight': 71.5,
+        'height': 172,
+        'gender': 'Male',
+        'diagnosis': 'Upper respiratory tract infection',
+        'notes': 'Drink plenty of fluids.\nReview after five days.',
+        'medications': [
+            {
+                'name': f'Medicine {i} 500mg Tablet',
+                'dosage': '1 tablet',
+                'frequency': 'Twice daily',
+                'duration': '5 days',
+            }
+            for i in range(1, medication_count + 1)
+        ],
+        'created_at': '2026-01-15T10:30:00+00:00',
+    }
+
+
+def render_rate(data, row_forms, repeat=5):
+    """Prescriptions/second over `repeat` renders"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        render_prescription_pdf(data, row_forms=row_forms)
+    return repeat / (time.perf_counter() - started)
+
+
+class Command(BaseCommand):
+    help = "Measure prescription PDF rendering throughput with and without row form XObjects"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,10,50', help="Comma separated medication counts")
+        parser.add_argument('--rounds', type=int, default=30, help="Timed rounds per size and mode")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        self.stdout.write(f"{'medications':>11} {'direct/s':>10} {'forms/s':>10} {'default/s':>10} {'speedup':>8}")
+        for size in sizes:
+            data = sample_pdf_data(size)
+            for row_forms in (False, True):
+                render_prescription_pdf(data, row_forms=row_forms)  # warm-up: font metrics, module caches
+
+            # Interleave the modes so machine noise affects both alike
+            rates = {False: [], True: [], None: []}
+            for _ in range(options['rounds']):
+                for row_forms in rates:
+                    rates[row_forms].append(render_rate(data, row_forms))
+            direct, forms, default = (sorted(rates[key])[len(rates[key]) // 2] for key in (False, True, None))
+            self.stdout.write(
+                f"{size:>11} {direct:>10.1f} {forms:>10.1f} {default:>10.1f} {default / direct:>7.2f}x"
+            )
@@ -0,0 +1,46 @@
+import os
+from django.core.management.base import BaseCommand
+from doctor.export import iter_prescriptions
+from doctor.pdf import render_prescription_pdfs
+
+
+class Command(BaseCommand):
+    help = "Render prescription PDFs into the PDF store in parallel (e.g. after a layout change)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes")
+        parser.add_argument('--chunk-size', type=int, default=50, help="Prescriptions sent to a worker at a time")
+        parser.add_argument('--batch-size', type=int, default=None, help="Prescriptions fetched per query")
+        parser.add_argument('--doctor', type=int, default=None, help="Only this doctor's prescriptions")
+        parser.add_argument('--force', action='store_true', help="Re-render PDFs that are already stored")
+
+    def handle(self, *args, **options):
+        last_report = [0.0]
+
+        def report(stats, elapsed):
+            # Called per finished chunk; print at most every few seconds
+            if elapsed - last_report[0] < 5:
+                return
+            last_report[0] = elapsed
+            done = stats['rendered'] + stats['failed']
+            self.stdout.write(
+                f"  {done} rendered, {stats['skipped']} already stored, {stats['failed']} failed "
+                f"({done / elapsed:.1f}/s)"
+            )
+
+        stats = render_prescription_pdfs(
+            iter_prescriptions(options['doctor'], options['batch_size']),
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            force=options['force'],
+            on_progress=report,
+        )
+
+        for digest, error in stats['errors'][:10]:
+            self.stderr.write(f"{digest}: {error}")
+        seconds = stats['seconds']
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {stats['rendered']} PDFs ({stats['bytes'] / 1e6:.1f} MB) in {seconds:.1f}s "
+            f"with {options['workers']} workers: {stats['rendered'] / seconds if seconds else 0:.1f} PDFs/s; "
+            f"{stats['skipped']} already stored, {stats['failed']} failed"
+        ))
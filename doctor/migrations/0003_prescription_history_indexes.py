@@ -0,0 +1,22 @@
+# Generated by Django 6.0 on 2026-10-18 21:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0002_doctor_specialty_prescription'),
+        ('user', '0003_appointment'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='doctor_pres_user_id_474e3f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['patient_email', 'created_at', 'id'], name='doctor_pres_patient_573dad_idx'),
+        ),
+    ]
@@ -35,5 +35,12 @@ class Prescription(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     sent_via_email = models.BooleanField(default=False)
     
+    class Meta:
+        # Keyset pages of a patient's history, matched by account or by email
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id']),
+            models.Index(fields=['patient_email', 'created_at', 'id']),
+        ]
+    
     def __str__(self):
         return f"Prescription for {self.patient_name} by Dr. {self.doctor.name}"
@@ -0,0 +1,346 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+from django.conf import settings
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+
+# Bump whenever the rendered layout changes so stored PDFs are re-rendered
+PDF_LAYOUT_VERSION = 1
+
+
+def prescription_pdf_data(prescription):
+    """
+    Everything the PDF shows, as plain JSON-able data. This is both what gets
+    hashed to address the stored PDF and the only input the renderer takes.
+    """
+    doctor = prescription.doctor
+    return {
+        'doctor_name': doctor.name,
+        'doctor_specialty': doctor.specialty or '',
+        'doctor_email': doctor.email,
+        'patient_name': prescription.patient_name,
+        'age': prescription.age,
+        'weight': prescription.weight,
+        'height': prescription.height,
+        'gender': prescription.gender or '',
+        'diagnosis': prescription.diagnosis or '',
+        'notes': prescription.notes or '',
+        'medications': [
+            {key: str(med.get(key) or '') for key in ('name', 'dosage', 'frequency', 'duration')}
+            for med in prescription.medications
+            if isinstance(med, dict)
+        ],
+        'created_at': prescription.created_at.isoformat(),
+    }
+
+
+def pdf_content_hash(data):
+    payload = json.dumps({'layout': PDF_LAYOUT_VERSION, 'data': data}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def pdf_store_path(digest, root=None):
+    return Path(root or settings.PRESCRIPTION_PDF_ROOT) / digest[:2] / f'{digest}.pdf'
+
+
+def store_pdf(digest, content, root=None):
+    """Write a rendered PDF into the store; the rename makes concurrent writers of the same hash safe"""
+    path = pdf_store_path(digest, root)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+def get_prescription_pdf(prescription):
+    """
+    Return (content hash, path) of the prescription's PDF, rendering it only
+    when no PDF for the current contents has been stored yet.
+    """
+    return stored_pdf(prescription_pdf_data(prescription))
+
+
+def stored_pdf(data):
+    """(content hash, path) of the PDF for prescription_pdf_data() output, rendering it if not stored yet"""
+    digest = pdf_content_hash(data)
+    path = pdf_store_path(digest)
+    if not path.exists():
+        path = store_pdf(digest, render_prescription_pdf(data))
+    return digest, path
+
+
+def render_pdf_chunk(root, items):
+    """
+    Process-pool worker: render and store a chunk of (content hash, pdf data)
+    pairs. It only receives primitives, never ORM objects or a DB connection.
+    Returns (rendered count, bytes written, failures as (hash, error)).
+    """
+    rendered = written = 0
+    failures = []
+    for digest, data in items:
+        try:
+            content = render_prescription_pdf(data)
+            store_pdf(digest, content, root)
+        except Exception as e:
+            failures.append((digest, f"{type(e).__name__}: {e}"))
+        else:
+            rendered += 1
+            written += len(content)
+    return rendered, written, failures
+
+
+def render_prescription_pdfs(prescriptions, workers=None, chunk_size=50, force=False, on_progress=None):
+    """
+    Render many prescriptions into the PDF store on a ProcessPoolExecutor.
+    `prescriptions` may be any (lazy) iterable of Prescription objects with
+    their doctor loaded; at most two chunks per worker are in flight, so a
+    100k-row iterator is never materialised. PDFs already stored for the
+    current contents are skipped unless `force` is set.
+    """
+    root = str(settings.PRESCRIPTION_PDF_ROOT)
+    workers = workers or os.cpu_count() or 1
+    stats = {'rendered': 0, 'skipped': 0, 'failed': 0, 'bytes': 0, 'errors': []}
+    started = time.perf_counter()
+
+    def collect(done):
+        for future in done:
+            rendered, written, failures = future.result()
+            stats['rendered'] += rendered
+            stats['bytes'] += written
+            stats['failed'] += len(failures)
+            stats['errors'].extend(failures)
+        if on_progress:
+            on_progress(stats, time.perf_counter() - started)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        chunk = []
+        for prescription in prescriptions:
+            data = prescription_pdf_data(prescription)
+            digest = pdf_content_hash(data)
+            if not force and pdf_store_path(digest, root).exists():
+                stats['skipped'] += 1
+                continue
+            chunk.append((digest, data))
+            if len(chunk) >= chunk_size:
+                pending.add(executor.submit(render_pdf_chunk, root, chunk))
+                chunk = []
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+        if chunk:
+            pending.add(executor.submit(render_pdf_chunk, root, chunk))
+        collect(wait(pending).done)
+
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+# Page layout, shared by every render in the process
+PAGE_WIDTH, PAGE_HEIGHT = letter
+BRAND_BLUE = (37/255, 117/255, 252/255)
+BRAND_PURPLE = (106/255, 17/255, 203/255)
+LIGHT_GRAY = (0.96, 0.96, 0.98)
+BORDER_GRAY = (0.8, 0.8, 0.85)
+TABLE_LEFT = 100
+COL_WIDTHS = [50, 200, 100, 120, 100]  # S.No., Medication, Dosage, Frequency, Duration
+TABLE_WIDTH = sum(COL_WIDTHS)
+COL_STARTS = [TABLE_LEFT + 5 + sum(COL_WIDTHS[:i]) for i in range(len(COL_WIDTHS))]
+COL_LIMITS = [None, 30, 15, 18, 15]
+TABLE_HEADINGS = ["S.No.", "Medication", "Dosage", "Frequency", "Duration"]
+ROW_HEIGHT = 20
+# Top and bottom borders plus the column separators, relative to the row's bottom-left corner
+ROW_GRID_LINES = [(0, 18, TABLE_WIDTH, 18), (0, 0, TABLE_WIDTH, 0)] + [
+    (sum(COL_WIDTHS[:i + 1]), 18, sum(COL_WIDTHS[:i + 1]), 0) for i in range(len(COL_WIDTHS))
+]
+
+
+# Defining a form costs more than drawing a few rows directly, so short tables skip them
+ROW_FORM_MIN_ROWS = 4
+
+
+def draw_row_grid(p, shaded, x=0, y=0):
+    """A table row's shading (even rows) and borders with its bottom-left corner at (x, y)"""
+    if shaded:
+        p.setFillColorRGB(*LIGHT_GRAY)
+        p.rect(x, y, TABLE_WIDTH, ROW_HEIGHT, fill=1, stroke=0)
+    p.setStrokeColorRGB(*BORDER_GRAY)
+    p.setLineWidth(1)
+    if x or y:
+        p.lines([(x1 + x, y1 + y, x2 + x, y2 + y) for x1, y1, x2, y2 in ROW_GRID_LINES])
+    else:
+        p.lines(ROW_GRID_LINES)
+
+
+def row_form(p, shaded, defined):
+    """
+    Name of the form XObject holding a table row's grid, defined in this
+    document on first use. Every further row is then one doForm instead of
+    seven line calls plus colour setup. Forms are resources of a single PDF
+    file, so each document defines its own.
+    """
+    name = 'row_shaded' if shaded else 'row'
+    if name not in defined:
+        p.beginForm(name, upperx=TABLE_WIDTH, uppery=ROW_HEIGHT)
+        draw_row_grid(p, shaded)
+        p.endForm()
+        defined.add(name)
+    return name
+
+
+def place_form(p, name, x, y):
+    p.saveState()
+    p.translate(x, y)
+    p.doForm(name)
+    p.restoreState()
+
+
+def render_prescription_pdf(data, row_forms=None):
+    """
+    Draw the prescription described by prescription_pdf_data() and return the
+    PDF bytes. row_forms forces the row grid on or off form XObjects (by
+    default they are used from ROW_FORM_MIN_ROWS rows up).
+    """
+    buffer = BytesIO()
+    # invariant: no timestamp or random id in the file, so equal data renders equal bytes
+    p = canvas.Canvas(buffer, pagesize=letter, invariant=1)
+    height = PAGE_HEIGHT
+
+    # Header band
+    p.setFillColorRGB(*BRAND_PURPLE)
+    p.rect(40, height - 70, PAGE_WIDTH - 80, 40, fill=1, stroke=0)
+    p.setFillColorRGB(1, 1, 1)
+    p.setFont("Helvetica-Bold", 18)
+    p.drawString(55, height - 45, "HealthConnect — Digital Prescription")
+
+    # Doctor Info
+    y = height - 100
+    p.setFont("Helvetica-Bold", 14)
+    p.drawString(100, y, f"Dr. {data['doctor_name']}")
+    y -= 20
+    p.setFont("Helvetica", 12)
+    p.drawString(100, y, f"Specialty: {data['doctor_specialty'] or 'General Medicine'}")
+    y -= 20
+    p.drawString(100, y, f"Email: {data['doctor_email']}")
+
+    # Patient Info
+    y -= 40
+    p.setFillColorRGB(*BRAND_BLUE)
+    p.setFont("Helvetica-Bold", 14)
+    p.drawString(100, y, "Patient Information")
+    y -= 20
+    p.setFillColorRGB(0, 0, 0)
+    p.setFont("Helvetica", 12)
+    p.drawString(100, y, f"Name: {data['patient_name']}")
+    y -= 20
+    p.drawString(100, y, f"Age: {data['age']} years")
+    if data['weight']:
+        y -= 20
+        p.drawString(100, y, f"Weight: {data['weight']} kg")
+    if data['height']:
+        y -= 20
+        p.drawString(100, y, f"Height: {data['height']} cm")
+    if data['gender']:
+        y -= 20
+        p.drawString(100, y, f"Gender: {data['gender']}")
+
+    # Diagnosis
+    if data['diagnosis']:
+        y -= 40
+        p.setFillColorRGB(*BRAND_BLUE)
+        p.setFont("Helvetica-Bold", 14)
+        p.drawString(100, y, "Diagnosis")
+        y -= 20
+        p.setFillColorRGB(0, 0, 0)
+        p.setFont("Helvetica", 12)
+        p.drawString(100, y, data['diagnosis'])
+
+    # Medications Table
+    y -= 40
+    p.setFillColorRGB(*BRAND_BLUE)
+    p.setFont("Helvetica-Bold", 14)
+    p.drawString(100, y, "Medications")
+    y -= 30
+
+    # Table header
+    table_top = y
+    p.setFillColorRGB(*BRAND_PURPLE)
+    p.rect(TABLE_LEFT, table_top - 20, TABLE_WIDTH, 25, fill=1, stroke=0)
+    p.setFillColorRGB(1, 1, 1)  # White text
+    p.setFont("Helvetica-Bold", 11)
+    for x, heading in zip(COL_STARTS, TABLE_HEADINGS):
+        p.drawString(x, table_top - 5, heading)
+    y = table_top - 25
+
+    # Rows: one form per row for the grid, and one text object per page for
+    # the cell text (drawn last, so text stays above the grid as before)
+    forms = set()
+    use_forms = len(data['medications']) >= ROW_FORM_MIN_ROWS if row_forms is None else row_forms
+    cells = p.beginText()
+    cells.setFont("Helvetica", 10)
+    cells.setFillColorRGB(0, 0, 0)
+    for idx, med in enumerate(data['medications'], 1):
+        if y < 120:
+            p.drawText(cells)
+            p.showPage()
+            cells = p.beginText()
+            cells.setFont("Helvetica", 10)
+            cells.setFillColorRGB(0, 0, 0)
+            y = height - 50
+
+        row_bottom = y - 18
+        if use_forms:
+            place_form(p, row_form(p, idx % 2 == 0, forms), TABLE_LEFT, row_bottom)
+        else:
+            draw_row_grid(p, idx % 2 == 0, TABLE_LEFT, row_bottom)
+
+        values = (str(idx), med['name'], med['dosage'], med['frequency'], med['duration'])
+        for x, value, limit in zip(COL_STARTS, values, COL_LIMITS):
+            cells.setTextOrigin(x, row_bottom + 5)
+            cells.textOut(value[:limit] if limit else value)
+
+        y = row_bottom - 2
+    p.drawText(cells)
+
+    # Notes
+    if data['notes']:
+        y -= 30
+        p.setFillColorRGB(*BRAND_BLUE)
+        p.setFont("Helvetica-Bold", 14)
+        p.drawString(100, y, "Notes")
+        y -= 20
+        p.setFillColorRGB(0, 0, 0)
+        p.setFont("Helvetica", 12)
+        notes_lines = data['notes'].split('\n')
+        for line in notes_lines:
+            if y < 100:
+                p.showPage()
+                y = height - 50
+            p.drawString(100, y, line)
+            y -= 15
+
+    # Footer
+    created_at = datetime.fromisoformat(data['created_at'])
+    y = 50
+    p.setFillColorRGB(*BRAND_PURPLE)
+    p.setFont("Helvetica-Bold", 10)
+    p.drawString(100, y, f"Prescribed on: {created_at.strftime('%B %d, %Y at %I:%M %p')}")
+    y -= 15
+    p.drawString(100, y, f"Approved by: Dr. {data['doctor_name']}")
+
+    p.save()
+    return buffer.getvalue()
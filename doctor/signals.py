@@ -0,0 +1,15 @@
+from django.dispatch import receiver
+from hello.outbox import emails_sent
+from .models import Prescription
+
+
+@receiver(emails_sent)
+def mark_prescriptions_sent(sender, messages, **kwargs):
+    """Flag prescriptions whose outbox email has been delivered"""
+    prescription_ids = [
+        int(message.reference.split(':', 1)[1])
+        for message in messages
+        if message.reference.startswith('prescription:')
+    ]
+    if prescription_ids:
+        Prescription.objects.filter(id__in=prescription_ids).update(sent_via_email=True)
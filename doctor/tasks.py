@@ -0,0 +1,33 @@
+from hello.models import OutgoingEmail
+from hello.tasks import PermanentTaskError, background_task
+from .models import Prescription
+
+
+def get_prescription(prescription_id):
+    try:
+        return Prescription.objects.select_related('doctor').get(id=prescription_id)
+    except Prescription.DoesNotExist:
+        raise PermanentTaskError(f"Prescription {prescription_id} no longer exists")
+
+
+@background_task
+def email_prescription(prescription_id):
+    """Render the prescription PDF and queue the patient email in the outbox"""
+    from .views import send_prescription_email
+
+    prescription = get_prescription(prescription_id)
+    # A retry after the email was already queued must not queue it twice
+    queued = OutgoingEmail.objects.filter(reference=f'prescription:{prescription.id}').first()
+    if queued is None:
+        queued = send_prescription_email(prescription)
+    if queued is None:
+        raise PermanentTaskError(f"Invalid patient email: {prescription.patient_email!r}")
+    return {'outbox_id': queued.id}
+
+
+@background_task
+def match_prescription(prescription_id):
+    """Link the prescription's medicines to the shops that stock them"""
+    from .views import match_prescription_medicines
+
+    return {'matches': match_prescription_medicines(get_prescription(prescription_id))}
@@ -1,3 +1,448 @@
-from django.test import TestCase
+import base64
+import csv
+import io
+import json
+import re
+import tempfile
+import zipfile
+import zlib
+from datetime import date, time, timedelta
+from unittest import mock
+from django.core import mail
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from hello.models import BackgroundTask
+from hello.outbox import send_outbox_batch
+from hello.tasks import run_pending_tasks
+from medicalshop.models import MedicalShop, Medicine, PrescriptionMedicineMatch
+from user.models import Appointment, User
+from .models import Doctor, Prescription
+from . import export, pdf
+from .appointments import FEEDS, appointment_feed
+from .views import match_prescription_medicines
 
-# Create your tests here.
+
+def use_temp_pdf_store(test):
+    store = tempfile.TemporaryDirectory()
+    test.addCleanup(store.cleanup)
+    override = test.settings(PRESCRIPTION_PDF_ROOT=store.name)
+    override.enable()
+    test.addCleanup(override.disable)
+
+
+class MatchPrescriptionMedicinesTests(TestCase):
+    def setUp(self):
+        self.doctor = Doctor.objects.create(name='Asha', email='asha@example.com')
+        self.stocked_names = ['Paracetamol 500 Tab', 'Amoxicillin 250mg', 'Cetirizine 10']
+
+    def add_shops(self, count):
+        start = MedicalShop.objects.count()
+        for i in range(start, start + count):
+            shop = MedicalShop.objects.create(
+                shop_name=f'Shop {i}', email=f'shop{i}@example.com', owner_name='Owner', location='Town'
+            )
+            for name in self.stocked_names:
+                Medicine.objects.create(shop=shop, name=name, quantity=5, price=10)
+
+    def prescribe(self):
+        return Prescription.objects.create(
+            doctor=self.doctor,
+            patient_name='Ravi',
+            patient_email='ravi@example.com',
+            age=40,
+            medications=[
+                {'name': 'Paracetamol 500mg'},
+                {'name': 'Amoxicillin'},
+                {'name': 'Cetirizine 10 tablet'},
+                {'name': 'Unknownol'},
+                {'name': ''},
+            ],
+        )
+
+    def count_match_queries(self, prescription):
+        """Return (SELECT count, INSERT count) issued while matching a prescription"""
+        with CaptureQueriesContext(connection) as queries:
+            match_prescription_medicines(prescription)
+        statements = [query['sql'].lstrip().upper() for query in queries]
+        selects = sum(1 for sql in statements if sql.startswith('SELECT'))
+        inserts = sum(1 for sql in statements if sql.startswith('INSERT'))
+        return selects, inserts
+
+    def test_matches_every_stocking_shop_once(self):
+        self.add_shops(3)
+        prescription = self.prescribe()
+
+        match_prescription_medicines(prescription)
+        match_prescription_medicines(prescription)
+
+        matches = PrescriptionMedicineMatch.objects.filter(prescription=prescription)
+        self.assertEqual(matches.count(), 9)
+        self.assertEqual(
+            set(matches.values_list('medicine_name', flat=True)),
+            {'Paracetamol 500mg', 'Amoxicillin', 'Cetirizine 10 tablet'},
+        )
+
+    def test_query_count_does_not_grow_with_shops(self):
+        fields = [field for field in PrescriptionMedicineMatch._meta.concrete_fields if not field.primary_key]
+        select_counts = []
+        for shops in (5, 50, 500):
+            self.add_shops(shops - MedicalShop.objects.count())
+            selects, inserts = self.count_match_queries(self.prescribe())
+            select_counts.append(selects)
+
+            # Writes are one INSERT for the reverse-matching index plus one bulk
+            # INSERT per database batch of matches, never one per match
+            rows = 3 * shops
+            batch_size = connection.ops.bulk_batch_size(fields, [None] * rows)
+            self.assertEqual(inserts, 1 + -(-rows // batch_size))
+
+        self.assertEqual(select_counts, [2, 2, 2])
+        # Shops added after a prescription reach it through reverse matching
+        self.assertEqual(PrescriptionMedicineMatch.objects.count(), 3 * 3 * 500)
+
+
+class ReverseMatchTests(TestCase):
+    def setUp(self):
+        doctor = Doctor.objects.create(name='Asha', email='asha@example.com')
+        self.shop = MedicalShop.objects.create(
+            shop_name='Corner', email='corner@example.com', owner_name='Owner', location='Town'
+        )
+        self.prescription = Prescription.objects.create(
+            doctor=doctor, patient_name='Ravi', patient_email='ravi@example.com', age=40,
+            medications=[{'name': 'Azithromycin'}, {'name': 'Dolo 650 tablet'}],
+        )
+        match_prescription_medicines(self.prescription)
+
+    def matched_names(self):
+        return set(
+            PrescriptionMedicineMatch.objects.filter(prescription=self.prescription)
+            .values_list('medicine__name', flat=True)
+        )
+
+    def test_new_stock_is_matched_to_open_prescriptions(self):
+        Medicine.objects.create(shop=self.shop, name='Azithromycin 500', quantity=3, price=50)
+        Medicine.objects.create(shop=self.shop, name='Dolo-650', quantity=3, price=30)
+        Medicine.objects.create(shop=self.shop, name='Dolo 500', quantity=3, price=30)
+
+        self.assertEqual(self.matched_names(), {'Azithromycin 500', 'Dolo-650'})
+
+    def test_restock_triggers_matching_but_empty_stock_does_not(self):
+        medicine = Medicine.objects.create(shop=self.shop, name='Azithromycin', quantity=0, price=50)
+        self.assertEqual(self.matched_names(), set())
+
+        medicine.quantity = 10
+        medicine.save()
+        self.assertEqual(self.matched_names(), {'Azithromycin'})
+
+
+class SavePrescriptionTests(TestCase):
+    def setUp(self):
+        use_temp_pdf_store(self)
+        self.doctor = Doctor.objects.create(name='Asha', email='asha@example.com')
+        shop = MedicalShop.objects.create(shop_name='Shop', email='shop@example.com', owner_name='Owner', location='Town')
+        Medicine.objects.create(shop=shop, name='Paracetamol 500mg', quantity=5, price=10)
+        session = self.client.session
+        session['doctor_id'] = self.doctor.id
+        session.save()
+
+    def save(self, patient_email='ravi@example.com'):
+        response = self.client.post('/save-prescription/', json.dumps({
+            'patient_name': 'Ravi',
+            'patient_email': patient_email,
+            'age': 40,
+            'medications': [{'name': 'Paracetamol 500mg'}],
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def status(self, prescription_id):
+        return self.client.get('/prescription-status/', {'prescription_id': prescription_id}).json()
+
+    def test_returns_before_email_and_matching(self):
+        data = self.save()
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertFalse(PrescriptionMedicineMatch.objects.exists())
+        self.assertEqual(self.status(data['prescription_id'])['email']['status'], 'pending')
+
+        self.assertEqual(run_pending_tasks('worker-a'), 2)
+
+        # Rendered and queued in the outbox, not sent yet
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(PrescriptionMedicineMatch.objects.count(), 1)
+        status = self.status(data['prescription_id'])
+        self.assertEqual(status['email']['status'], 'pending')
+        self.assertEqual(status['matching']['status'], BackgroundTask.DONE)
+
+        send_outbox_batch()
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].attachments[0][0], 'prescription.pdf')
+        status = self.status(data['prescription_id'])
+        self.assertTrue(status['email_sent'])
+        self.assertEqual(status['email']['status'], 'sent')
+
+    def test_invalid_address_fails_without_retrying(self):
+        data = self.save(patient_email='not-an-address')
+
+        run_pending_tasks('worker-a')
+
+        status = self.status(data['prescription_id'])
+        self.assertFalse(status['email_sent'])
+        self.assertEqual(status['email']['status'], 'failed')
+        self.assertEqual(status['email']['attempts'], 1)
+
+
+class DownloadPrescriptionTests(TestCase):
+    def setUp(self):
+        use_temp_pdf_store(self)
+        self.doctor = Doctor.objects.create(name='Asha', email='asha@example.com')
+        self.prescription = Prescription.objects.create(
+            doctor=self.doctor,
+            patient_name='Ravi',
+            patient_email='ravi@example.com',
+            age=40,
+            medications=[{'name': 'Paracetamol 500mg', 'dosage': '1 tab', 'frequency': 'twice', 'duration': '5 days'}],
+        )
+        session = self.client.session
+        session['doctor_id'] = self.doctor.id
+        session.save()
+
+    def download(self, **headers):
+        return self.client.get('/download-prescription/', {'prescription_id': self.prescription.id}, headers=headers)
+
+    def test_renders_once_and_revalidates_with_etag(self):
+        with mock.patch.object(pdf, 'render_prescription_pdf', wraps=pdf.render_prescription_pdf) as render:
+            first = self.download()
+            second = self.download()
+            not_modified = self.download(if_none_match=first['ETag'])
+
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.streaming)
+        self.assertEqual(first['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(first.streaming_content).startswith(b'%PDF'))
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_edit_changes_etag_and_rerenders(self):
+        first = self.download()
+        self.prescription.notes = 'Take after food'
+        self.prescription.save()
+
+        with mock.patch.object(pdf, 'render_prescription_pdf', wraps=pdf.render_prescription_pdf) as render:
+            second = self.download(if_none_match=first['ETag'])
+
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(render.call_count, 1)
+
+    def test_other_doctor_cannot_download(self):
+        other = Doctor.objects.create(name='Other', email='other@example.com')
+        session = self.client.session
+        session['doctor_id'] = other.id
+        session.save()
+
+        self.assertEqual(self.download().status_code, 404)
+
+
+@override_settings(PRESCRIPTION_EXPORT_BATCH_SIZE=2)
+class ExportPrescriptionsTests(TestCase):
+    def setUp(self):
+        use_temp_pdf_store(self)
+        self.doctor = Doctor.objects.create(name='Asha', email='asha@example.com')
+        other = Doctor.objects.create(name='Other', email='other@example.com')
+        for i in range(5):
+            Prescription.objects.create(
+                doctor=self.doctor, patient_name=f'Patient {i}', patient_email=f'p{i}@example.com', age=30 + i,
+                medications=[{'name': 'Paracetamol 500mg'}, {'name': 'Cetirizine 10'}],
+            )
+        Prescription.objects.create(doctor=other, patient_name='Not mine', patient_email='x@example.com', age=50)
+        session = self.client.session
+        session['doctor_id'] = self.doctor.id
+        session.save()
+
+    def test_streams_zip_of_pdfs_and_manifest(self):
+        response = self.client.get('/export-prescriptions/')
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        chunks = list(response.streaming_content)
+        # One piece per PDF rather than the archive in one go
+        self.assertGreaterEqual(len(chunks), 5)
+
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+        self.assertIsNone(archive.testzip())
+        names = archive.namelist()
+        self.assertEqual(names[-1], 'manifest.csv')
+        pdf_names = [name for name in names if name.endswith('.pdf')]
+        self.assertEqual(len(pdf_names), 5)
+        self.assertTrue(all(archive.read(name).startswith(b'%PDF') for name in pdf_names))
+
+        rows = list(csv.DictReader(io.StringIO(archive.read('manifest.csv').decode('utf-8'))))
+        self.assertEqual([row['patient_name'] for row in rows], [f'Patient {i}' for i in range(5)])
+        self.assertEqual([row['file'] for row in rows], pdf_names)
+        self.assertEqual(rows[0]['medications'], 'Paracetamol 500mg; Cetirizine 10')
+
+    def test_requires_doctor_session(self):
+        self.client.session.flush()
+        self.client.cookies.clear()
+
+        self.assertEqual(self.client.get('/export-prescriptions/').status_code, 401)
+
+    def test_manifest_matches_pdfs_when_prescriptions_change_mid_export(self):
+        chunks = []
+        pieces = export.prescription_archive(self.doctor.id, batch_size=2)
+        chunks.append(next(pieces))
+        # Written and edited after the export has started
+        last = Prescription.objects.filter(doctor=self.doctor).order_by('id').last()
+        Prescription.objects.filter(id=last.id).update(patient_name='Renamed')
+        Prescription.objects.create(
+            doctor=self.doctor, patient_name='Late', patient_email='late@example.com', age=20,
+            medications=[{'name': 'Ibuprofen 200mg'}],
+        )
+        chunks.extend(pieces)
+
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+        pdf_names = [name for name in archive.namelist() if name.endswith('.pdf')]
+        rows = list(csv.DictReader(io.StringIO(archive.read('manifest.csv').decode('utf-8'))))
+        self.assertEqual([row['file'] for row in rows], pdf_names)
+        for row in rows:
+            self.assertEqual(archive.read(row['file']), pdf.pdf_store_path(row['content_hash']).read_bytes())
+        self.assertEqual(rows[-2]['patient_name'], 'Renamed')
+        self.assertEqual(rows[-1]['patient_name'], 'Late')
+
+
+class RenderPrescriptionPdfsTests(TestCase):
+    def setUp(self):
+        use_temp_pdf_store(self)
+        doctor = Doctor.objects.create(name='Asha', email='asha@example.com')
+        for i in range(7):
+            Prescription.objects.create(
+                doctor=doctor, patient_name=f'Patient {i}', patient_email=f'p{i}@example.com', age=30 + i,
+                medications=[{'name': f'Medicine {j}'} for j in range(i)],
+            )
+
+    def test_renders_into_store_in_worker_processes(self):
+        prescriptions = Prescription.objects.select_related('doctor').order_by('id')
+
+        stats = pdf.render_prescription_pdfs(prescriptions, workers=2, chunk_size=3)
+
+        self.assertEqual((stats['rendered'], stats['skipped'], stats['failed']), (7, 0, 0))
+        for prescription in prescriptions:
+            digest = pdf.pdf_content_hash(pdf.prescription_pdf_data(prescription))
+            self.assertTrue(pdf.pdf_store_path(digest).read_bytes().startswith(b'%PDF'))
+
+        again = pdf.render_prescription_pdfs(prescriptions, workers=2, chunk_size=3)
+        self.assertEqual((again['rendered'], again['skipped']), (0, 7))
+
+
+def pdf_page_content(content):
+    """Decoded content streams (pages and forms) of a PDF rendered by reportlab"""
+    streams = re.findall(rb'stream\r?\n(.*?)endstream', content, re.S)
+    return b'\n'.join(zlib.decompress(base64.a85decode(stream.strip().removesuffix(b'~>'))) for stream in streams)
+
+
+class RenderPrescriptionPdfTests(TestCase):
+    def data(self, rows):
+        return {
+            'doctor_name': 'Asha', 'doctor_specialty': '', 'doctor_email': 'asha@example.com',
+            'patient_name': 'Ravi', 'age': 40, 'weight': None, 'height': None, 'gender': '',
+            'diagnosis': 'Fever', 'notes': '', 'created_at': '2026-01-01T10:00:00+00:00',
+            'medications': [
+                {'name': f'Medicine {i}', 'dosage': '500mg', 'frequency': 'Twice daily', 'duration': '5 days'}
+                for i in range(1, rows + 1)
+            ],
+        }
+
+    def test_row_grids_are_two_forms_reused_by_every_row_across_pages(self):
+        content = pdf.render_prescription_pdf(self.data(30))
+        drawn = pdf_page_content(content)
+
+        self.assertEqual(content.count(b'/Type /Page\n'), 2)
+        self.assertEqual(content.count(b'/Subtype /Form'), 2)
+        self.assertEqual(len(re.findall(rb'/FormXob\.row Do', drawn)), 15)
+        self.assertEqual(len(re.findall(rb'/FormXob\.row_shaded Do', drawn)), 15)
+        self.assertEqual(re.findall(rb'\((Medicine \d+)\) Tj', drawn), [f'Medicine {i}'.encode() for i in range(1, 31)])
+
+    def test_short_tables_draw_rows_directly_with_the_same_text(self):
+        short = pdf_page_content(pdf.render_prescription_pdf(self.data(3)))
+        with_forms = pdf_page_content(pdf.render_prescription_pdf(self.data(3), row_forms=True))
+
+        self.assertNotIn(b' Do', short)
+        self.assertEqual(re.findall(rb'\(([^)]*)\) Tj', short), re.findall(rb'\(([^)]*)\) Tj', with_forms))
+        self.assertEqual(pdf.render_prescription_pdf(self.data(3)), pdf.render_prescription_pdf(self.data(3)))
+
+
+@override_settings(DOCTOR_APPOINTMENTS_PAGE_SIZE=3)
+class AppointmentFeedTests(TestCase):
+    def setUp(self):
+        self.doctor = Doctor.objects.create(name='Asha', email='asha@example.com')
+        other = Doctor.objects.create(name='Vikram', email='vikram@example.com')
+        self.patient = User.objects.create(name='Ravi', email='ravi@example.com')
+        today = timezone.localdate()
+        for offset, status in [(-3, 'completed'), (-2, 'scheduled'), (-1, 'cancelled'), (0, 'scheduled'),
+                               (0, 'confirmed'), (1, 'scheduled'), (2, 'cancelled'), (5, 'confirmed'), (9, 'scheduled')]:
+            Appointment.objects.create(user=self.patient, doctor=self.doctor, appointment_date=today + timedelta(days=offset),
+                                       appointment_time=time(10 + offset % 3), status=status)
+        Appointment.objects.create(user=self.patient, doctor=other, appointment_date=today, appointment_time=time(9))
+        session = self.client.session
+        session['doctor_id'] = self.doctor.id
+        session.save()
+
+    def feed(self, **params):
+        appointments, cursor = [], None
+        while True:
+            data = self.client.get('/doctor-appointments/', {**params, **({'cursor': cursor} if cursor else {})}).json()
+            appointments += data['appointments']
+            cursor = data['next_cursor']
+            if not cursor:
+                return appointments
+
+    def test_dashboard_shows_the_first_page_of_today_and_upcoming(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/ddashboard/')
+
+        appointments = response.context['appointments']
+        today = timezone.localdate()
+        self.assertEqual([(a.appointment_date - today).days for a in appointments], [0, 0, 1])
+        self.assertTrue(response.context['next_cursor'])
+        # Session, doctor, one page of appointments with their patients per active status
+        self.assertEqual(len(queries), 4)
+
+    def test_feeds_page_through_upcoming_past_and_cancelled(self):
+        today = timezone.localdate()
+
+        def days(appointments):
+            return [(date.fromisoformat(a['date']) - today).days for a in appointments]
+
+        self.assertEqual(days(self.feed()), [0, 0, 1, 5, 9])
+        self.assertEqual(days(self.feed(feed='past')), [-2, -3])
+        self.assertEqual(days(self.feed(feed='cancelled')), [2, -1])
+        window = (today + timedelta(days=1)).isoformat(), (today + timedelta(days=5)).isoformat()
+        self.assertEqual(days(self.feed(start=window[0], end=window[1])), [1, 5])
+
+    def test_every_feed_pages_along_the_status_index(self):
+        today = timezone.localdate()
+        cursor = (today, time(10), 0)
+        with CaptureQueriesContext(connection) as queries:
+            for feed in FEEDS:
+                appointment_feed(self.doctor.id, feed, cursor=cursor)
+                appointment_feed(self.doctor.id, feed, start=today - timedelta(days=7), end=today + timedelta(days=7))
+
+        self.assertEqual(len(queries), 2 * (2 + 3 + 1))
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as explain:
+                for query in queries:
+                    explain.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                    plan = ' '.join(row[-1] for row in explain.fetchall())
+                    self.assertIn('USING INDEX user_appoin_doctor__6e9041_idx (doctor_id=? AND status=? AND appointment_date', plan)
+                    self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_bad_parameters_are_rejected(self):
+        for params in [{'feed': 'all'}, {'start': 'tomorrow'}, {'cursor': 'nope'}]:
+            self.assertEqual(self.client.get('/doctor-appointments/', params).status_code, 400)
+        self.client.cookies.clear()
+        self.assertEqual(self.client.get('/doctor-appointments/').status_code, 401)
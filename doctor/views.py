@@ -1,23 +1,26 @@
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.utils import timezone
-from django.db import IntegrityError, models
-from django.db.models import Case, When, Value, IntegerField
-from django.http import JsonResponse
+from django.db import IntegrityError, models, transaction
+from django.http import FileResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import ensure_csrf_cookie
-from django.core.mail import EmailMessage
 from django.template.loader import render_to_string
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
-from io import BytesIO
 import json
-from smtplib import SMTPException
+from asgiref.sync import sync_to_async
+from .appointments import FEEDS, appointment_feed, appointment_summary, decode_cursor
+from .export import prescription_archive
 from .models import Doctor, Prescription
+from .pdf import get_prescription_pdf, pdf_content_hash, prescription_pdf_data
+from .tasks import email_prescription, match_prescription
 from user.models import User
-from hello.models import LoginLog
+from hello.models import BackgroundTask, LoginLog, OutgoingEmail
+from hello.outbox import queue_email
+from hello.tasks import enqueue
 from medicalshop.models import Medicine, PrescriptionMedicineMatch
+from medicalshop.catalog import catalog_ids_for_names
+from medicalshop.matching import index_prescribed_medicines
 
 # Create your views here.
 def doctorLogin(request):
@@ -107,31 +110,36 @@ def doctorDashboard(request):
     except Doctor.DoesNotExist:
         return redirect('doctorLogin')
     
-    # Get appointments for this doctor
-    # Get appointments for this doctor
-    from user.models import Appointment
-    appointments = Appointment.objects.filter(doctor=doctor).annotate(
-        status_order=Case(
-            When(status='scheduled', then=Value(0)),
-            When(status='confirmed', then=Value(1)),
-            When(status='completed', then=Value(2)),
-            When(status='cancelled', then=Value(3)),
-            default=Value(4),
-            output_field=IntegerField(),
-        )
-    ).order_by('status_order', 'appointment_date', 'appointment_time')
+    # Get today's and upcoming appointments for this doctor; past and cancelled ones load on demand
+    appointments, next_cursor = appointment_feed(doctor.id)
     
     context = {
         'doctor_name': doctor_name,
         'doctor_specialty': doctor_specialty,
         'doctor_email': doctor_email,
         'appointments': appointments,
+        'next_cursor': next_cursor,
     }
     return render(request,"doctor.html", context)
 
+def create_prescription(doctor, user, fields, send_email):
+    """
+    Save a prescription together with its background tasks in one transaction.
+    The PDF, email and shop matching run in a background worker (`manage.py run_tasks`).
+    """
+    with transaction.atomic():
+        prescription = Prescription.objects.create(doctor=doctor, user=user, **fields)
+        reference = f'prescription:{prescription.id}'
+        email_task = None
+        if send_email:
+            email_task = enqueue(email_prescription, prescription.id, reference=reference)
+        enqueue(match_prescription, prescription.id, reference=reference)
+    return prescription, email_task
+
 @require_http_methods(["POST"])
-def savePrescription(request):
-    if 'doctor_id' not in request.session:
+async def savePrescription(request):
+    doctor_id = await request.session.aget('doctor_id')
+    if doctor_id is None:
         return JsonResponse({'error': 'Unauthorized'}, status=401)
     
     try:
@@ -139,300 +147,178 @@ def savePrescription(request):
             data = json.loads(request.body or b'{}')
         except json.JSONDecodeError:
             return JsonResponse({'error': 'Invalid JSON'}, status=400)
-        doctor_id = request.session.get('doctor_id')
-        doctor = Doctor.objects.get(id=doctor_id)
+        doctor = await Doctor.objects.aget(id=doctor_id)
         
-        patient_name = data.get('patient_name')
         patient_email = data.get('patient_email')
-        age = data.get('age')
-        weight = data.get('weight')
-        height = data.get('height')
-        gender = data.get('gender', '')
-        diagnosis = data.get('diagnosis', '')
-        notes = data.get('notes', '')
-        medications = data.get('medications', [])
+        fields = {
+            'patient_name': data.get('patient_name'),
+            'patient_email': patient_email,
+            'age': data.get('age'),
+            'weight': data.get('weight'),
+            'height': data.get('height'),
+            'gender': data.get('gender', ''),
+            'diagnosis': data.get('diagnosis', ''),
+            'notes': data.get('notes', ''),
+            'medications': data.get('medications', []),
+        }
         
         # Check if user exists
         user = None
         try:
-            user = User.objects.get(email=patient_email)
+            user = await User.objects.aget(email=patient_email)
         except User.DoesNotExist:
             pass
         
-        prescription = Prescription.objects.create(
-            doctor=doctor,
-            user=user,
-            patient_name=patient_name,
-            patient_email=patient_email,
-            age=age,
-            weight=weight,
-            height=height,
-            gender=gender,
-            diagnosis=diagnosis,
-            notes=notes,
-            medications=medications
-        )
-        
-        # Send email and PDF if requested
+        # Transactions are not available to async code, so the atomic save runs in a thread
         send_email = data.get('send_email', True)
-        email_sent = False
-        if send_email:
-            email_sent = send_prescription_email(prescription)
-        
-        # Match prescription medicines with medical shop medicines
-        match_prescription_medicines(prescription)
+        prescription, email_task = await sync_to_async(create_prescription)(doctor, user, fields, send_email)
         
-        if email_sent:
-            return JsonResponse({
-                'success': True, 
-                'prescription_id': prescription.id,
-                'message': 'Prescription saved and email sent successfully!'
-            })
-        else:
-            return JsonResponse({
-                'success': True, 
-                'prescription_id': prescription.id,
-                'message': 'Prescription saved but email sending failed. Please check email settings.',
-                'warning': True
-            })
+        return JsonResponse({
+            'success': True,
+            'prescription_id': prescription.id,
+            'email_task_id': email_task.id if email_task else None,
+            'message': 'Prescription saved. The email will be sent shortly.' if send_email else 'Prescription saved.'
+        })
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
-def send_prescription_email(prescription):
+@require_http_methods(["GET"])
+def prescriptionStatus(request):
+    """Progress of a saved prescription's background work, polled by the dashboard"""
+    if 'doctor_id' not in request.session:
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
+    
     try:
-        from django.conf import settings
-        
-        # Generate PDF first
-        pdf_buffer = generate_prescription_pdf(prescription)
-        
-        # Validate patient email
-        to_email = prescription.patient_email.strip() if prescription.patient_email else None
-        
-        if not to_email:
-            print("[EMAIL] ERROR: No patient email provided")
-            return False
-        
-        # Simple email validation
-        if '@' not in to_email or '.' not in to_email.split('@')[-1]:
-            print(f"[EMAIL] ERROR: Invalid email format: {to_email}")
-            return False
-        
-        print(f"[EMAIL] Sending prescription to: {to_email}")
-        
-        # Create simple email
-        subject = f'Your Prescription from Dr. {prescription.doctor.name}'
-        
-        text_body = f"Dear {prescription.patient_name},\n\nYour prescription is attached.\n\nBest regards,\nHealthConnect"
-        
-        # Create the email message
-        email = EmailMessage(
-            subject=subject,
-            body=text_body,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[to_email],
+        prescription = Prescription.objects.only('id', 'sent_via_email').get(
+            id=request.GET.get('prescription_id'), doctor_id=request.session['doctor_id']
         )
-        
-        # Attach PDF
-        if pdf_buffer:
-            pdf_content = pdf_buffer.getvalue()
-            email.attach('prescription.pdf', pdf_content, 'application/pdf')
-            print(f"[EMAIL] PDF attached: {len(pdf_content)} bytes")
-        
-        # Send email
-        print(f"[EMAIL] Calling email.send()...")
-        result = email.send(fail_silently=False)
-        print(f"[EMAIL] Email send returned: {result}")
-        
-        if result > 0:
-            prescription.sent_via_email = True
-            prescription.save()
-            print(f"[EMAIL] SUCCESS: Email sent to {to_email}")
-            return True
-        else:
-            print(f"[EMAIL] ERROR: email.send() returned {result}")
-            return False
-            
-    except SMTPException as smtp_error:
-        print(f"[EMAIL] SMTP ERROR: {smtp_error}")
-        return False
-    except Exception as e:
-        print(f"[EMAIL] ERROR: {type(e).__name__}: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
-
-def generate_prescription_pdf(prescription):
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    
-    # Colors
-    brand_blue = (37/255, 117/255, 252/255)
-    brand_purple = (106/255, 17/255, 203/255)
-    brand_yellow = (1, 0.9, 0.0)
-    light_gray = (0.96, 0.96, 0.98)
-    border_gray = (0.8, 0.8, 0.85)
-
-    # Header band
-    p.setFillColorRGB(*brand_purple)
-    p.rect(40, height - 70, width - 80, 40, fill=1, stroke=0)
-    p.setFillColorRGB(1, 1, 1)
-    p.setFont("Helvetica-Bold", 18)
-    p.drawString(55, height - 45, "HealthConnect — Digital Prescription")
-    
-    # Doctor Info
-    y = height - 100
-    p.setFont("Helvetica-Bold", 14)
-    p.drawString(100, y, f"Dr. {prescription.doctor.name}")
-    y -= 20
-    p.setFont("Helvetica", 12)
-    p.drawString(100, y, f"Specialty: {prescription.doctor.specialty or 'General Medicine'}")
-    y -= 20
-    p.drawString(100, y, f"Email: {prescription.doctor.email}")
-    
-    # Patient Info
-    y -= 40
-    p.setFillColorRGB(*brand_blue)
-    p.setFont("Helvetica-Bold", 14)
-    p.drawString(100, y, "Patient Information")
-    y -= 20
-    p.setFillColorRGB(0, 0, 0)
-    p.setFont("Helvetica", 12)
-    p.drawString(100, y, f"Name: {prescription.patient_name}")
-    y -= 20
-    p.drawString(100, y, f"Age: {prescription.age} years")
-    if prescription.weight:
-        y -= 20
-        p.drawString(100, y, f"Weight: {prescription.weight} kg")
-    if prescription.height:
-        y -= 20
-        p.drawString(100, y, f"Height: {prescription.height} cm")
-    if prescription.gender:
-        y -= 20
-        p.drawString(100, y, f"Gender: {prescription.gender}")
+    except (Prescription.DoesNotExist, ValueError):
+        return JsonResponse({'error': 'Prescription not found'}, status=404)
     
-    # Diagnosis
-    if prescription.diagnosis:
-        y -= 40
-        p.setFillColorRGB(*brand_blue)
-        p.setFont("Helvetica-Bold", 14)
-        p.drawString(100, y, "Diagnosis")
-        y -= 20
-        p.setFillColorRGB(0, 0, 0)
-        p.setFont("Helvetica", 12)
-        p.drawString(100, y, prescription.diagnosis)
+    tasks = {
+        task.name: task
+        for task in BackgroundTask.objects.filter(reference=f'prescription:{prescription.id}').order_by('id')
+    }
     
-    # Medications Table
-    y -= 40
-    p.setFillColorRGB(*brand_blue)
-    p.setFont("Helvetica-Bold", 14)
-    p.drawString(100, y, "Medications")
-    y -= 30
+    def task_state(func):
+        task = tasks.get(func.task_name)
+        if task is None:
+            return None
+        return {
+            'id': task.id,
+            'status': task.status,
+            'attempts': task.attempts,
+            'error': task.last_error.strip().splitlines()[-1] if task.last_error else None,
+        }
     
-    # Table header with borders
-    table_top = y
-    table_left = 100
-    col_widths = [50, 200, 100, 120, 100]  # S.No., Medication, Dosage, Frequency, Duration
-    table_width = sum(col_widths)
+    # The email task only renders and queues the message; delivery is tracked in the outbox
+    email = task_state(email_prescription)
+    outgoing = OutgoingEmail.objects.filter(reference=f'prescription:{prescription.id}').order_by('-id').first()
+    if outgoing is not None:
+        email = {
+            'id': outgoing.id,
+            'status': {OutgoingEmail.SENT: 'sent', OutgoingEmail.DEAD: 'failed'}.get(outgoing.status, 'pending'),
+            'attempts': outgoing.attempts,
+            'error': outgoing.last_error or None,
+        }
+    elif email is not None:
+        email['status'] = 'failed' if email['status'] == BackgroundTask.FAILED else 'pending'
     
-    # Draw header background
-    p.setFillColorRGB(*brand_purple)
-    p.rect(table_left, table_top - 20, table_width, 25, fill=1, stroke=0)
+    return JsonResponse({
+        'prescription_id': prescription.id,
+        'email_sent': prescription.sent_via_email,
+        'email': email,
+        'matching': task_state(match_prescription),
+    })
+
+def send_prescription_email(prescription):
+    """
+    Render the prescription PDF and put the email in the outbox, which
+    delivers it in batches (`manage.py send_outbox`). Returns the queued
+    OutgoingEmail, or None when the patient address is missing or malformed.
+    """
+    # Validate patient email
+    to_email = prescription.patient_email.strip() if prescription.patient_email else None
     
-    # Header text
-    p.setFillColorRGB(1, 1, 1)  # White text
-    p.setFont("Helvetica-Bold", 11)
-    x_pos = table_left + 5
-    p.drawString(x_pos, table_top - 5, "S.No.")
-    x_pos += col_widths[0]
-    p.drawString(x_pos, table_top - 5, "Medication")
-    x_pos += col_widths[1]
-    p.drawString(x_pos, table_top - 5, "Dosage")
-    x_pos += col_widths[2]
-    p.drawString(x_pos, table_top - 5, "Frequency")
-    x_pos += col_widths[3]
-    p.drawString(x_pos, table_top - 5, "Duration")
+    if not to_email:
+        print("[EMAIL] ERROR: No patient email provided")
+        return None
     
-    y = table_top - 25
+    # Simple email validation
+    if '@' not in to_email or '.' not in to_email.split('@')[-1]:
+        print(f"[EMAIL] ERROR: Invalid email format: {to_email}")
+        return None
     
-    # Draw table rows with borders
-    p.setFillColorRGB(0, 0, 0)  # Black text
-    p.setFont("Helvetica", 10)
+    # Rendered once per distinct prescription contents, then reused from the PDF store
+    digest, pdf_path = get_prescription_pdf(prescription)
+    attachments = [('prescription.pdf', pdf_path.read_bytes(), 'application/pdf')]
     
-    for idx, med in enumerate(prescription.medications, 1):
-        if y < 120:
-            p.showPage()
-            y = height - 50
-            table_top = y + 20
-        
-        row_bottom = y - 18
-        
-        # Alternate row color
-        if idx % 2 == 0:
-            p.setFillColorRGB(*light_gray)
-            p.rect(table_left, row_bottom, table_width, 20, fill=1, stroke=0)
-        
-        # Draw borders
-        p.setStrokeColorRGB(*border_gray)
-        p.setLineWidth(1)
-        # Top border
-        p.line(table_left, y, table_left + table_width, y)
-        # Bottom border
-        p.line(table_left, row_bottom, table_left + table_width, row_bottom)
-        # Vertical borders
-        x_pos = table_left
-        for width in col_widths:
-            x_pos += width
-            p.line(x_pos, y, x_pos, row_bottom)
-        
-        # Draw cell content
-        p.setFillColorRGB(0, 0, 0)
-        x_pos = table_left + 5
-        p.drawString(x_pos, row_bottom + 5, str(idx))
-        x_pos += col_widths[0]
-        p.drawString(x_pos, row_bottom + 5, med.get('name', '')[:30])  # Limit length
-        x_pos += col_widths[1]
-        p.drawString(x_pos, row_bottom + 5, med.get('dosage', '')[:15])
-        x_pos += col_widths[2]
-        p.drawString(x_pos, row_bottom + 5, med.get('frequency', '')[:18])
-        x_pos += col_widths[3]
-        p.drawString(x_pos, row_bottom + 5, med.get('duration', '')[:15])
-        
-        y = row_bottom - 2
+    outgoing = queue_email(
+        subject=f'Your Prescription from Dr. {prescription.doctor.name}',
+        body=f"Dear {prescription.patient_name},\n\nYour prescription is attached.\n\nBest regards,\nHealthConnect",
+        to=[to_email],
+        attachments=attachments,
+        reference=f'prescription:{prescription.id}',
+    )
+    print(f"[EMAIL] Prescription email to {to_email} queued as #{outgoing.id}")
+    return outgoing
+
+@require_http_methods(["GET"])
+def downloadPrescription(request):
+    """
+    Serve a prescription PDF to its doctor or patient. The ETag is the hash
+    of the prescription contents, so unchanged prescriptions revalidate with
+    a 304 and the stored PDF is only re-rendered after an edit.
+    """
+    prescription_id = request.GET.get('prescription_id')
+    prescriptions = Prescription.objects.select_related('doctor')
+    if 'doctor_id' in request.session:
+        prescriptions = prescriptions.filter(doctor_id=request.session['doctor_id'])
+    elif 'user_id' in request.session:
+        prescriptions = prescriptions.filter(
+            models.Q(user_id=request.session['user_id']) | models.Q(patient_email=request.session.get('user_email'))
+        )
+    else:
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
     
-    # Notes
-    if prescription.notes:
-        y -= 30
-        p.setFillColorRGB(*brand_blue)
-        p.setFont("Helvetica-Bold", 14)
-        p.drawString(100, y, "Notes")
-        y -= 20
-        p.setFillColorRGB(0, 0, 0)
-        p.setFont("Helvetica", 12)
-        notes_lines = prescription.notes.split('\n')
-        for line in notes_lines:
-            if y < 100:
-                p.showPage()
-                y = height - 50
-            p.drawString(100, y, line)
-            y -= 15
+    try:
+        prescription = prescriptions.get(id=prescription_id)
+    except (Prescription.DoesNotExist, ValueError):
+        return JsonResponse({'error': 'Prescription not found'}, status=404)
     
-    # Footer
-    y = 50
-    p.setFillColorRGB(*brand_purple)
-    p.setFont("Helvetica-Bold", 10)
-    p.drawString(100, y, f"Prescribed on: {prescription.created_at.strftime('%B %d, %Y at %I:%M %p')}")
-    y -= 15
-    p.drawString(100, y, f"Approved by: Dr. {prescription.doctor.name}")
+    etag = quote_etag(pdf_content_hash(prescription_pdf_data(prescription)))
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        digest, path = get_prescription_pdf(prescription)
+        response = FileResponse(
+            open(path, 'rb'),
+            as_attachment=True,
+            filename=f'prescription_{prescription.id}.pdf',
+            content_type='application/pdf',
+        )
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@require_http_methods(["GET"])
+def exportPrescriptions(request):
+    """Stream the doctor's whole prescription archive (PDFs plus manifest.csv) as a ZIP"""
+    if 'doctor_id' not in request.session:
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
     
-    p.save()
-    buffer.seek(0)
-    return buffer
+    doctor_id = request.session['doctor_id']
+    response = StreamingHttpResponse(prescription_archive(doctor_id), content_type='application/zip')
+    response['Content-Disposition'] = (
+        f'attachment; filename="prescriptions_{doctor_id}_{timezone.now():%Y%m%d}.zip"'
+    )
+    return response
 
 @require_http_methods(["POST"])
-def updateAppointment(request):
+async def updateAppointment(request):
     """Update appointment status (accept/reject/complete)"""
-    if 'doctor_id' not in request.session:
+    doctor_id = await request.session.aget('doctor_id')
+    if doctor_id is None:
         return JsonResponse({'error': 'Unauthorized'}, status=401)
     
     try:
@@ -450,15 +336,16 @@ def updateAppointment(request):
             return JsonResponse({'error': 'Invalid status'}, status=400)
         
         from user.models import Appointment
-        appointment = Appointment.objects.get(id=appointment_id, doctor_id=request.session.get('doctor_id'))
+        # doctor and user are needed for the confirmation email
+        appointment = await Appointment.objects.select_related('doctor', 'user').aget(id=appointment_id, doctor_id=doctor_id)
         
         old_status = appointment.status
         appointment.status = status
-        appointment.save()
+        await appointment.asave()
         
         # Send email to user when appointment is accepted
         if status == 'confirmed' and old_status == 'scheduled':
-            send_appointment_confirmation_email(appointment)
+            await sync_to_async(send_appointment_confirmation_email)(appointment)
             message = 'Appointment accepted and confirmation email sent to patient!'
         elif status == 'cancelled':
             message = 'Appointment cancelled successfully!'
@@ -476,20 +363,51 @@ def updateAppointment(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+@require_http_methods(["GET"])
+async def doctorAppointments(request):
+    """
+    A page of the doctor's appointments:
+    GET ?feed=upcoming|past|cancelled&start=<YYYY-MM-DD>&end=<YYYY-MM-DD>&cursor=<next_cursor>&limit=<n>
+    """
+    doctor_id = await request.session.aget('doctor_id')
+    if doctor_id is None:
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
+    
+    from datetime import date
+    from django.conf import settings
+    try:
+        feed = request.GET.get('feed', 'upcoming')
+        if feed not in FEEDS:
+            raise ValueError(f"feed must be one of: {', '.join(FEEDS)}")
+        start, end = (request.GET.get(name) for name in ('start', 'end'))
+        start = date.fromisoformat(start) if start else None
+        end = date.fromisoformat(end) if end else None
+        cursor = request.GET.get('cursor')
+        cursor = decode_cursor(cursor) if cursor else None
+        limit = min(max(int(request.GET.get('limit', settings.DOCTOR_APPOINTMENTS_PAGE_SIZE)), 1), 100)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    appointments, next_cursor = await sync_to_async(appointment_feed)(doctor_id, feed, start, end, cursor, limit)
+    
+    return JsonResponse({
+        'success': True,
+        'feed': feed,
+        'appointments': [appointment_summary(appointment) for appointment in appointments],
+        'next_cursor': next_cursor,
+    })
+
 def send_appointment_confirmation_email(appointment):
-    """Send confirmation email to user when appointment is accepted"""
+    """Queue a confirmation email to the user when the appointment is accepted"""
     try:
-        from django.core.mail import EmailMessage
         from myproject.config import EMAIL_FROM_ADDRESS
         from_email = EMAIL_FROM_ADDRESS
     except ImportError:
         from django.conf import settings
-        from django.core.mail import EmailMessage
         from_email = settings.EMAIL_HOST_USER or ''
     
-    try:
-        subject = f'Appointment Confirmed with Dr. {appointment.doctor.name}'
-        message = f'''
+    subject = f'Appointment Confirmed with Dr. {appointment.doctor.name}'
+    message = f'''
 Dear {appointment.user.name},
 
 Your appointment has been confirmed!
@@ -505,41 +423,49 @@ Please arrive on time for your appointment.
 Best regards,
 HealthConnect Team
         '''
-        
-        email = EmailMessage(
-            subject,
-            message,
-            from_email,
-            [appointment.user.email],
-        )
-        email.send()
-        return True
-    except Exception as e:
-        print(f"Error sending appointment confirmation email: {e}")
-        return False
+    
+    return queue_email(subject, message, [appointment.user.email], from_email=from_email, reference=f'appointment:{appointment.id}')
 
 def match_prescription_medicines(prescription):
-    """Match prescription medicines with available medicines in medical shops"""
-    from medicalshop.models import MedicalShop
+    """
+    Match prescription medicines with available medicines in medical shops.
     
-    medications = prescription.medications or []
+    All medication names are resolved to catalog ids in one query, every
+    stocking Medicine row is read in one more, and the matches are written
+    with a single bulk insert that skips rows the unique constraint already
+    has, so the query count does not grow with the number of shops. The
+    lines are also recorded for reverse matching (see medicalshop.matching).
+    """
+    names = [med.get('name', '').strip() for med in prescription.medications or []]
+    names = [name for name in names if name]
+    if not names:
+        return 0
     
-    for med in medications:
-        med_name = med.get('name', '').strip().lower()
-        if not med_name:
-            continue
-        
-        # Search for medicines in all shops (case-insensitive partial match)
-        all_medicines = Medicine.objects.filter(
-            name__icontains=med_name
-        ).select_related('shop')
-        
-        for medicine in all_medicines:
-            # Create match record
-            PrescriptionMedicineMatch.objects.get_or_create(
-                prescription=prescription,
-                medicine=medicine,
-                medicine_name=med.get('name', ''),
-                shop=medicine.shop,
-                defaults={'notified': False}
-            )
\ No newline at end of file
+    # Index the lines so inventory stocked later can find this prescription
+    index_prescribed_medicines(prescription, names)
+    
+    # The first prescribed line that resolves to a catalog entry names its matches
+    line_for_catalog = {}
+    resolved = catalog_ids_for_names(names)
+    for name in names:
+        for catalog_id in resolved[name]:
+            line_for_catalog.setdefault(catalog_id, name)
+    if not line_for_catalog:
+        return 0
+    
+    stocked = Medicine.objects.filter(
+        catalog_id__in=line_for_catalog
+    ).values_list('id', 'shop_id', 'catalog_id')
+    
+    matches = [
+        PrescriptionMedicineMatch(
+            prescription=prescription,
+            medicine_id=medicine_id,
+            medicine_name=line_for_catalog[catalog_id],
+            shop_id=shop_id,
+            notified=False,
+        )
+        for medicine_id, shop_id, catalog_id in stocked
+    ]
+    PrescriptionMedicineMatch.objects.bulk_create(matches, ignore_conflicts=True)
+    return len(matches)
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import LoginLog
+from django.utils import timezone
+from .models import BackgroundTask, LoginLog, OutgoingEmail, TokenBucket
 
 # Register your models here.
 @admin.register(LoginLog)
@@ -8,3 +9,34 @@ class LoginLogAdmin(admin.ModelAdmin):
     list_filter = ('user_type', 'success', 'login_time')
     search_fields = ('email',)
     readonly_fields = ('login_time',)
+
+
+@admin.register(BackgroundTask)
+class BackgroundTaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'reference', 'status', 'attempts', 'max_attempts', 'run_after', 'created_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'reference')
+    readonly_fields = ('created_at', 'finished_at', 'locked_by', 'locked_at')
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'destination', 'reference', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status', 'destination')
+    search_fields = ('subject', 'reference', 'destination')
+    readonly_fields = ('created_at', 'sent_at', 'locked_by', 'locked_at')
+    exclude = ('attachments',)
+    actions = ['requeue']
+
+    @admin.action(description="Requeue selected dead letters")
+    def requeue(self, request, queryset):
+        requeued = queryset.filter(status=OutgoingEmail.DEAD).update(
+            status=OutgoingEmail.QUEUED, attempts=0, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f"Requeued {requeued} email(s)")
+
+
+@admin.register(TokenBucket)
+class TokenBucketAdmin(admin.ModelAdmin):
+    list_display = ('key', 'tokens', 'refilled_at')
+    search_fields = ('key',)
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class HelloConfig(AppConfig):
     name = 'hello'
+
+    def ready(self):
+        # Register every app's @background_task functions so workers can run them by name
+        from django.utils.module_loading import autodiscover_modules
+        autodiscover_modules('tasks')
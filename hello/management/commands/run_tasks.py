@@ -0,0 +1,31 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from hello.tasks import run_pending_tasks, worker_name
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks (prescription emails, medicine matching, ...)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the due tasks and exit instead of polling")
+        parser.add_argument('--poll-interval', type=float, default=None, help="Seconds to sleep when the queue is empty")
+
+    def handle(self, *args, **options):
+        worker = worker_name()
+        poll_interval = options['poll_interval'] or settings.TASK_POLL_INTERVAL
+        self.stdout.write(f"Task worker {worker} started")
+
+        try:
+            while True:
+                close_old_connections()
+                ran = run_pending_tasks(worker)
+                if ran:
+                    self.stdout.write(f"Ran {ran} task(s)")
+                if options['once']:
+                    break
+                if not ran:
+                    time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            self.stdout.write("Task worker stopped")
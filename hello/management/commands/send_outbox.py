@@ -0,0 +1,35 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from hello.outbox import send_outbox_batch
+from hello.tasks import worker_name
+
+
+class Command(BaseCommand):
+    help = "Deliver queued outbox emails in batches over one SMTP connection per batch"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Send the due emails and exit instead of polling")
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--poll-interval', type=float, default=None, help="Seconds to sleep when nothing was sent")
+
+    def handle(self, *args, **options):
+        worker = worker_name()
+        poll_interval = options['poll_interval'] or settings.EMAIL_OUTBOX_POLL_INTERVAL
+        self.stdout.write(f"Outbox sender {worker} started")
+
+        try:
+            while True:
+                close_old_connections()
+                counts = send_outbox_batch(options['batch_size'], worker)
+                if any(counts.values()):
+                    self.stdout.write(
+                        f"Sent {counts['sent']}, deferred {counts['deferred']}, failed {counts['failed']}"
+                    )
+                if not counts['sent'] and not counts['failed']:
+                    if options['once']:
+                        break
+                    time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            self.stdout.write("Outbox sender stopped")
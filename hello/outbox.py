@@ -0,0 +1,177 @@
+import base64
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Count, Min
+from django.dispatch import Signal
+from django.utils import timezone
+from .models import OutgoingEmail
+from .tasks import worker_name
+
+
+# Sent once per batch with the OutgoingEmail rows that were just delivered
+emails_sent = Signal()
+
+
+def destination_of(address):
+    return address.rsplit('@', 1)[-1].strip().lower()
+
+
+def queue_email(subject, body, to, from_email=None, attachments=(), reference=''):
+    """
+    Put an email in the outbox instead of sending it inline.
+    `attachments` is an iterable of (filename, content bytes, mimetype).
+    """
+    to = [to] if isinstance(to, str) else list(to)
+    return OutgoingEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email if from_email is not None else settings.DEFAULT_FROM_EMAIL,
+        to=to,
+        attachments=[
+            {'filename': filename, 'mimetype': mimetype, 'content': base64.b64encode(content).decode('ascii')}
+            for filename, content, mimetype in attachments
+        ],
+        destination=destination_of(to[0]),
+        reference=reference,
+        next_attempt_at=timezone.now(),
+    )
+
+
+def build_message(outgoing, connection):
+    message = EmailMessage(
+        subject=outgoing.subject,
+        body=outgoing.body,
+        from_email=outgoing.from_email or None,
+        to=outgoing.to,
+        connection=connection,
+    )
+    for attachment in outgoing.attachments:
+        message.attach(attachment['filename'], base64.b64decode(attachment['content']), attachment['mimetype'])
+    return message
+
+
+def retry_delay(attempts):
+    """Exponential backoff: EMAIL_RETRY_DELAY, 2x, 4x, ... capped at EMAIL_RETRY_MAX_DELAY seconds"""
+    return min(settings.EMAIL_RETRY_DELAY * 2 ** (attempts - 1), settings.EMAIL_RETRY_MAX_DELAY)
+
+
+def claim_batch(worker, batch_size):
+    """Claim up to batch_size due messages; rows left 'sending' by a dead sender are reclaimed first"""
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=settings.EMAIL_OUTBOX_LOCK_TIMEOUT)
+    OutgoingEmail.objects.filter(status=OutgoingEmail.SENDING, locked_at__lt=stale_before).update(
+        status=OutgoingEmail.QUEUED, locked_by='', locked_at=None
+    )
+
+    due_ids = list(
+        OutgoingEmail.objects.filter(status=OutgoingEmail.QUEUED, next_attempt_at__lte=now)
+        .order_by('next_attempt_at', 'id')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    # Conditional on status, so rows another sender claimed in between are skipped
+    OutgoingEmail.objects.filter(id__in=due_ids, status=OutgoingEmail.QUEUED).update(
+        status=OutgoingEmail.SENDING, locked_by=worker, locked_at=now
+    )
+    return list(
+        OutgoingEmail.objects.filter(id__in=due_ids, status=OutgoingEmail.SENDING, locked_by=worker).order_by('id')
+    )
+
+
+def destination_windows(destinations, now):
+    """Per destination: (messages sent in the current rate window, when the oldest of them leaves it)"""
+    window = timedelta(seconds=settings.EMAIL_DESTINATION_WINDOW)
+    rows = (
+        OutgoingEmail.objects.filter(status=OutgoingEmail.SENT, destination__in=destinations, sent_at__gte=now - window)
+        .values('destination')
+        .annotate(sent=Count('id'), oldest=Min('sent_at'))
+    )
+    return {row['destination']: [row['sent'], row['oldest'] + window] for row in rows}
+
+
+def record_failure(outgoing, error, now):
+    outgoing.attempts += 1
+    outgoing.last_error = f"{type(error).__name__}: {error}"
+    outgoing.locked_by = ''
+    outgoing.locked_at = None
+    if outgoing.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+        outgoing.status = OutgoingEmail.DEAD
+        print(f"[OUTBOX] Dead letter #{outgoing.id} to {outgoing.to} after {outgoing.attempts} attempts: {error}")
+    else:
+        outgoing.status = OutgoingEmail.QUEUED
+        outgoing.next_attempt_at = now + timedelta(seconds=retry_delay(outgoing.attempts))
+        print(f"[OUTBOX] Send #{outgoing.id} failed (attempt {outgoing.attempts}), retrying at {outgoing.next_attempt_at}: {error}")
+    outgoing.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at', 'locked_by', 'locked_at'])
+
+
+def send_outbox_batch(batch_size=None, worker=None):
+    """
+    Deliver one batch of due outbox messages over a single SMTP connection.
+    Destinations that already used their EMAIL_DESTINATION_RATE for the
+    current window are deferred (not counted as an attempt); failed sends
+    back off exponentially and become dead letters after EMAIL_MAX_ATTEMPTS.
+    Returns a dict of counts.
+    """
+    worker = worker or worker_name()
+    batch = claim_batch(worker, batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE)
+    counts = {'sent': 0, 'deferred': 0, 'failed': 0}
+    if not batch:
+        return counts
+
+    now = timezone.now()
+    windows = destination_windows({outgoing.destination for outgoing in batch}, now)
+    # A window opened by this batch reopens one full window from now
+    next_window = now + timedelta(seconds=settings.EMAIL_DESTINATION_WINDOW)
+    to_send = []
+    for outgoing in batch:
+        sent, reopens_at = windows.setdefault(outgoing.destination, [0, next_window])
+        if sent >= settings.EMAIL_DESTINATION_RATE:
+            OutgoingEmail.objects.filter(id=outgoing.id).update(
+                status=OutgoingEmail.QUEUED, next_attempt_at=reopens_at, locked_by='', locked_at=None
+            )
+            counts['deferred'] += 1
+            continue
+        windows[outgoing.destination][0] += 1
+        to_send.append(outgoing)
+
+    delivered = []
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        for outgoing in to_send:
+            record_failure(outgoing, e, now)
+        counts['failed'] += len(to_send)
+        return counts
+
+    try:
+        for outgoing in to_send:
+            try:
+                if not connection.send_messages([build_message(outgoing, connection)]):
+                    raise RuntimeError("Message was not accepted for delivery")
+            except Exception as e:
+                record_failure(outgoing, e, timezone.now())
+                counts['failed'] += 1
+                # The server may have dropped us; later messages get a fresh connection
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    pass
+            else:
+                # Recorded right away: if the worker dies later in the batch this
+                # message must not be sent again when its lock times out
+                outgoing.status = OutgoingEmail.SENT
+                outgoing.sent_at = timezone.now()
+                OutgoingEmail.objects.filter(id=outgoing.id).update(
+                    status=OutgoingEmail.SENT, sent_at=outgoing.sent_at, last_error='', locked_by='', locked_at=None
+                )
+                delivered.append(outgoing)
+    finally:
+        connection.close()
+
+    if delivered:
+        counts['sent'] = len(delivered)
+        print(f"[OUTBOX] Sent {len(delivered)} email(s) over one connection")
+        emails_sent.send(sender=OutgoingEmail, messages=delivered)
+    return counts
@@ -0,0 +1,66 @@
+import math
+import time
+from django.db import IntegrityError
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Greatest, Least
+from .models import TokenBucket
+
+
+def take_token(key, rate, capacity, now=None):
+    """
+    Take one token from the bucket `key`, which refills at `rate` tokens per
+    second up to `capacity`. Returns (allowed, seconds until a token is free).
+
+    Refill, check and decrement happen in one conditional UPDATE, so
+    concurrent requests in any number of processes cannot overdraw the
+    bucket, and a request that is over the limit never waits.
+    """
+    now = time.time() if now is None else now
+    # A request that read the clock before a concurrent one refilled the
+    # bucket sees no elapsed time, rather than a negative refill
+    elapsed = Greatest(Value(now, output_field=FloatField()) - F('refilled_at'), Value(0.0))
+    available = Least(Value(float(capacity)), F('tokens') + elapsed * Value(float(rate)))
+
+    tokens = 0
+    for _ in range(2):
+        taken = TokenBucket.objects.filter(key=key, tokens__gte=Value(1.0) - elapsed * Value(float(rate))).update(
+            tokens=available - Value(1.0), refilled_at=Greatest(F('refilled_at'), Value(now, output_field=FloatField()))
+        )
+        if taken:
+            return True, 0
+
+        bucket = TokenBucket.objects.filter(key=key).first()
+        if bucket is None:
+            try:
+                TokenBucket.objects.create(key=key, tokens=capacity - 1, refilled_at=now)
+                return True, 0
+            except IntegrityError:
+                # Another process created it first; take from that bucket instead
+                continue
+
+        tokens = min(capacity, bucket.tokens + max(0, now - bucket.refilled_at) * rate)
+        if tokens < 1:
+            break
+        # The bucket was created by a concurrent request after our UPDATE ran; take from it once more
+    return False, max(0, (1 - tokens) / rate)
+
+
+def return_token(key, capacity):
+    """Give back a token taken for a request that was rejected by another limit"""
+    TokenBucket.objects.filter(key=key).update(tokens=Least(Value(float(capacity)), F('tokens') + Value(1.0)))
+
+
+def take_tokens(limits, now=None):
+    """
+    Take a token from every (key, rate, capacity) bucket in `limits`, or from
+    none of them. Returns (allowed, Retry-After seconds rounded up).
+    """
+    taken = []
+    for key, rate, capacity in limits:
+        allowed, retry_after = take_token(key, rate, capacity, now)
+        if not allowed:
+            for taken_key, taken_capacity in taken:
+                return_token(taken_key, taken_capacity)
+            return False, max(1, math.ceil(retry_after))
+        taken.append((key, capacity))
+    return True, 0
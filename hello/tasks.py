@@ -0,0 +1,149 @@
+import os
+import socket
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from .models import BackgroundTask
+
+
+TASK_REGISTRY = {}
+
+
+class PermanentTaskError(Exception):
+    """Raised by a task whose failure retrying cannot fix (it is marked failed immediately)"""
+
+
+def background_task(func):
+    """Register a function so it can be enqueued and run by name in a worker"""
+    name = f"{func.__module__}.{func.__qualname__}"
+    TASK_REGISTRY[name] = func
+    func.task_name = name
+    return func
+
+
+def enqueue(func, *args, reference='', max_attempts=None, delay=0, **kwargs):
+    """
+    Store a call to a @background_task function for a worker to pick up.
+    The row is written in the caller's transaction, so the task only becomes
+    visible to workers once the data it refers to has been committed.
+    """
+    if getattr(func, 'task_name', None) not in TASK_REGISTRY:
+        raise ValueError(f"{func!r} is not registered with @background_task")
+    return BackgroundTask.objects.create(
+        name=func.task_name,
+        args=list(args),
+        kwargs=kwargs,
+        reference=reference,
+        max_attempts=max_attempts or settings.TASK_MAX_ATTEMPTS,
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def retry_delay(attempts):
+    """Exponential backoff: TASK_RETRY_DELAY, 2x, 4x, ... capped at TASK_RETRY_MAX_DELAY seconds"""
+    return min(settings.TASK_RETRY_DELAY * 2 ** (attempts - 1), settings.TASK_RETRY_MAX_DELAY)
+
+
+def requeue_stale_tasks():
+    """
+    Put back tasks whose worker died mid-run (still running after
+    TASK_LOCK_TIMEOUT). The dead run was counted as an attempt when it was
+    claimed, so a task that keeps killing its worker is marked failed once it
+    has used max_attempts instead of being requeued forever.
+    """
+    now = timezone.now()
+    stale = BackgroundTask.objects.filter(
+        status=BackgroundTask.RUNNING, locked_at__lt=now - timedelta(seconds=settings.TASK_LOCK_TIMEOUT)
+    )
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=BackgroundTask.FAILED,
+        last_error=f"Worker stopped responding for over {settings.TASK_LOCK_TIMEOUT}s on the last attempt",
+        finished_at=now,
+        locked_by='',
+        locked_at=None,
+    )
+    if failed:
+        print(f"[TASKS] {failed} stale task(s) out of attempts, marked failed")
+    return stale.filter(attempts__lt=F('max_attempts')).update(
+        status=BackgroundTask.PENDING, locked_by='', locked_at=None
+    )
+
+
+def claim_task(worker):
+    """
+    Atomically claim the next due task for this worker, or return None.
+    The claim is a conditional UPDATE on status, so two workers racing for
+    the same row cannot both win it on any database backend.
+    """
+    now = timezone.now()
+    candidates = BackgroundTask.objects.filter(
+        status=BackgroundTask.PENDING, run_after__lte=now
+    ).order_by('run_after', 'id').values_list('id', flat=True)[:10]
+
+    for task_id in candidates:
+        claimed = BackgroundTask.objects.filter(id=task_id, status=BackgroundTask.PENDING).update(
+            status=BackgroundTask.RUNNING,
+            locked_by=worker,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return BackgroundTask.objects.get(id=task_id)
+    return None
+
+
+def run_task(task, worker):
+    """Run a claimed task and record its outcome; failures are retried with backoff until max_attempts"""
+    owned = BackgroundTask.objects.filter(id=task.id, locked_by=worker, status=BackgroundTask.RUNNING)
+    func = TASK_REGISTRY.get(task.name)
+
+    try:
+        if func is None:
+            raise PermanentTaskError(f"Unknown task {task.name}")
+        result = func(*task.args, **task.kwargs)
+    except Exception as e:
+        error = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+        now = timezone.now()
+        if isinstance(e, PermanentTaskError) or task.attempts >= task.max_attempts:
+            print(f"[TASKS] {task.name} #{task.id} failed permanently: {e}")
+            owned.update(status=BackgroundTask.FAILED, last_error=error, finished_at=now, locked_by='', locked_at=None)
+            return BackgroundTask.FAILED
+        delay = retry_delay(task.attempts)
+        print(f"[TASKS] {task.name} #{task.id} failed (attempt {task.attempts}), retrying in {delay}s: {e}")
+        owned.update(
+            status=BackgroundTask.PENDING,
+            last_error=error,
+            run_after=now + timedelta(seconds=delay),
+            locked_by='',
+            locked_at=None,
+        )
+        return BackgroundTask.PENDING
+
+    owned.update(
+        status=BackgroundTask.DONE,
+        result=result,
+        finished_at=timezone.now(),
+        locked_by='',
+        locked_at=None,
+    )
+    return BackgroundTask.DONE
+
+
+def run_pending_tasks(worker=None, limit=None):
+    """Run due tasks until none are left (or `limit` have run); returns how many ran"""
+    worker = worker or worker_name()
+    requeue_stale_tasks()
+    ran = 0
+    while limit is None or ran < limit:
+        task = claim_task(worker)
+        if task is None:
+            break
+        run_task(task, worker)
+        ran += 1
+    return ran
@@ -1,3 +1,235 @@
-from django.test import TestCase
+from datetime import timedelta
+from smtplib import SMTPServerDisconnected
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from .models import BackgroundTask, OutgoingEmail, TokenBucket
+from .outbox import queue_email, send_outbox_batch
+from .ratelimit import take_token, take_tokens
+from .tasks import PermanentTaskError, background_task, claim_task, enqueue, requeue_stale_tasks, run_pending_tasks
 
-# Create your tests here.
+
+calls = []
+
+
+@background_task
+def record_call(value):
+    calls.append(value)
+    return {'value': value}
+
+
+@background_task
+def flaky_call():
+    raise ConnectionError("SMTP server unavailable")
+
+
+@background_task
+def broken_call():
+    raise PermanentTaskError("bad input")
+
+
+@override_settings(TASK_MAX_ATTEMPTS=3, TASK_RETRY_DELAY=10, TASK_RETRY_MAX_DELAY=15)
+class BackgroundTaskTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def make_due(self, task):
+        BackgroundTask.objects.filter(id=task.id).update(run_after=timezone.now())
+
+    def test_runs_task_and_records_result(self):
+        task = enqueue(record_call, 7, reference='test:1')
+
+        self.assertEqual(run_pending_tasks('worker-a'), 1)
+
+        task.refresh_from_db()
+        self.assertEqual(calls, [7])
+        self.assertEqual(task.status, BackgroundTask.DONE)
+        self.assertEqual(task.result, {'value': 7})
+        self.assertEqual(task.attempts, 1)
+        self.assertEqual(run_pending_tasks('worker-a'), 0)
+
+    def test_failed_task_is_retried_with_backoff_then_marked_failed(self):
+        task = enqueue(flaky_call)
+        delays = []
+        for _ in range(3):
+            before = timezone.now()
+            run_pending_tasks('worker-a')
+            task.refresh_from_db()
+            delays.append(round((task.run_after - before).total_seconds()))
+            self.make_due(task)
+
+        self.assertEqual(task.status, BackgroundTask.FAILED)
+        self.assertEqual(task.attempts, 3)
+        self.assertIn('SMTP server unavailable', task.last_error)
+        # 10s, then 20s capped at 15s; the final failure is not rescheduled
+        self.assertEqual(delays[:2], [10, 15])
+
+    def test_permanent_error_is_not_retried(self):
+        task = enqueue(broken_call)
+
+        run_pending_tasks('worker-a')
+
+        task.refresh_from_db()
+        self.assertEqual(task.status, BackgroundTask.FAILED)
+        self.assertEqual(task.attempts, 1)
+
+    def test_task_is_claimed_by_one_worker_only(self):
+        enqueue(record_call, 1)
+
+        self.assertIsNotNone(claim_task('worker-a'))
+        self.assertIsNone(claim_task('worker-b'))
+
+    def test_stale_running_task_is_requeued(self):
+        task = enqueue(record_call, 2)
+        claim_task('dead-worker')
+        BackgroundTask.objects.filter(id=task.id).update(locked_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(run_pending_tasks('worker-a'), 1)
+        self.assertEqual(calls, [2])
+
+    def test_task_that_keeps_killing_its_worker_fails_after_max_attempts(self):
+        task = enqueue(record_call, 3)
+        for _ in range(3):
+            # The worker claims it and dies before recording an outcome
+            self.assertIsNotNone(claim_task('doomed-worker'))
+            BackgroundTask.objects.filter(id=task.id).update(locked_at=timezone.now() - timedelta(hours=1))
+            requeue_stale_tasks()
+
+        self.assertEqual(run_pending_tasks('worker-a'), 0)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (BackgroundTask.FAILED, 3))
+        self.assertIn('stopped responding', task.last_error)
+        self.assertEqual(calls, [])
+
+
+class WorkerKilled(BaseException):
+    """Stands in for the worker process dying mid-send"""
+
+
+class CountingBackend(EmailBackend):
+    """locmem backend that counts how often a connection is opened"""
+    opened = 0
+    fail_for = set()
+    kill_at = None
+
+    def open(self):
+        CountingBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to[0] == self.kill_at:
+                raise WorkerKilled()
+            if message.to[0] in self.fail_for:
+                raise SMTPServerDisconnected("Connection unexpectedly closed")
+        return super().send_messages(messages)
+
+
+@override_settings(
+    EMAIL_BACKEND='hello.tests.CountingBackend',
+    EMAIL_DESTINATION_RATE=3,
+    EMAIL_DESTINATION_WINDOW=60,
+    EMAIL_RETRY_DELAY=60,
+    EMAIL_RETRY_MAX_DELAY=600,
+    EMAIL_MAX_ATTEMPTS=3,
+)
+class OutboxTests(TestCase):
+    def setUp(self):
+        CountingBackend.opened = 0
+        CountingBackend.fail_for = set()
+        CountingBackend.kill_at = None
+
+    def test_batch_is_sent_over_one_connection(self):
+        for i in range(5):
+            queue_email('Hello', 'Body', [f'user{i}@clinic{i}.example'], attachments=[('a.pdf', b'%PDF', 'application/pdf')])
+
+        counts = send_outbox_batch()
+
+        self.assertEqual(counts, {'sent': 5, 'deferred': 0, 'failed': 0})
+        self.assertEqual(CountingBackend.opened, 1)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].attachments[0][1], b'%PDF')
+        self.assertFalse(OutgoingEmail.objects.exclude(status=OutgoingEmail.SENT).exists())
+
+    def test_destination_over_rate_is_deferred(self):
+        for i in range(5):
+            queue_email('Hello', 'Body', [f'user{i}@gmail.com'])
+        queue_email('Hello', 'Body', ['someone@yahoo.com'])
+
+        counts = send_outbox_batch()
+
+        self.assertEqual(counts, {'sent': 4, 'deferred': 2, 'failed': 0})
+        deferred = OutgoingEmail.objects.filter(status=OutgoingEmail.QUEUED)
+        self.assertEqual(set(deferred.values_list('destination', flat=True)), {'gmail.com'})
+        self.assertTrue(all(outgoing.next_attempt_at > timezone.now() for outgoing in deferred))
+        self.assertTrue(all(outgoing.attempts == 0 for outgoing in deferred))
+        self.assertEqual(send_outbox_batch()['sent'], 0)
+
+    @override_settings(EMAIL_OUTBOX_LOCK_TIMEOUT=60)
+    def test_messages_sent_before_a_crash_are_not_sent_again(self):
+        for i in range(3):
+            queue_email('Prescription', 'Body', [f'patient{i}@clinic{i}.example'])
+        CountingBackend.kill_at = 'patient1@clinic1.example'
+
+        with self.assertRaises(WorkerKilled):
+            send_outbox_batch()
+        self.assertEqual(OutgoingEmail.objects.get(to=['patient0@clinic0.example']).status, OutgoingEmail.SENT)
+
+        # Another worker picks the batch up once the dead worker's locks time out
+        CountingBackend.kill_at = None
+        OutgoingEmail.objects.filter(status=OutgoingEmail.SENDING).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(send_outbox_batch()['sent'], 2)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [
+            'patient0@clinic0.example', 'patient1@clinic1.example', 'patient2@clinic2.example',
+        ])
+
+    def test_failures_back_off_then_dead_letter(self):
+        CountingBackend.fail_for = {'down@broken.example'}
+        outgoing = queue_email('Hello', 'Body', ['down@broken.example'])
+        queue_email('Hello', 'Body', ['ok@fine.example'])
+
+        counts = send_outbox_batch()
+
+        self.assertEqual(counts, {'sent': 1, 'deferred': 0, 'failed': 1})
+        delays = []
+        for _ in range(2):
+            outgoing.refresh_from_db()
+            delays.append(round((outgoing.next_attempt_at - timezone.now()).total_seconds() / 60))
+            OutgoingEmail.objects.filter(id=outgoing.id).update(next_attempt_at=timezone.now())
+            send_outbox_batch()
+
+        outgoing.refresh_from_db()
+        self.assertEqual(delays, [1, 2])
+        self.assertEqual(outgoing.status, OutgoingEmail.DEAD)
+        self.assertEqual(outgoing.attempts, 3)
+        self.assertIn('SMTPServerDisconnected', outgoing.last_error)
+
+
+class TokenBucketTests(TestCase):
+    def test_burst_then_refill(self):
+        # 3 tokens, refilling one every 10 seconds
+        results = [take_token('user:1', 0.1, 3, now=1000) for _ in range(4)]
+
+        self.assertEqual([allowed for allowed, _ in results], [True, True, True, False])
+        self.assertAlmostEqual(results[-1][1], 10)
+        self.assertEqual(take_token('user:1', 0.1, 3, now=1005), (False, 5.0))
+        self.assertEqual(take_token('user:1', 0.1, 3, now=1010)[0], True)
+        # Refill is capped at capacity
+        self.assertEqual([take_token('user:1', 0.1, 3, now=5000)[0] for _ in range(4)], [True, True, True, False])
+
+    def test_clock_read_before_a_concurrent_refill_is_not_a_negative_refill(self):
+        take_token('user:1', 100, 500, now=1000)
+
+        # 2 seconds stale at 100 tokens/second would otherwise cost 200 tokens
+        self.assertEqual(take_token('user:1', 100, 500, now=998), (True, 0))
+        bucket = TokenBucket.objects.get(key='user:1')
+        self.assertEqual((bucket.tokens, bucket.refilled_at), (498, 1000))
+
+    def test_rejected_by_global_limit_refunds_user_token(self):
+        limits = [('user:1', 0.1, 2), ('global', 0.1, 1)]
+
+        self.assertEqual(take_tokens(limits, now=1000), (True, 0))
+        self.assertEqual(take_tokens(limits, now=1000), (False, 10))
+
+        self.assertEqual(TokenBucket.objects.get(key='user:1').tokens, 1)
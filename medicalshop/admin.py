@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import MedicalShop, Medicine, PrescriptionMedicineMatch
+from django.core.exceptions import ValidationError
+from django.forms.models import BaseInlineFormSet
+from .catalog import catalog_key
+from .models import CatalogMedicine, CatalogSynonym, MedicalShop, Medicine, PrescriptionMedicineMatch
 
 # Register your models here.
 @admin.register(MedicalShop)
@@ -23,9 +26,36 @@ class MedicalShopAdmin(admin.ModelAdmin):
 
 @admin.register(Medicine)
 class MedicineAdmin(admin.ModelAdmin):
-    list_display = ('name', 'shop', 'quantity', 'price', 'created_at')
-    search_fields = ('name', 'shop__shop_name')
+    list_display = ('name', 'shop', 'catalog', 'quantity', 'price', 'created_at')
+    search_fields = ('name', 'shop__shop_name', 'catalog__name')
     list_filter = ('shop', 'created_at')
+    raw_id_fields = ('catalog',)
+
+class CatalogSynonymFormSet(BaseInlineFormSet):
+    def clean(self):
+        # Each form only checks its key against saved synonyms; catch clashes between new rows too
+        super().clean()
+        seen = set()
+        for form in self.forms:
+            if not getattr(form, 'cleaned_data', None) or form.cleaned_data.get('DELETE'):
+                continue
+            key = catalog_key(form.cleaned_data.get('name'))
+            if key in seen:
+                raise ValidationError(f'Two synonyms have the same key "{key}".')
+            seen.add(key)
+
+class CatalogSynonymInline(admin.TabularInline):
+    model = CatalogSynonym
+    formset = CatalogSynonymFormSet
+    fields = ('name', 'kind', 'key', 'base_key')
+    readonly_fields = ('key', 'base_key')
+    extra = 1
+
+@admin.register(CatalogMedicine)
+class CatalogMedicineAdmin(admin.ModelAdmin):
+    list_display = ('name', 'generic_name', 'created_at')
+    search_fields = ('name', 'generic_name', 'synonyms__name')
+    inlines = [CatalogSynonymInline]
 
 @admin.register(PrescriptionMedicineMatch)
 class PrescriptionMedicineMatchAdmin(admin.ModelAdmin):
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class MedicalshopConfig(AppConfig):
     name = 'medicalshop'
+    
+    def ready(self):
+        from . import signals  # noqa: F401
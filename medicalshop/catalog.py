@@ -0,0 +1,89 @@
+import re
+from django.db.models import Q
+from .models import CatalogMedicine, CatalogSynonym
+
+# Words that describe the dosage form, unit or pharmacopoeia rather than the
+# medicine itself, so "Dolo-650 Tab" and "dolo 650" share a key
+NOISE_WORDS = {
+    'tab', 'tabs', 'tablet', 'tablets', 'cap', 'caps', 'capsule', 'capsules',
+    'syp', 'syr', 'syrup', 'susp', 'suspension', 'inj', 'injection',
+    'drop', 'drops', 'cream', 'gel', 'oint', 'ointment',
+    'mg', 'mcg', 'g', 'gm', 'ml', 'iu',
+    'ip', 'bp', 'usp',
+}
+
+_TOKEN_RE = re.compile(r'[a-z]+|\d+')
+
+
+def catalog_key(name):
+    """
+    Normalize a medicine name into the key used to look it up in the catalog.
+    
+    Lowercases, splits letters from digits ("650mg" -> "650 mg"), drops
+    punctuation and noise words, e.g. "Dolo-650 Tab" -> "dolo 650".
+    """
+    tokens = _TOKEN_RE.findall((name or '').lower())
+    return ' '.join(token for token in tokens if token not in NOISE_WORDS)
+
+
+def base_key(key):
+    """Strip strength numbers from a catalog key: "dolo 650" -> "dolo" """
+    return ' '.join(token for token in key.split() if not token.isdigit())
+
+
+def resolve_catalog(name):
+    """
+    Return the catalog entry for a medicine name, creating one (with the name
+    as its first synonym) when no synonym has the same key. Returns None for
+    names that normalize to nothing.
+    """
+    key = catalog_key(name)
+    if not key:
+        return None
+    synonym = CatalogSynonym.objects.filter(key=key).select_related('catalog').first()
+    if synonym is not None:
+        return synonym.catalog
+    
+    catalog = CatalogMedicine.objects.create(name=name.strip())
+    _, created = CatalogSynonym.objects.get_or_create(
+        key=key,
+        defaults={'catalog': catalog, 'name': name.strip(), 'base_key': base_key(key), 'kind': 'generic'},
+    )
+    if not created:
+        # Lost a race with another writer; use the entry it created
+        catalog.delete()
+        return CatalogSynonym.objects.get(key=key).catalog
+    return catalog
+
+
+def catalog_ids_for_names(names):
+    """
+    Resolve many medicine names to catalog ids in one query.
+    
+    A name with a strength ("Paracetamol 500mg") matches synonyms with the same
+    key; a name without one ("Paracetamol") matches every strength through the
+    synonyms' base key. Returns {name: set of catalog ids}.
+    """
+    keys = {name: catalog_key(name) for name in names}
+    wanted = {key for key in keys.values() if key}
+    if not wanted:
+        return {name: set() for name in names}
+    
+    by_key = {}
+    by_base = {}
+    synonyms = CatalogSynonym.objects.filter(
+        Q(key__in=wanted) | Q(base_key__in=wanted)
+    ).values_list('key', 'base_key', 'catalog_id')
+    for key, synonym_base, catalog_id in synonyms:
+        by_key.setdefault(key, set()).add(catalog_id)
+        by_base.setdefault(synonym_base, set()).add(catalog_id)
+    
+    resolved = {}
+    for name, key in keys.items():
+        if not key:
+            resolved[name] = set()
+        elif key == base_key(key):
+            resolved[name] = by_key.get(key, set()) | by_base.get(key, set())
+        else:
+            resolved[name] = set(by_key.get(key, set()))
+    return resolved
@@ -0,0 +1,125 @@
+import math
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Shops are bucketed into precision-5 geohash cells (about 4.9 km x 4.9 km at
+# the equator); a radius search only reads the cells covering its bounding box.
+GEOHASH_PRECISION = 5
+CELL_LAT_DEGREES = 180 / 2 ** 12
+CELL_LON_DEGREES = 360 / 2 ** 13
+# Upper bound on the distance from any point of a cell to its centre
+CELL_HALF_DIAGONAL_KM = 3.5
+# Most cells one geohash__in lookup may list; keeps well under SQLite's bound parameter limit
+MAX_COVERING_CELLS = 900
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Encode a coordinate as a geohash string of the given precision"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two coordinates in kilometres"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    (min_lat, max_lat, min_lon, max_lon) around a circle of radius_km. The
+    longitudes are not wrapped, so they can run past +/-180.
+    """
+    if not all(math.isfinite(value) for value in (latitude, longitude, radius_km)):
+        raise ValueError('Coordinates and radius must be finite numbers')
+    if radius_km <= 0:
+        raise ValueError('Radius must be positive')
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = max(math.cos(math.radians(latitude)), 0.01)
+    lon_delta = min(180.0, lat_delta / cos_lat)
+    return (
+        max(-90.0, latitude - lat_delta),
+        min(90.0, latitude + lat_delta),
+        longitude - lon_delta,
+        longitude + lon_delta,
+    )
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """
+    Return the geohash cells that cover a circle of radius_km around a point,
+    or None when that would take more than MAX_COVERING_CELLS (wide circles
+    near the poles), so callers filter on the bounding box instead.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+    rows = math.ceil((max_lat - min_lat) / CELL_LAT_DEGREES) + 1
+    columns = math.ceil((max_lon - min_lon) / CELL_LON_DEGREES) + 1
+    if rows * columns > MAX_COVERING_CELLS:
+        return None
+
+    cells = set()
+    lat = min_lat
+    while True:
+        lon = min_lon
+        while True:
+            wrapped_lon = (lon + 180.0) % 360.0 - 180.0
+            cells.add(encode_geohash(min(lat, 89.999999), wrapped_lon))
+            if lon >= max_lon:
+                break
+            lon = min(lon + CELL_LON_DEGREES, max_lon)
+        if lat >= max_lat:
+            break
+        lat = min(lat + CELL_LAT_DEGREES, max_lat)
+    return cells
+
+
+def geohash_center(geohash):
+    """Return the (latitude, longitude) centre of a geohash cell"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            target = lon_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            if (bits >> shift) & 1:
+                target[0] = mid
+            else:
+                target[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from medicalshop.catalog import resolve_catalog
+from medicalshop.models import Medicine
+
+
+class Command(BaseCommand):
+    help = "Link existing Medicine rows that have no catalog entry to the canonical catalog"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--relink', action='store_true',
+            help="Re-resolve every row, e.g. after synonyms were merged in the admin",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        rows = Medicine.objects.all() if options['relink'] else Medicine.objects.filter(catalog__isnull=True)
+
+        # Rows sharing a name resolve to the same entry, so resolve each name once
+        resolved = {}
+        linked = 0
+        last_id = 0
+        while True:
+            batch = list(rows.filter(id__gt=last_id).order_by('id').only('id', 'name', 'catalog')[:batch_size])
+            if not batch:
+                break
+            changed = []
+            for medicine in batch:
+                if medicine.name not in resolved:
+                    resolved[medicine.name] = resolve_catalog(medicine.name)
+                catalog = resolved[medicine.name]
+                if catalog is not None and medicine.catalog_id != catalog.id:
+                    medicine.catalog = catalog
+                    changed.append(medicine)
+            # bulk_update skips the save signals; only the catalog link changes here
+            Medicine.objects.bulk_update(changed, ['catalog'])
+            linked += len(changed)
+            last_id = batch[-1].id
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Linked {linked} medicine rows to {len({c.id for c in resolved.values() if c})} catalog entries"
+        ))
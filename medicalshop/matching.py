@@ -0,0 +1,70 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .catalog import base_key, catalog_key
+from .models import CatalogSynonym, PrescribedMedicine, PrescriptionMedicineMatch
+
+
+def index_prescribed_medicines(prescription, names):
+    """Record a prescription's medication lines in the PrescribedMedicine inverted index"""
+    entries = {}
+    for name in names:
+        key = catalog_key(name)
+        if key and key not in entries:
+            entries[key] = PrescribedMedicine(
+                prescription=prescription,
+                medicine_name=name,
+                key=key,
+                has_strength=key != base_key(key),
+                created_at=prescription.created_at,
+            )
+    PrescribedMedicine.objects.bulk_create(entries.values(), ignore_conflicts=True)
+
+
+def match_medicine_to_prescriptions(medicine):
+    """
+    Reverse matching: link a newly stocked medicine to the recent prescriptions
+    that mention it.
+    
+    The medicine's catalog synonyms give the keys to look up in the inverted
+    index. A prescription line with a strength matches a synonym key exactly,
+    and a line without one matches the synonyms' base keys, mirroring forward
+    matching. Only prescriptions from the last REVERSE_MATCH_WINDOW_DAYS are
+    considered, and nothing else is scanned.
+    """
+    if medicine.catalog_id is None:
+        return 0
+    
+    keys = set()
+    bases = set()
+    for key, synonym_base in CatalogSynonym.objects.filter(
+        catalog_id=medicine.catalog_id
+    ).values_list('key', 'base_key'):
+        keys.add(key)
+        bases.add(synonym_base)
+    
+    cutoff = timezone.now() - timedelta(days=getattr(settings, 'REVERSE_MATCH_WINDOW_DAYS', 90))
+    lines = PrescribedMedicine.objects.filter(
+        Q(key__in=keys) | Q(key__in=bases, has_strength=False),
+        created_at__gte=cutoff,
+    ).order_by('id').values_list('prescription_id', 'medicine_name')
+    
+    line_for_prescription = {}
+    for prescription_id, medicine_name in lines:
+        line_for_prescription.setdefault(prescription_id, medicine_name)
+    
+    PrescriptionMedicineMatch.objects.bulk_create(
+        [
+            PrescriptionMedicineMatch(
+                prescription_id=prescription_id,
+                medicine=medicine,
+                medicine_name=medicine_name,
+                shop_id=medicine.shop_id,
+                notified=False,
+            )
+            for prescription_id, medicine_name in line_for_prescription.items()
+        ],
+        ignore_conflicts=True,
+    )
+    return len(line_for_prescription)
@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-18 20:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def index_existing_names(apps, schema_editor):
+    Medicine = apps.get_model('medicalshop', 'Medicine')
+    MedicineNameGram = apps.get_model('medicalshop', 'MedicineNameGram')
+    
+    batch = []
+    for medicine_id, name in Medicine.objects.values_list('id', 'name').iterator():
+        lowered = name.lower()
+        grams = {lowered[i:i + 3] for i in range(len(lowered) - 2)}
+        batch.extend(MedicineNameGram(medicine_id=medicine_id, gram=gram) for gram in grams)
+        if len(batch) >= 5000:
+            MedicineNameGram.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        MedicineNameGram.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicalshop', '0004_medicalshop_latitude_medicalshop_longitude'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicineNameGram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=3)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='name_grams', to='medicalshop.medicine')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['gram', 'medicine'], name='medicalshop_gram_d48000_idx')],
+                'unique_together': {('medicine', 'gram')},
+            },
+        ),
+        migrations.RunPython(index_existing_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 6.0 on 2026-10-18 20:19
+
+from django.db import migrations, models
+
+
+# Frozen copy of medicalshop.geo.encode_geohash at precision 5, so this
+# migration keeps producing the same cells whatever happens to the app code
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode_geohash(latitude, longitude, precision=5):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def fill_geohash(apps, schema_editor):
+    MedicalShop = apps.get_model('medicalshop', 'MedicalShop')
+    shops = MedicalShop.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    for shop in shops.iterator():
+        shop.geohash = encode_geohash(float(shop.latitude), float(shop.longitude))
+        shop.save(update_fields=['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicalshop', '0005_medicinenamegram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicalshop',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Geohash grid cell derived from latitude/longitude', max_length=12, null=True),
+        ),
+        migrations.RunPython(fill_geohash, migrations.RunPython.noop),
+    ]
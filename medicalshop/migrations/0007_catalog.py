@@ -0,0 +1,39 @@
+# Generated by Django 6.0 on 2026-10-18 20:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicalshop', '0006_medicalshop_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogMedicine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('generic_name', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='medicine',
+            name='catalog',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='medicines', to='medicalshop.catalogmedicine'),
+        ),
+        migrations.CreateModel(
+            name='CatalogSynonym',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('key', models.CharField(help_text='Normalized name, see medicalshop.catalog.catalog_key', max_length=200, unique=True)),
+                ('base_key', models.CharField(db_index=True, help_text='Key without strength numbers', max_length=200)),
+                ('kind', models.CharField(choices=[('generic', 'Generic'), ('brand', 'Brand'), ('synonym', 'Synonym')], default='synonym', max_length=20)),
+                ('catalog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='synonyms', to='medicalshop.catalogmedicine')),
+            ],
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 6.0 on 2026-10-18 20:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from medicalshop.catalog import base_key, catalog_key
+
+
+def index_existing_prescriptions(apps, schema_editor):
+    Prescription = apps.get_model('doctor', 'Prescription')
+    PrescribedMedicine = apps.get_model('medicalshop', 'PrescribedMedicine')
+
+    batch = []
+    for prescription in Prescription.objects.only('id', 'medications', 'created_at').iterator():
+        seen = set()
+        for med in prescription.medications or []:
+            name = (med.get('name') or '').strip()
+            key = catalog_key(name)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            batch.append(PrescribedMedicine(
+                prescription_id=prescription.id,
+                medicine_name=name,
+                key=key,
+                has_strength=key != base_key(key),
+                created_at=prescription.created_at,
+            ))
+        if len(batch) >= 5000:
+            PrescribedMedicine.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        PrescribedMedicine.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0002_doctor_specialty_prescription'),
+        ('medicalshop', '0007_catalog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrescribedMedicine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('medicine_name', models.CharField(max_length=200)),
+                ('key', models.CharField(max_length=200)),
+                ('has_strength', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField()),
+                ('prescription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prescribed_medicines', to='doctor.prescription')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['key', 'created_at'], name='medicalshop_key_5b80b7_idx')],
+                'unique_together': {('prescription', 'key')},
+            },
+        ),
+        migrations.RunPython(index_existing_prescriptions, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,7 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.hashers import make_password, check_password
+from .geo import encode_geohash
 
 # Create your models here.
 class MedicalShop(models.Model):
@@ -9,6 +11,7 @@ class MedicalShop(models.Model):
     location = models.CharField(max_length=200)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True, help_text="Latitude for GIS location")
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True, help_text="Longitude for GIS location")
+    geohash = models.CharField(max_length=12, null=True, blank=True, db_index=True, editable=False, help_text="Geohash grid cell derived from latitude/longitude")
     password = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
     last_login = models.DateTimeField(null=True, blank=True)
@@ -19,12 +22,66 @@ class MedicalShop(models.Model):
     def check_password(self, raw_password):
         return check_password(raw_password, self.password)
     
+    def save(self, *args, **kwargs):
+        # Keep the grid cell used by nearby searches in step with the coordinates
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = encode_geohash(float(self.latitude), float(self.longitude))
+        else:
+            self.geohash = None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'geohash'}
+        super().save(*args, **kwargs)
+    
     def __str__(self):
         return self.shop_name
 
+class CatalogMedicine(models.Model):
+    """Canonical medicine that shop inventory and prescriptions are joined on"""
+    name = models.CharField(max_length=200)
+    generic_name = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.name
+
+class CatalogSynonym(models.Model):
+    """A generic name, brand or alternate spelling that resolves to a catalog entry"""
+    KIND_CHOICES = [
+        ('generic', 'Generic'),
+        ('brand', 'Brand'),
+        ('synonym', 'Synonym'),
+    ]
+    
+    catalog = models.ForeignKey(CatalogMedicine, on_delete=models.CASCADE, related_name='synonyms')
+    name = models.CharField(max_length=200)
+    key = models.CharField(max_length=200, unique=True, help_text="Normalized name, see medicalshop.catalog.catalog_key")
+    base_key = models.CharField(max_length=200, db_index=True, help_text="Key without strength numbers")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='synonym')
+    
+    def clean(self):
+        # key is derived from the name, so a clash has to be reported against the name
+        from .catalog import catalog_key
+        key = catalog_key(self.name)
+        if not key:
+            raise ValidationError({'name': "The name has no letters or digits to match on."})
+        clash = CatalogSynonym.objects.filter(key=key).exclude(pk=self.pk).select_related('catalog').first()
+        if clash is not None:
+            raise ValidationError({'name': f'"{clash.name}" already has the key "{key}" (catalog entry {clash.catalog.name}).'})
+    
+    def save(self, *args, **kwargs):
+        from .catalog import base_key, catalog_key
+        self.key = catalog_key(self.name)
+        self.base_key = base_key(self.key)
+        super().save(*args, **kwargs)
+    
+    def __str__(self):
+        return f"{self.name} -> {self.catalog.name}"
+
 class Medicine(models.Model):
     shop = models.ForeignKey(MedicalShop, on_delete=models.CASCADE, related_name='medicines')
     name = models.CharField(max_length=200)
+    catalog = models.ForeignKey(CatalogMedicine, on_delete=models.SET_NULL, null=True, blank=True, related_name='medicines')
     quantity = models.IntegerField(default=0)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     expiry_date = models.DateField(null=True, blank=True)
@@ -37,6 +94,18 @@ class Medicine(models.Model):
     def __str__(self):
         return f"{self.name} - {self.shop.shop_name}"
 
+class MedicineNameGram(models.Model):
+    """Trigram index over Medicine.name used to narrow substring searches"""
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='name_grams')
+    gram = models.CharField(max_length=3)
+    
+    class Meta:
+        unique_together = ['medicine', 'gram']
+        indexes = [models.Index(fields=['gram', 'medicine'])]
+    
+    def __str__(self):
+        return f"{self.gram} -> {self.medicine_id}"
+
 class PrescriptionMedicineMatch(models.Model):
     """Tracks which medical shops have medicines from prescriptions"""
     prescription = models.ForeignKey('doctor.Prescription', on_delete=models.CASCADE, related_name='matches')
@@ -51,3 +120,21 @@ class PrescriptionMedicineMatch(models.Model):
     
     def __str__(self):
         return f"{self.medicine_name} available at {self.shop.shop_name}"
+
+class PrescribedMedicine(models.Model):
+    """
+    Inverted index of prescription lines by catalog key, so newly stocked
+    medicines can find the prescriptions that mention them.
+    """
+    prescription = models.ForeignKey('doctor.Prescription', on_delete=models.CASCADE, related_name='prescribed_medicines')
+    medicine_name = models.CharField(max_length=200)  # The name as written on the prescription
+    key = models.CharField(max_length=200)
+    has_strength = models.BooleanField(default=False)
+    created_at = models.DateTimeField()  # Copied from the prescription
+    
+    class Meta:
+        unique_together = ['prescription', 'key']
+        indexes = [models.Index(fields=['key', 'created_at'])]
+    
+    def __str__(self):
+        return f"{self.medicine_name} on prescription #{self.prescription_id}"
@@ -0,0 +1,704 @@
+import bisect
+import heapq
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict
+from django.conf import settings
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+from .catalog import catalog_ids_for_names
+from .geo import CELL_HALF_DIAGONAL_KM, bounding_box, covering_cells, haversine_km
+from .models import Medicine, MedicineNameGram
+
+NEARBY_DEFAULT_RADIUS_KM = 10
+NEARBY_MAX_RADIUS_KM = 50
+NEARBY_RADIUS_STEPS_KM = [2, 5, 10, 25, 50]
+
+
+def name_trigrams(name):
+    """Return the set of lowercase character trigrams in a medicine name"""
+    lowered = (name or '').lower()
+    return {lowered[i:i + 3] for i in range(len(lowered) - 2)}
+
+
+def index_medicine_name(medicine):
+    """Bring the trigram rows of a medicine in line with its current name"""
+    wanted = name_trigrams(medicine.name)
+    existing = set(
+        MedicineNameGram.objects.filter(medicine=medicine).values_list('gram', flat=True)
+    )
+    
+    stale = existing - wanted
+    if stale:
+        MedicineNameGram.objects.filter(medicine=medicine, gram__in=stale).delete()
+    
+    missing = wanted - existing
+    if missing:
+        MedicineNameGram.objects.bulk_create(
+            [MedicineNameGram(medicine=medicine, gram=gram) for gram in missing],
+            ignore_conflicts=True,
+        )
+
+
+def filter_by_name(queryset, term):
+    """
+    Restrict a Medicine queryset to names containing `term` (case-insensitive).
+    
+    Every trigram of the term must appear in a matching name, so the trigram
+    index narrows the candidates first and `icontains` only checks those rows.
+    Terms shorter than three characters fall back to the plain substring match.
+    """
+    grams = name_trigrams(term)
+    if grams:
+        candidate_ids = (
+            MedicineNameGram.objects.filter(gram__in=grams)
+            .values('medicine_id')
+            .annotate(hits=Count('gram'))
+            .filter(hits=len(grams))
+            .values('medicine_id')
+        )
+        queryset = queryset.filter(id__in=candidate_ids)
+    return queryset.filter(name__icontains=term)
+
+
+def filter_by_term(queryset, term):
+    """
+    Restrict a Medicine queryset to names containing `term` plus every
+    medicine linked to the catalog entries `term` resolves to (its brands and
+    synonyms). Returns (queryset, catalog_ids).
+    """
+    catalog_ids = catalog_ids_for_names([term])[term]
+    matches = filter_by_name(queryset, term)
+    if catalog_ids:
+        matches = matches | queryset.filter(catalog_id__in=catalog_ids)
+    return matches, catalog_ids
+
+
+def normalize_name(name):
+    """Lowercase a medicine name and collapse its whitespace"""
+    return ' '.join((name or '').lower().split())
+
+
+def _padded_trigrams(normalized):
+    """Trigrams of a name with every word padded by '$', so word edges count too"""
+    padded = '$' + normalized.replace(' ', '$') + '$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _bit_pattern(a):
+    peq = {}
+    for i, char in enumerate(a):
+        peq[char] = peq.get(char, 0) | (1 << i)
+    return peq, len(a)
+
+
+def _pattern_distance(pattern, b):
+    peq, length = pattern
+    if not length:
+        return len(b)
+    full = (1 << length) - 1
+    last = 1 << (length - 1)
+    pv, mv, score = full, 0, length
+    for char in b:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+    return score
+
+
+def edit_distance(a, b):
+    """
+    Levenshtein distance between a and b.
+    
+    Uses Myers' bit-parallel algorithm with one Python int as the bit vector,
+    so the cost is a handful of integer operations per character of b.
+    """
+    return _pattern_distance(_bit_pattern(a), b)
+
+
+class MedicineNameIndex:
+    """
+    In-memory index of the distinct medicine names across all shops.
+    
+    Names are normalized with `normalize_name` and given a small integer id.
+    Padded trigram postings map each gram to the ids containing it, which is
+    enough to pull a short candidate list for a misspelled term; candidates
+    are then ranked by bounded edit distance. Removed names are tombstoned
+    (their row count drops to zero) instead of being cut out of the postings.
+    
+    The normalized names are also kept in a sorted list for prefix lookups.
+    The row count of a name (how many shop rows carry it) is its popularity
+    weight; the top completions of prefixes that span many names are cached
+    and dropped whenever a name under that prefix changes.
+    """
+    
+    candidate_limit = 100
+    completion_scan_limit = 256
+    completion_cache_size = 20
+    
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.originals = []
+        self.counts = []
+        self.postings = {}
+        self.sorted_names = []
+        self.completion_cache = {}
+        self.built_at = None
+    
+    @classmethod
+    def build(cls, names):
+        index = cls()
+        for name in names:
+            index._add(name)
+        index.sorted_names = sorted(index.ids)
+        index.warm_completions()
+        index.built_at = time.monotonic()
+        return index
+    
+    def _add(self, name):
+        normalized = normalize_name(name)
+        if not normalized:
+            return None
+        name_id = self.ids.get(normalized)
+        if name_id is None:
+            name_id = len(self.names)
+            self.ids[normalized] = name_id
+            self.names.append(normalized)
+            self.originals.append({})
+            self.counts.append(0)
+            for gram in _padded_trigrams(normalized):
+                self.postings.setdefault(gram, array('I')).append(name_id)
+        self.counts[name_id] += 1
+        originals = self.originals[name_id]
+        originals[name] = originals.get(name, 0) + 1
+        return normalized
+    
+    def add(self, name):
+        is_new = normalize_name(name) not in self.ids
+        normalized = self._add(name)
+        if normalized is None:
+            return
+        if is_new:
+            bisect.insort(self.sorted_names, normalized)
+        self._raise_completion(normalized)
+    
+    def discard(self, name):
+        normalized = normalize_name(name)
+        name_id = self.ids.get(normalized)
+        if name_id is None or not self.counts[name_id]:
+            return
+        self.counts[name_id] -= 1
+        originals = self.originals[name_id]
+        if originals.get(name, 0) > 1:
+            originals[name] -= 1
+        else:
+            originals.pop(name, None)
+        # A lower weight can let a name outside a cached top list overtake it,
+        # so those lists are rebuilt on their next lookup
+        for length in range(1, len(normalized) + 1):
+            cached = self.completion_cache.get(normalized[:length])
+            if cached is not None and any(entry == normalized for entry, _ in cached):
+                del self.completion_cache[normalized[:length]]
+    
+    def update(self, removed=None, added=None):
+        """Move one shop row from name `removed` to name `added`; either may be None"""
+        if removed is not None:
+            self.discard(removed)
+        if added is not None:
+            self.add(added)
+    
+    def _raise_completion(self, normalized):
+        weight = self.counts[self.ids[normalized]]
+        for length in range(1, len(normalized) + 1):
+            cached = self.completion_cache.get(normalized[:length])
+            if cached is None:
+                continue
+            entries = [pair for pair in cached if pair[0] != normalized]
+            entries.append((normalized, weight))
+            entries.sort(key=lambda pair: (-pair[1], pair[0]))
+            self.completion_cache[normalized[:length]] = entries[:self.completion_cache_size]
+    
+    def _scan_completions(self, prefix, limit):
+        start = bisect.bisect_left(self.sorted_names, prefix)
+        end = bisect.bisect_left(self.sorted_names, prefix + '\uffff', start)
+        candidates = (
+            (normalized, self.counts[self.ids[normalized]])
+            for normalized in self.sorted_names[start:end]
+        )
+        # nlargest is stable, so equally weighted names stay in alphabetical order
+        completions = heapq.nlargest(
+            limit, (pair for pair in candidates if pair[1]), key=lambda pair: pair[1]
+        )
+        return completions, end - start
+    
+    def warm_completions(self, max_length=3):
+        """Pre-compute the top completions of every prefix up to max_length characters"""
+        prefixes = {normalized[:length] for normalized in self.sorted_names
+                    for length in range(1, max_length + 1)}
+        for prefix in prefixes:
+            completions, span = self._scan_completions(prefix, self.completion_cache_size)
+            if span > self.completion_scan_limit:
+                self.completion_cache[prefix] = completions
+    
+    def complete(self, prefix, limit=8):
+        """
+        Return up to `limit` (normalized name, weight) pairs starting with
+        `prefix`, most widely stocked first.
+        """
+        prefix = normalize_name(prefix)
+        if not prefix:
+            return []
+        limit = min(limit, self.completion_cache_size)
+        cached = self.completion_cache.get(prefix)
+        if cached is not None:
+            return cached[:limit]
+        
+        completions, span = self._scan_completions(prefix, self.completion_cache_size)
+        if span > self.completion_scan_limit:
+            self.completion_cache[prefix] = completions
+        return completions[:limit]
+    
+    def display_name(self, normalized):
+        """Return the most common stored spelling of a normalized name"""
+        name_id = self.ids.get(normalized)
+        if name_id is None or not self.originals[name_id]:
+            return normalized
+        originals = self.originals[name_id]
+        return max(originals, key=originals.get)
+    
+    @staticmethod
+    def _distance(pattern, normalized):
+        length = pattern[1]
+        best = _pattern_distance(pattern, normalized)
+        if best and ' ' in normalized:
+            for token in normalized.split():
+                if abs(len(token) - length) < best:
+                    best = min(best, _pattern_distance(pattern, token))
+                if best == 0:
+                    break
+        if best and len(normalized) > length:
+            best = min(best, _pattern_distance(pattern, normalized[:length]))
+        return best
+    
+    @staticmethod
+    def default_max_distance(term):
+        return max(1, min(3, len(term) // 4))
+    
+    @classmethod
+    def within_fuzzy_distance(cls, term, normalized):
+        """Whether a normalized name is close enough to count as a fuzzy match for term"""
+        return cls._distance(_bit_pattern(term), normalized) <= cls.default_max_distance(term)
+    
+    def fuzzy_lookup(self, term, limit=10, max_distance=None):
+        """
+        Return up to `limit` (normalized name, distance) pairs closest to `term`.
+        
+        A name matches when the term is within `max_distance` edits of the
+        whole name, of one of its words or of its leading characters, so
+        "paracetmol" still finds "paracetamol 500".
+        
+        Each edit destroys at most three of the term's trigrams, so a match
+        shares at least len(grams) - 3 * max_distance of them and must appear
+        in the postings of at least one of the 3 * max_distance + 1 rarest
+        grams. Only those short postings are counted, and candidates below the
+        shared-gram bound are dropped before any edit distance is computed.
+        """
+        term = normalize_name(term)
+        if not term:
+            return []
+        if max_distance is None:
+            max_distance = self.default_max_distance(term)
+        
+        grams = _padded_trigrams(term)
+        postings = sorted(
+            (self.postings[gram] for gram in grams if gram in self.postings), key=len
+        )
+        overlap = Counter()
+        for posting in postings[:3 * max_distance + 1]:
+            overlap.update(posting)
+        
+        min_shared = len(grams) - 3 * max_distance
+        pattern = _bit_pattern(term)
+        ranked = []
+        for name_id, _ in overlap.most_common(self.candidate_limit):
+            if not self.counts[name_id]:
+                continue
+            normalized = self.names[name_id]
+            shared = len(grams & _padded_trigrams(normalized))
+            if shared < min_shared:
+                continue
+            distance = self._distance(pattern, normalized)
+            if distance <= max_distance:
+                ranked.append((distance, -shared, normalized))
+        ranked.sort()
+        return [(normalized, distance) for distance, _, normalized in ranked[:limit]]
+    
+    def original_names(self, normalized):
+        """Return the stored spellings of a normalized name"""
+        name_id = self.ids.get(normalized)
+        return list(self.originals[name_id]) if name_id is not None else []
+
+
+_name_index = None
+_name_index_lock = threading.Lock()
+# Name changes made while a rebuild runs, replayed onto the new index; None when no rebuild runs
+_name_index_journal = None
+
+
+def rebuild_name_index():
+    """
+    Build a fresh name index from the database and swap it in. Name changes
+    this process makes while the build runs are recorded and replayed onto
+    the new index, so they are not lost with the old one (a change that the
+    build already read is counted twice until the next rebuild, which only
+    nudges that name's weight). Returns None if a rebuild is already running.
+    """
+    global _name_index, _name_index_journal
+    with _name_index_lock:
+        if _name_index_journal is not None:
+            return None
+        _name_index_journal = []
+    try:
+        index = MedicineNameIndex.build(Medicine.objects.values_list('name', flat=True).iterator())
+    except BaseException:
+        with _name_index_lock:
+            _name_index_journal = None
+        raise
+    with _name_index_lock:
+        for removed, added in _name_index_journal:
+            index.update(removed, added)
+        _name_index = index
+        _name_index_journal = None
+    return index
+
+
+def _rebuild_name_index_in_background():
+    from django.db import connection
+    try:
+        rebuild_name_index()
+    except Exception as e:
+        print(f"[SEARCH] Name index rebuild failed, keeping the old index: {e}")
+        # Try again after another TTL rather than on every lookup
+        if _name_index is not None:
+            _name_index.built_at = time.monotonic()
+    finally:
+        connection.close()
+
+
+def get_name_index():
+    """
+    Return the process-wide name index. The first call builds it; after that,
+    an index older than MEDICINE_NAME_INDEX_TTL seconds is rebuilt in a
+    background thread and swapped in when ready, while lookups keep using the
+    old one. Writes made in this process are applied immediately through the
+    Medicine signals; the TTL picks up writes made by other worker processes.
+    """
+    global _name_index
+    index = _name_index
+    if index is None:
+        with _name_index_lock:
+            if _name_index is None:
+                _name_index = MedicineNameIndex.build(
+                    Medicine.objects.values_list('name', flat=True).iterator()
+                )
+            return _name_index
+    
+    ttl = getattr(settings, 'MEDICINE_NAME_INDEX_TTL', 300)
+    if time.monotonic() - index.built_at > ttl and _name_index_journal is None:
+        threading.Thread(target=_rebuild_name_index_in_background, daemon=True).start()
+    return index
+
+
+def record_name_change(removed=None, added=None):
+    """Apply a Medicine name change to the loaded index and to one being rebuilt"""
+    with _name_index_lock:
+        if _name_index_journal is not None:
+            _name_index_journal.append((removed, added))
+        if _name_index is not None:
+            _name_index.update(removed, added)
+
+
+def fuzzy_filter(queryset, term, limit=10):
+    """
+    Restrict a Medicine queryset to the `limit` distinct names closest to
+    `term`. Returns (queryset, distances) where distances maps each matched
+    normalized name to its edit distance from the term.
+    """
+    index = get_name_index()
+    ranked = index.fuzzy_lookup(term, limit=limit)
+    spellings = [
+        original for normalized, _ in ranked for original in index.original_names(normalized)
+    ]
+    return queryset.filter(name__in=spellings), dict(ranked)
+
+
+def nearby_in_stock(queryset, latitude, longitude, radius_km):
+    """
+    Return [(medicine, distance_km)] for in-stock medicines at shops within
+    radius_km of a point, nearest first.
+    
+    Only shops in the geohash cells covering the search circle are read, so
+    shops without coordinates (and far-away ones) never reach the query.
+    Circles needing too many cells are narrowed by their bounding box instead.
+    """
+    cells = covering_cells(latitude, longitude, radius_km)
+    if cells is not None:
+        candidates = queryset.filter(shop__geohash__in=cells)
+    else:
+        min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+        candidates = queryset.filter(shop__latitude__range=(min_lat, max_lat))
+        if -180 <= min_lon and max_lon <= 180:
+            candidates = candidates.filter(shop__longitude__range=(min_lon, max_lon))
+        else:
+            candidates = candidates.filter(shop__longitude__isnull=False)
+    nearby = []
+    for medicine in candidates.filter(quantity__gt=0).select_related('shop'):
+        distance = haversine_km(
+            latitude, longitude, float(medicine.shop.latitude), float(medicine.shop.longitude)
+        )
+        if distance <= radius_km:
+            nearby.append((medicine, distance))
+    nearby.sort(key=lambda pair: (pair[1], pair[0].name))
+    return nearby
+
+
+def k_nearest_radius(queryset, latitude, longitude, k):
+    """
+    Return the distance to the k-th nearest in-stock result, widening the
+    search through NEARBY_RADIUS_STEPS_KM; NEARBY_MAX_RADIUS_KM if there are
+    fewer than k results in range.
+    """
+    for radius in NEARBY_RADIUS_STEPS_KM:
+        nearby = nearby_in_stock(queryset, latitude, longitude, radius)
+        if len(nearby) >= k:
+            return nearby[k - 1][1]
+    return NEARBY_MAX_RADIUS_KM
+
+
+def _result_row(medicine):
+    return {
+        'medicine_id': medicine.id,
+        'medicine_name': medicine.name,
+        'shop_id': medicine.shop.id,
+        'shop_name': medicine.shop.shop_name,
+        'shop_location': medicine.shop.location,
+        'quantity': medicine.quantity,
+        'price': float(medicine.price),
+    }
+
+
+def availability_for_names(names, shops_per_name=5):
+    """
+    In-stock offers for many medicine names at once: {name: rows}, cheapest
+    first, at most `shops_per_name` each. Names are matched by catalog key
+    (every saved Medicine is linked to its catalog entry), and the database
+    keeps only the `shops_per_name` cheapest rows of each catalog entry, so
+    the whole list costs two queries and a bounded number of rows however
+    much stock there is.
+    """
+    names = [name for name in dict.fromkeys(names) if name]
+    offers = {name: [] for name in names}
+    if not names:
+        return offers
+    
+    names_for_catalog = {}
+    for name, catalog_ids in catalog_ids_for_names(names).items():
+        for catalog_id in catalog_ids:
+            names_for_catalog.setdefault(catalog_id, set()).add(name)
+    if not names_for_catalog:
+        return offers
+    
+    # A name spanning several entries (every strength) still gets its overall
+    # cheapest rows: they are among the cheapest of the entries they come from
+    stocked = Medicine.objects.filter(
+        catalog_id__in=names_for_catalog, quantity__gt=0,
+    ).annotate(
+        rank=Window(RowNumber(), partition_by=[F('catalog_id')], order_by=[F('price').asc(), F('id').asc()]),
+    ).filter(rank__lte=shops_per_name).select_related('shop').order_by('price', 'id')
+    for medicine in stocked:
+        row = _result_row(medicine)
+        for name in names_for_catalog[medicine.catalog_id]:
+            if len(offers[name]) < shops_per_name:
+                offers[name].append(row)
+    return offers
+
+
+class CachedSearch:
+    """The serialized rows of one search plus what is needed to invalidate them"""
+    
+    def __init__(self, term, mode, rows, catalog_ids=()):
+        self.term = term
+        self.mode = mode
+        self.rows = rows
+        self.catalog_ids = set(catalog_ids)
+        self.medicine_ids = {row['medicine_id'] for row in rows}
+        self.shop_ids = {row['shop_id'] for row in rows}
+        self.created_at = time.monotonic()
+    
+    def could_match(self, name):
+        """Whether a medicine called `name` could appear in this search's results"""
+        if self.mode == 'fuzzy':
+            term = normalize_name(self.term)
+            return MedicineNameIndex.within_fuzzy_distance(term, normalize_name(name))
+        return self.term in (name or '').lower()
+
+
+def search_medicines(term, mode='exact', limit=10, center=None, radius_km=None, k=None):
+    """
+    Run a medicine search and return it as a CachedSearch.
+    
+    Without `center` the rows are ordered by name (exact, which also takes in
+    the term's catalog entries) or by edit distance (fuzzy). With `center` (the centre of the caller's geohash cell) the rows
+    are every in-stock candidate that any caller inside that cell could need:
+    radius searches read radius_km + CELL_HALF_DIAGONAL_KM around the centre,
+    and k-nearest searches read the centre's k-th nearest distance plus twice
+    that margin. `rank_nearby` then cuts them down for the caller's exact point.
+    """
+    distances = None
+    catalog_ids = set()
+    if mode == 'fuzzy':
+        medicines, distances = fuzzy_filter(Medicine.objects.all(), term, limit=limit)
+    else:
+        medicines, catalog_ids = filter_by_term(Medicine.objects.all(), term)
+    
+    if center is not None:
+        latitude, longitude = center
+        if k is not None:
+            reach = k_nearest_radius(medicines, latitude, longitude, k) + 2 * CELL_HALF_DIAGONAL_KM
+        else:
+            reach = radius_km + CELL_HALF_DIAGONAL_KM
+        ordered = [medicine for medicine, _ in nearby_in_stock(medicines, latitude, longitude, reach)]
+    elif distances is not None:
+        ordered = sorted(
+            medicines.select_related('shop'),
+            key=lambda medicine: (distances.get(normalize_name(medicine.name), 0), medicine.name),
+        )
+    else:
+        ordered = medicines.select_related('shop').order_by('name')
+    
+    rows = []
+    for medicine in ordered:
+        row = _result_row(medicine)
+        if distances is not None:
+            row['distance'] = distances.get(normalize_name(medicine.name))
+        if center is not None:
+            row['shop_latitude'] = float(medicine.shop.latitude)
+            row['shop_longitude'] = float(medicine.shop.longitude)
+        rows.append(row)
+    return CachedSearch(term, mode, rows, catalog_ids)
+
+
+def rank_nearby(rows, latitude, longitude, radius_km=None, k=None):
+    """Attach distance_km for the caller's point and keep the rows in range, nearest first"""
+    ranked = []
+    for row in rows:
+        distance = haversine_km(latitude, longitude, row['shop_latitude'], row['shop_longitude'])
+        if distance <= (radius_km if k is None else NEARBY_MAX_RADIUS_KM):
+            ranked.append(dict(row, distance_km=round(distance, 2)))
+    ranked.sort(key=lambda row: (row['distance_km'], row['medicine_name']))
+    return ranked[:k] if k is not None else ranked
+
+
+class SearchResultCache:
+    """
+    Process-local LRU cache of search results with a TTL.
+    
+    Entries are invalidated precisely: a Medicine write drops the entries that
+    contain that medicine or whose term could match its old or new name, and a
+    MedicalShop write drops the entries that show that shop. The TTL bounds
+    how long writes made by other worker processes can go unseen.
+    """
+    
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.created_at > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+    
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def _drop(self, predicate):
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if predicate(entry)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+    
+    def invalidate_medicine(self, medicine_id, names, catalog_id=None):
+        names = [name for name in names if name]
+        self._drop(lambda entry: medicine_id in entry.medicine_ids
+                   or catalog_id in entry.catalog_ids
+                   or any(entry.could_match(name) for name in names))
+    
+    def invalidate_shop(self, shop_id):
+        self._drop(lambda entry: shop_id in entry.shop_ids)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+_search_cache = None
+
+
+def get_search_cache():
+    """Return the process-wide search result cache, sized from settings"""
+    global _search_cache
+    if _search_cache is None:
+        _search_cache = SearchResultCache(
+            max_entries=getattr(settings, 'SEARCH_CACHE_MAX_ENTRIES', 1024),
+            ttl=getattr(settings, 'SEARCH_CACHE_TTL', 60),
+        )
+    return _search_cache
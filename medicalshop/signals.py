@@ -0,0 +1,73 @@
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+from .catalog import resolve_catalog
+from .matching import match_medicine_to_prescriptions
+from .models import MedicalShop, Medicine
+from .search import get_search_cache, index_medicine_name, record_name_change
+
+
+@receiver(post_init, sender=Medicine)
+def remember_loaded_medicine(sender, instance, **kwargs):
+    """
+    Remember the name and stock a Medicine was loaded with so changes can be
+    detected. Fields left out by only()/defer() are not read (that would load
+    them through another instance, firing this again); they stay None, meaning
+    unknown, which the handlers below treat as "may have changed".
+    """
+    loaded = instance.__dict__ if instance.pk else {}
+    instance._loaded_name = loaded.get('name')
+    instance._loaded_quantity = loaded.get('quantity')
+    instance._loaded_catalog_id = loaded.get('catalog_id')
+
+
+@receiver(pre_save, sender=Medicine)
+def link_medicine_catalog(sender, instance, **kwargs):
+    """Link every written Medicine to its canonical catalog entry"""
+    if instance.catalog_id is None or instance._loaded_name != instance.name:
+        instance.catalog = resolve_catalog(instance.name)
+
+
+@receiver(post_save, sender=Medicine)
+def sync_saved_medicine(sender, instance, created, **kwargs):
+    """Keep the search indexes, cached results and prescription matches in sync with every Medicine write"""
+    index_medicine_name(instance)
+
+    old_name = instance._loaded_name
+    if created:
+        record_name_change(added=instance.name)
+    elif old_name is not None and old_name != instance.name:
+        # A rename of a row loaded without its name reaches the index on its next rebuild
+        record_name_change(old_name, instance.name)
+
+    get_search_cache().invalidate_medicine(instance.id, {old_name, instance.name}, instance.catalog_id)
+
+    # Newly stocked (created, restocked or relinked to another catalog entry):
+    # match it against the open prescriptions that mention it
+    if instance.quantity > 0 and (
+        created
+        or (instance._loaded_quantity or 0) <= 0
+        or instance._loaded_catalog_id != instance.catalog_id
+    ):
+        match_medicine_to_prescriptions(instance)
+
+    instance._loaded_name = instance.name
+    instance._loaded_quantity = instance.quantity
+    instance._loaded_catalog_id = instance.catalog_id
+
+
+@receiver(post_delete, sender=Medicine)
+def unindex_medicine_name(sender, instance, **kwargs):
+    """Drop a deleted medicine from the in-memory name index and cached results"""
+    if instance._loaded_name is not None:
+        record_name_change(removed=instance._loaded_name)
+
+    # The row is gone, so deferred fields can no longer be loaded
+    get_search_cache().invalidate_medicine(
+        instance.id, {instance._loaded_name, instance.__dict__.get('name')}, instance.__dict__.get('catalog_id')
+    )
+
+
+@receiver(post_save, sender=MedicalShop)
+def invalidate_shop_results(sender, instance, **kwargs):
+    """Shop name, location and coordinates are part of cached search rows"""
+    get_search_cache().invalidate_shop(instance.id)
@@ -1,3 +1,447 @@
+import math
+import time
+from unittest import mock
+import io
+import json
+from django.contrib.auth.models import User as AdminUser
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from user.models import User
+from .catalog import base_key, catalog_ids_for_names, catalog_key, resolve_catalog
+from .models import CatalogMedicine, CatalogSynonym, MedicalShop, Medicine, MedicineNameGram
+from . import search
+from .geo import MAX_COVERING_CELLS, covering_cells, encode_geohash
+from .search import NEARBY_MAX_RADIUS_KM, MedicineNameIndex, get_search_cache, k_nearest_radius, nearby_in_stock, edit_distance, filter_by_name, get_name_index, name_trigrams, rebuild_name_index
 
-# Create your tests here.
+
+def make_shop(number, **fields):
+    return MedicalShop.objects.create(
+        shop_name=f'Shop {number}', email=f'shop{number}@example.com', owner_name='Owner', location='Town', **fields
+    )
+
+
+class TrigramSearchTests(TestCase):
+    names = ['Paracetamol 500', 'PARACETAMOL syrup', 'Amoxicillin 250mg', 'Cetirizine 10', 'Dolo-650', 'Azithral']
+
+    def setUp(self):
+        self.shop = make_shop(1)
+        for name in self.names:
+            Medicine.objects.create(shop=self.shop, name=name, quantity=5, price=10)
+
+    def search(self, term):
+        return set(filter_by_name(Medicine.objects.all(), term).values_list('name', flat=True))
+
+    def test_matches_the_plain_substring_search(self):
+        for term in ['paracetamol', 'CETAM', 'cillin 2', 'o-6', 'zine 10', 'syrup', 'ibuprofen']:
+            expected = set(Medicine.objects.filter(name__icontains=term).values_list('name', flat=True))
+            self.assertEqual(self.search(term), expected, term)
+
+    def test_short_terms_fall_back_to_substring_match(self):
+        self.assertEqual(self.search('am'), {'Paracetamol 500', 'PARACETAMOL syrup', 'Amoxicillin 250mg'})
+        self.assertEqual(self.search('-'), {'Dolo-650'})
+
+    def test_rename_and_delete_update_the_grams(self):
+        medicine = Medicine.objects.get(name='Azithral')
+        medicine.name = 'Ibuprofen 400'
+        medicine.save()
+
+        grams = set(MedicineNameGram.objects.filter(medicine=medicine).values_list('gram', flat=True))
+        self.assertEqual(grams, name_trigrams('Ibuprofen 400'))
+        self.assertEqual(self.search('azith'), set())
+        self.assertEqual(self.search('profen'), {'Ibuprofen 400'})
+
+        medicine.delete()
+        self.assertFalse(MedicineNameGram.objects.filter(medicine_id=medicine.id).exists())
+        self.assertEqual(self.search('profen'), set())
+
+
+class FuzzyNameIndexTests(TestCase):
+    def setUp(self):
+        self.index = MedicineNameIndex.build([
+            'Paracetamol 500', 'Paracetamol 500', 'Paracetamol 650', 'Pantoprazole 40',
+            'Amoxicillin 250mg', 'Azithromycin', 'Cetirizine 10',
+        ])
+
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance('paracetamol', 'paracetmol'), 1)
+        self.assertEqual(edit_distance('kitten', 'sitting'), 3)
+        self.assertEqual(edit_distance('', 'abc'), 3)
+
+    def test_misspellings_find_names_within_the_edit_budget(self):
+        self.assertEqual(self.index.fuzzy_lookup('azithromicin'), [('azithromycin', 1)])
+        # One word of a longer name is enough
+        self.assertEqual({name for name, _ in self.index.fuzzy_lookup('amoxicilin')}, {'amoxicillin 250mg'})
+        self.assertEqual(self.index.fuzzy_lookup('ibuprofen'), [])
+
+    def test_results_are_ranked_by_distance_then_shared_grams(self):
+        ranked = self.index.fuzzy_lookup('paracetamol 500')
+
+        self.assertEqual(ranked[0], ('paracetamol 500', 0))
+        self.assertEqual(ranked[1], ('paracetamol 650', 2))
+        self.assertEqual([distance for _, distance in ranked], sorted(distance for _, distance in ranked))
+        self.assertEqual(self.index.fuzzy_lookup('paracetamol 500', limit=1), [('paracetamol 500', 0)])
+
+    def test_removed_names_are_not_returned(self):
+        self.index.discard('Azithromycin')
+
+        self.assertEqual(self.index.fuzzy_lookup('azithromicin'), [])
+
+
+class NameIndexRebuildTests(TestCase):
+    def setUp(self):
+        search._name_index = None
+        self.addCleanup(setattr, search, '_name_index', None)
+        make_shop(1)
+        Medicine.objects.create(shop=MedicalShop.objects.get(), name='Azithromycin', quantity=5, price=10)
+
+    def test_stale_index_is_rebuilt_in_the_background_while_lookups_use_the_old_one(self):
+        index = get_name_index()
+        index.built_at = time.monotonic() - 3600
+
+        with mock.patch.object(search.threading, 'Thread') as thread:
+            self.assertIs(get_name_index(), index)
+        thread.assert_called_once()
+        self.assertIs(thread.call_args.kwargs['target'], search._rebuild_name_index_in_background)
+
+    def test_rebuild_swaps_in_a_fresh_index_and_replays_writes_made_meanwhile(self):
+        old = get_name_index()
+        shop = MedicalShop.objects.get()
+        build_index = MedicineNameIndex.build
+
+        def build(names):
+            names = list(names)
+            # A write lands after the rebuild has read the database
+            Medicine.objects.create(shop=shop, name='Cetirizine 10', quantity=5, price=10)
+            return build_index(names)
+
+        with mock.patch.object(MedicineNameIndex, 'build', side_effect=build):
+            new = rebuild_name_index()
+
+        self.assertIsNot(new, old)
+        self.assertIs(get_name_index(), new)
+        self.assertEqual(new.complete('ceti'), [('cetirizine 10', 1)])
+
+
+CENTER = (12.9716, 77.5946)
+
+
+def north_of(center, km):
+    """A point `km` kilometres due north of `center`, rounded like the model fields"""
+    return round(center[0] + math.degrees(km / 6371.0), 6), center[1]
+
+
+class NearbySearchTests(TestCase):
+    def setUp(self):
+        for number, km in enumerate([0.5, 3, 9.9, 10.1, 30]):
+            latitude, longitude = north_of(CENTER, km)
+            shop = make_shop(number, latitude=latitude, longitude=longitude)
+            Medicine.objects.create(shop=shop, name='Paracetamol 500', quantity=5, price=10)
+        Medicine.objects.create(shop=make_shop(10), name='Paracetamol 500', quantity=5, price=10)
+        empty = make_shop(11, latitude=CENTER[0], longitude=CENTER[1])
+        Medicine.objects.create(shop=empty, name='Paracetamol 500', quantity=0, price=10)
+
+    def nearby(self, radius_km, center=CENTER):
+        return nearby_in_stock(Medicine.objects.all(), *center, radius_km)
+
+    def test_in_stock_results_within_the_radius_nearest_first(self):
+        nearby = self.nearby(10)
+
+        self.assertEqual([medicine.shop.shop_name for medicine, _ in nearby], ['Shop 0', 'Shop 1', 'Shop 2'])
+        self.assertEqual([round(distance, 1) for _, distance in nearby], [0.5, 3.0, 9.9])
+
+    def test_radius_edges(self):
+        self.assertEqual(self.nearby(0.4), [])
+        self.assertEqual(len(self.nearby(10.2)), 4)
+        self.assertEqual(len(self.nearby(50)), 5)
+
+    def test_search_wraps_around_the_antimeridian(self):
+        shop = make_shop(20, latitude=0, longitude=-179.99)
+        Medicine.objects.create(shop=shop, name='Paracetamol 500', quantity=5, price=10)
+
+        self.assertEqual([medicine.shop_id for medicine, _ in self.nearby(5, center=(0, 179.99))], [shop.id])
+
+    def test_k_nearest_radius_widens_until_k_results(self):
+        medicines = Medicine.objects.all()
+
+        self.assertAlmostEqual(k_nearest_radius(medicines, *CENTER, 2), 3, places=1)
+        self.assertAlmostEqual(k_nearest_radius(medicines, *CENTER, 4), 10.1, places=1)
+        self.assertEqual(k_nearest_radius(medicines, *CENTER, 6), NEARBY_MAX_RADIUS_KM)
+
+    def test_saving_only_the_coordinates_moves_the_shop_to_its_new_cell(self):
+        shop = MedicalShop.objects.get(shop_name='Shop 4')
+        shop.latitude, shop.longitude = CENTER
+        shop.save(update_fields=['latitude', 'longitude'])
+
+        shop.refresh_from_db()
+        self.assertEqual(shop.geohash, encode_geohash(*CENTER))
+        self.assertEqual(len(self.nearby(1)), 2)
+
+
+    def test_wide_circles_near_the_pole_fall_back_to_the_bounding_box(self):
+        north = (70.0, 25.0)
+        shop = make_shop(21, latitude=north[0], longitude=north[1] + 0.5)
+        Medicine.objects.create(shop=shop, name='Paracetamol 500', quantity=5, price=10)
+
+        self.assertIsNone(covering_cells(*north, 50))
+        self.assertEqual([medicine.shop_id for medicine, _ in self.nearby(50, center=north)], [shop.id])
+
+    def test_covering_cells_rejects_non_finite_or_empty_circles(self):
+        for radius_km in [math.nan, math.inf, 0, -5]:
+            with self.assertRaises(ValueError):
+                covering_cells(*CENTER, radius_km)
+        with self.assertRaises(ValueError):
+            covering_cells(math.nan, CENTER[1], 5)
+        self.assertLessEqual(len(covering_cells(*CENTER, NEARBY_MAX_RADIUS_KM + 3.5)), MAX_COVERING_CELLS)
+
+
+class SearchCacheInvalidationTests(TestCase):
+    def setUp(self):
+        get_search_cache().clear()
+        self.addCleanup(get_search_cache().clear)
+        user = User.objects.create(name='Ravi', email='ravi@example.com')
+        session = self.client.session
+        session['user_id'] = user.id
+        session.save()
+        self.shop = make_shop(1, latitude=CENTER[0], longitude=CENTER[1])
+        self.medicine = Medicine.objects.create(shop=self.shop, name='Paracetamol 500', quantity=5, price=10)
+
+    def test_bad_near_me_input_is_rejected(self):
+        near = {'search_term': 'paracetamol', 'latitude': CENTER[0], 'longitude': CENTER[1]}
+        for body in [
+            {**near, 'radius_km': math.nan}, {**near, 'radius_km': 'nan'}, {**near, 'radius_km': math.inf},
+            {**near, 'radius_km': 0}, {**near, 'radius_km': -3}, {**near, 'radius_km': 'far'},
+            {**near, 'latitude': math.nan}, {**near, 'longitude': 'east'}, {**near, 'latitude': math.inf},
+            {**near, 'k': 'two'}, {**near, 'k': 2.5e400},
+        ]:
+            response = self.client.post('/search-medicine/', json.dumps(body), content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+
+    def test_non_numeric_limit_is_rejected(self):
+        for limit in ['abc', None, [3]]:
+            body = {'search_term': 'paracetamol', 'mode': 'fuzzy', 'limit': limit}
+            response = self.client.post('/search-medicine/', json.dumps(body), content_type='application/json')
+            self.assertEqual(response.status_code, 400, limit)
+
+    def test_k_is_capped(self):
+        body = {'search_term': 'paracetamol', 'latitude': CENTER[0], 'longitude': CENTER[1], 'k': 10 ** 9}
+        with mock.patch.object(search, 'k_nearest_radius', wraps=search.k_nearest_radius) as widen:
+            response = self.client.post('/search-medicine/', json.dumps(body), content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(widen.call_args.args[-1], 50)
+
+    def search(self, term, near_me=False):
+        body = {'search_term': term}
+        if near_me:
+            body.update(latitude=CENTER[0], longitude=CENTER[1], radius_km=5)
+        response = self.client.post('/search-medicine/', json.dumps(body), content_type='application/json')
+        return [row['medicine_name'] for row in response.json()['results']]
+
+    def assert_cached(self, term, near_me=False):
+        hits = get_search_cache().hits
+        result = self.search(term, near_me)
+        self.assertEqual(get_search_cache().hits, hits + 1)
+        return result
+
+    def test_stock_change_drops_cached_near_me_results(self):
+        self.search('paracetamol', near_me=True)
+        self.assertEqual(self.assert_cached('paracetamol', near_me=True), ['Paracetamol 500'])
+
+        self.medicine.quantity = 0
+        self.medicine.save()
+
+        self.assertEqual(self.search('paracetamol', near_me=True), [])
+
+    def test_rename_drops_results_for_the_old_and_the_new_name(self):
+        self.search('paracetamol')
+        self.assertEqual(self.search('crocin'), [])
+
+        self.medicine.name = 'Crocin 500'
+        self.medicine.save()
+
+        self.assertEqual(self.search('paracetamol'), [])
+        self.assertEqual(self.search('crocin'), ['Crocin 500'])
+
+    def test_delete_drops_cached_results(self):
+        self.search('paracetamol')
+        self.assert_cached('paracetamol')
+
+        self.medicine.delete()
+
+        self.assertEqual(self.search('paracetamol'), [])
+
+    def test_moving_a_shop_drops_cached_near_me_results(self):
+        self.search('paracetamol', near_me=True)
+        self.assert_cached('paracetamol', near_me=True)
+
+        self.shop.latitude, self.shop.longitude = north_of(CENTER, 30)
+        self.shop.save()
+
+        self.assertEqual(self.search('paracetamol', near_me=True), [])
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        search._name_index = None
+        self.addCleanup(setattr, search, '_name_index', None)
+        user = User.objects.create(name='Ravi', email='ravi@example.com')
+        session = self.client.session
+        session['user_id'] = user.id
+        session.save()
+        stock = {'Paracetamol 500': 3, 'Paracetamol 650': 1, 'Pantoprazole 40': 2, 'Paroxetine 20': 1, 'Cetirizine 10': 3}
+        shops = [make_shop(number) for number in range(3)]
+        for name, shop_count in stock.items():
+            for shop in shops[:shop_count]:
+                Medicine.objects.create(shop=shop, name=name, quantity=5, price=10)
+
+    def complete(self, prefix, **params):
+        response = self.client.get('/autocomplete-medicine/', {'q': prefix, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(suggestion['name'], suggestion['shops']) for suggestion in response.json()['suggestions']]
+
+    def test_prefix_matches_most_widely_stocked_first(self):
+        self.assertEqual(self.complete('par'), [('Paracetamol 500', 3), ('Paracetamol 650', 1), ('Paroxetine 20', 1)])
+        self.assertEqual(self.complete('  PA'), [
+            ('Paracetamol 500', 3), ('Pantoprazole 40', 2), ('Paracetamol 650', 1), ('Paroxetine 20', 1),
+        ])
+        self.assertEqual(self.complete('ibu'), [])
+
+    def test_limit_is_applied_and_clamped(self):
+        self.assertEqual(self.complete('pa', limit=2), [('Paracetamol 500', 3), ('Pantoprazole 40', 2)])
+        self.assertEqual(len(self.complete('pa', limit=0)), 1)
+        self.assertEqual(self.client.get('/autocomplete-medicine/', {'q': 'pa', 'limit': 'abc'}).status_code, 400)
+
+    @mock.patch.object(MedicineNameIndex, 'completion_scan_limit', 1)
+    def test_new_stock_is_suggested_without_a_rebuild(self):
+        # With a scan limit of one every prefix is served from the warmed completion cache
+        self.complete('par')
+        self.assertIn('par', search._name_index.completion_cache)
+        Medicine.objects.create(shop=make_shop(9), name='Paroxetine 20', quantity=5, price=10)
+        Medicine.objects.create(shop=make_shop(10), name='Paroxetine 20', quantity=5, price=10)
+
+        self.assertEqual(self.complete('par')[:2], [('Paracetamol 500', 3), ('Paroxetine 20', 3)])
+
+    def test_requires_login(self):
+        self.client.cookies.clear()
+        self.assertEqual(self.client.get('/autocomplete-medicine/', {'q': 'par'}).status_code, 401)
+
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        for i in range(8):
+            shop = make_shop(i)
+            Medicine.objects.create(shop=shop, name='Paracetamol 500mg', quantity=5, price=20 - i)
+            Medicine.objects.create(shop=shop, name='Paracetamol 650 Tab', quantity=5, price=30 - i)
+        Medicine.objects.create(shop=make_shop(9), name='paracetamol-500', quantity=0, price=1)
+
+    def test_cheapest_in_stock_offers_are_capped_in_the_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            offers = search.availability_for_names(['Paracetamol 500', 'Paracetamol', 'Unknownol'], shops_per_name=3)
+
+        self.assertEqual([row['price'] for row in offers['Paracetamol 500']], [13.0, 14.0, 15.0])
+        # Across strengths; the out-of-stock row is never offered
+        self.assertEqual([row['price'] for row in offers['Paracetamol']], [13.0, 14.0, 15.0])
+        self.assertEqual(offers['Unknownol'], [])
+        self.assertEqual(len(queries), 2)
+        sql = queries[-1]['sql'].upper()
+        self.assertIn('ROW_NUMBER', sql)
+        self.assertNotIn('LIKE', sql)
+
+
+class DeferredMedicineFieldsTests(TestCase):
+    def setUp(self):
+        self.shop = make_shop(1)
+        self.medicine = Medicine.objects.create(shop=self.shop, name='Dolo-650', quantity=0, price=10)
+
+    def test_medicines_load_save_and_delete_with_deferred_fields(self):
+        medicine = Medicine.objects.only('id', 'name').get()
+        self.assertIsNone(medicine._loaded_quantity)
+        self.assertEqual(medicine.quantity, 0)
+
+        medicine = Medicine.objects.defer('name').get()
+        medicine.name = 'Dolo 650 Tab'
+        medicine.save()
+        self.assertEqual(Medicine.objects.get().name, 'Dolo 650 Tab')
+        self.assertEqual(set(MedicineNameGram.objects.values_list('gram', flat=True)), name_trigrams('Dolo 650 Tab'))
+
+        Medicine.objects.only('id').get().delete()
+        self.assertFalse(Medicine.objects.exists())
+
+    def test_backfill_catalog_links_unlinked_rows(self):
+        Medicine.objects.update(catalog=None)
+        Medicine.objects.create(shop=make_shop(2), name='Dolo 650 tablet', quantity=3, price=12)
+        Medicine.objects.filter(name='Dolo 650 tablet').update(catalog=None)
+        CatalogMedicine.objects.all().delete()
+
+        call_command('backfill_catalog', batch_size=1, stdout=io.StringIO())
+
+        catalogs = set(Medicine.objects.values_list('catalog_id', flat=True))
+        self.assertEqual(len(catalogs), 1)
+        self.assertNotIn(None, catalogs)
+
+
+class CatalogTests(TestCase):
+    def test_keys_drop_punctuation_units_and_dosage_forms(self):
+        self.assertEqual(catalog_key('Dolo-650 Tab'), 'dolo 650')
+        self.assertEqual(catalog_key('PARACETAMOL 500mg Tablets IP'), 'paracetamol 500')
+        self.assertEqual(catalog_key('Amoxicillin 250MG/5ML syrup'), 'amoxicillin 250 5')
+        self.assertEqual(catalog_key('Tab.'), '')
+        self.assertEqual(base_key('amoxicillin 250 5'), 'amoxicillin')
+
+    def test_names_resolve_by_exact_key_or_every_strength_by_base_key(self):
+        dolo_650 = resolve_catalog('Dolo 650')
+        dolo_500 = resolve_catalog('Dolo 500 Tab')
+        CatalogSynonym.objects.create(catalog=dolo_650, name='Paracetamol 650mg', kind='generic')
+
+        self.assertIs(resolve_catalog('dolo-650 tablet').id, dolo_650.id)
+        self.assertEqual(catalog_ids_for_names(['Dolo 650mg', 'Dolo', 'paracetamol 650', 'Crocin', 'Tab']), {
+            'Dolo 650mg': {dolo_650.id},
+            'Dolo': {dolo_650.id, dolo_500.id},
+            'paracetamol 650': {dolo_650.id},
+            'Crocin': set(),
+            'Tab': set(),
+        })
+
+    def test_backfill_relink_follows_merged_synonyms(self):
+        medicine = Medicine.objects.create(shop=make_shop(1), name='Crocin 650', quantity=5, price=10)
+        dolo = resolve_catalog('Dolo 650')
+        # An admin merges Crocin into Dolo by moving its synonym
+        CatalogSynonym.objects.filter(key='crocin 650').update(catalog=dolo)
+
+        call_command('backfill_catalog', stdout=io.StringIO())
+        medicine.refresh_from_db()
+        self.assertNotEqual(medicine.catalog_id, dolo.id)
+
+        call_command('backfill_catalog', relink=True, stdout=io.StringIO())
+        medicine.refresh_from_db()
+        self.assertEqual(medicine.catalog_id, dolo.id)
+
+    def test_synonym_with_a_taken_key_is_a_validation_error(self):
+        dolo = resolve_catalog('Dolo 650')
+
+        with self.assertRaises(ValidationError) as raised:
+            CatalogSynonym(catalog=dolo, name='DOLO-650 tablets').full_clean()
+        self.assertIn('name', raised.exception.message_dict)
+
+    def test_admin_reports_duplicate_keys_as_form_errors(self):
+        resolve_catalog('Dolo 650')
+        admin = AdminUser.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(admin)
+
+        def add_catalog(*synonyms):
+            data = {
+                'name': 'Calpol', 'generic_name': '',
+                'synonyms-TOTAL_FORMS': len(synonyms), 'synonyms-INITIAL_FORMS': 0,
+                'synonyms-MIN_NUM_FORMS': 0, 'synonyms-MAX_NUM_FORMS': 1000,
+            }
+            for i, name in enumerate(synonyms):
+                data.update({f'synonyms-{i}-name': name, f'synonyms-{i}-kind': 'brand'})
+            return self.client.post('/admin/medicalshop/catalogmedicine/add/', data)
+
+        self.assertEqual(add_catalog('Dolo 650 Tab').status_code, 200)
+        self.assertEqual(add_catalog('Calpol 500', 'calpol-500mg').status_code, 200)
+        self.assertFalse(CatalogMedicine.objects.filter(name='Calpol').exists())
+        self.assertEqual(add_catalog('Calpol 500').status_code, 302)
@@ -136,4 +136,102 @@ EMAIL_PORT = int(os.getenv('EMAIL_PORT', 587))
 EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'True').lower() == 'true'
 EMAIL_HOST_USER = os.getenv('EMAIL_ADDRESS', '')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_PASSWORD', '')
-DEFAULT_FROM_EMAIL = os.getenv('EMAIL_ADDRESS', EMAIL_HOST_USER)
\ No newline at end of file
+DEFAULT_FROM_EMAIL = os.getenv('EMAIL_ADDRESS', EMAIL_HOST_USER)
+
+# Medicine search
+# Seconds before a worker rebuilds its in-memory medicine name index from the database
+MEDICINE_NAME_INDEX_TTL = int(os.getenv('MEDICINE_NAME_INDEX_TTL', 300))
+# Per-worker search result cache (LRU entries, seconds before an entry expires)
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', 1024))
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 60))
+# Newly stocked medicines are matched against prescriptions from this many days back
+REVERSE_MATCH_WINDOW_DAYS = int(os.getenv('REVERSE_MATCH_WINDOW_DAYS', 90))
+
+# Background tasks (run with `python manage.py run_tasks`)
+TASK_MAX_ATTEMPTS = int(os.getenv('TASK_MAX_ATTEMPTS', 5))
+# Retry backoff in seconds: TASK_RETRY_DELAY, doubled per attempt up to TASK_RETRY_MAX_DELAY
+TASK_RETRY_DELAY = int(os.getenv('TASK_RETRY_DELAY', 30))
+TASK_RETRY_MAX_DELAY = int(os.getenv('TASK_RETRY_MAX_DELAY', 3600))
+# A task still running after this many seconds is assumed lost with its worker and requeued
+TASK_LOCK_TIMEOUT = int(os.getenv('TASK_LOCK_TIMEOUT', 600))
+TASK_POLL_INTERVAL = float(os.getenv('TASK_POLL_INTERVAL', 2))
+
+# Email outbox (delivered with `python manage.py send_outbox`)
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv('EMAIL_OUTBOX_BATCH_SIZE', 50))
+EMAIL_OUTBOX_POLL_INTERVAL = float(os.getenv('EMAIL_OUTBOX_POLL_INTERVAL', 5))
+# A batch still 'sending' after this many seconds is assumed lost with its sender and requeued
+EMAIL_OUTBOX_LOCK_TIMEOUT = int(os.getenv('EMAIL_OUTBOX_LOCK_TIMEOUT', 300))
+# At most EMAIL_DESTINATION_RATE messages per recipient domain every EMAIL_DESTINATION_WINDOW seconds
+EMAIL_DESTINATION_RATE = int(os.getenv('EMAIL_DESTINATION_RATE', 30))
+EMAIL_DESTINATION_WINDOW = int(os.getenv('EMAIL_DESTINATION_WINDOW', 60))
+# Failed sends back off from EMAIL_RETRY_DELAY seconds, doubling up to EMAIL_RETRY_MAX_DELAY,
+# and are dead-lettered after EMAIL_MAX_ATTEMPTS
+EMAIL_RETRY_DELAY = int(os.getenv('EMAIL_RETRY_DELAY', 60))
+EMAIL_RETRY_MAX_DELAY = int(os.getenv('EMAIL_RETRY_MAX_DELAY', 3600))
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', 6))
+
+# Rendered prescription PDFs, stored by content hash
+PRESCRIPTION_PDF_ROOT = os.getenv('PRESCRIPTION_PDF_ROOT', str(BASE_DIR / 'media' / 'prescription_pdfs'))
+# Prescriptions fetched per query while streaming a doctor's ZIP export
+PRESCRIPTION_EXPORT_BATCH_SIZE = int(os.getenv('PRESCRIPTION_EXPORT_BATCH_SIZE', 200))
+# Prescriptions per page of a patient's history (the dashboard renders the first page)
+# and most recent medicine-shop matches rendered on the patient dashboard
+USER_DASHBOARD_PRESCRIPTIONS = int(os.getenv('USER_DASHBOARD_PRESCRIPTIONS', 20))
+USER_DASHBOARD_MATCHES = int(os.getenv('USER_DASHBOARD_MATCHES', 50))
+# Most recent appointments and doctors (by name, the rest are searched for) rendered on the patient dashboard
+USER_DASHBOARD_APPOINTMENTS = int(os.getenv('USER_DASHBOARD_APPOINTMENTS', 20))
+USER_DASHBOARD_DOCTORS = int(os.getenv('USER_DASHBOARD_DOCTORS', 100))
+# Appointments per page of the doctor dashboard's appointment feeds
+DOCTOR_APPOINTMENTS_PAGE_SIZE = int(os.getenv('DOCTOR_APPOINTMENTS_PAGE_SIZE', 25))
+
+# AI backend. 'user.ai.StubProvider' answers offline after AI_STUB_LATENCY seconds,
+# for load tests and benchmarks without network access or API quota
+AI_PROVIDER = os.getenv('AI_PROVIDER', 'user.ai.GeminiProvider')
+AI_MODEL = os.getenv('AI_MODEL', 'gemini-2.5-flash')
+AI_REQUEST_TIMEOUT = float(os.getenv('AI_REQUEST_TIMEOUT', 60))
+AI_STUB_LATENCY = float(os.getenv('AI_STUB_LATENCY', 0.5))
+
+# AI endpoint rate limits (token buckets shared by all workers through the database)
+AI_USER_RATE_PER_MINUTE = float(os.getenv('AI_USER_RATE_PER_MINUTE', 6))
+AI_USER_BURST = int(os.getenv('AI_USER_BURST', 3))
+AI_GLOBAL_RATE_PER_MINUTE = float(os.getenv('AI_GLOBAL_RATE_PER_MINUTE', 30))
+AI_GLOBAL_BURST = int(os.getenv('AI_GLOBAL_BURST', 5))
+
+# Caches. 'ai_analysis' keeps prescription analyses by content hash and 'chat_memory' each
+# session's conversation; point them at a shared backend (e.g.
+# django.core.cache.backends.redis.RedisCache) to share entries between workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'chat_memory': {
+        'BACKEND': os.getenv('CHAT_MEMORY_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CHAT_MEMORY_CACHE_LOCATION', 'chat-memory'),
+        # Idle conversations expire; every exchange renews the timeout
+        'TIMEOUT': int(os.getenv('CHAT_MEMORY_IDLE_TIMEOUT', 30 * 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CHAT_MEMORY_MAX_SESSIONS', 1000)),
+        },
+    },
+    'ai_analysis': {
+        'BACKEND': os.getenv('AI_ANALYSIS_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('AI_ANALYSIS_CACHE_LOCATION', 'ai-analysis'),
+        'TIMEOUT': int(os.getenv('AI_ANALYSIS_CACHE_TTL', 7 * 24 * 3600)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('AI_ANALYSIS_CACHE_MAX_ENTRIES', 1000)),
+        },
+    },
+}
+
+# Prescription photos are auto-oriented, converted to grayscale (AI_IMAGE_GRAYSCALE), shrunk to
+# at most AI_IMAGE_MAX_DIMENSION pixels per side and re-encoded as JPEG or WEBP before AI upload
+AI_IMAGE_MAX_DIMENSION = int(os.getenv('AI_IMAGE_MAX_DIMENSION', 1600))
+AI_IMAGE_FORMAT = os.getenv('AI_IMAGE_FORMAT', 'JPEG')
+AI_IMAGE_QUALITY = int(os.getenv('AI_IMAGE_QUALITY', 80))
+AI_IMAGE_GRAYSCALE = os.getenv('AI_IMAGE_GRAYSCALE', 'True').lower() == 'true'
+
+# Server-side chat memory: recent turns plus a rolling summary of older ones, compacted to
+# stay within CHAT_MEMORY_TOKEN_BUDGET (estimated) tokens per session
+CHAT_MEMORY_TOKEN_BUDGET = int(os.getenv('CHAT_MEMORY_TOKEN_BUDGET', 1500))
+CHAT_MEMORY_SUMMARY_TOKENS = int(os.getenv('CHAT_MEMORY_SUMMARY_TOKENS', 300))
+CHAT_MESSAGE_MAX_CHARS = int(os.getenv('CHAT_MESSAGE_MAX_CHARS', 2000))
@@ -19,17 +19,25 @@ urlpatterns = [
     path('ulogin/', userLogin, name="userLogin"),
     path('uregister/', registerUser, name="registerUser"),
     path('udashboard/', userDashboard, name="userDashboard"),
+    path('prescription-history/', prescriptionHistory, name="prescriptionHistory"),
     path('ai-assistant/', aiAssistant, name="aiAssistant"),
     path('analyze-prescription/', analyzePrescription, name="analyzePrescription"),
     path('chat-prescription/', chatPrescription, name="chatPrescription"),
     path('save-prescription/', savePrescription, name="savePrescription"),
+    path('prescription-status/', prescriptionStatus, name="prescriptionStatus"),
+    path('download-prescription/', downloadPrescription, name="downloadPrescription"),
+    path('export-prescriptions/', exportPrescriptions, name="exportPrescriptions"),
     path('add-medicine/', addMedicine, name="addMedicine"),
     path('delete-medicine/', deleteMedicine, name="deleteMedicine"),
     path('search-medicine/', searchMedicine, name="searchMedicine"),
+    path('autocomplete-medicine/', autocompleteMedicine, name="autocompleteMedicine"),
+    path('search-cache-stats/', searchCacheStats, name="searchCacheStats"),
     path('place-order/', placeOrder, name="placeOrder"),
     path('book-appointment/', bookAppointment, name="bookAppointment"),
+    path('search-doctors/', searchDoctors, name="searchDoctors"),
     path('update-shop/', updateShop, name="updateShop"),
     path('update-appointment/', updateAppointment, name="updateAppointment"),
+    path('doctor-appointments/', doctorAppointments, name="doctorAppointments"),
     path('user-logout/', userLogout, name="userLogout"),
     path('doctor-logout/', doctorLogout, name="doctorLogout"),
     path('medical-logout/', medicalLogout, name="medicalLogout"),
@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import weakref
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+class AIError(Exception):
+    """The AI backend failed to answer"""
+
+
+class AITimeout(AIError):
+    """The AI backend did not answer within AI_REQUEST_TIMEOUT seconds"""
+
+
+class AINotConfigured(AIError):
+    """The configured AI backend is missing credentials"""
+
+
+class AIProvider:
+    """
+    Interface of an AI backend. `prompt` is a list of text parts and
+    {"inline_data": {"mime_type", "data"}} image parts.
+    """
+
+    async def generate(self, prompt):
+        """The complete answer text"""
+        raise NotImplementedError
+
+    async def stream(self, prompt):
+        """Async iterator over the answer text, chunk by chunk"""
+        raise NotImplementedError
+        yield
+
+
+class GeminiProvider(AIProvider):
+    """
+    Google Gemini. The API key is configured once per process and models are
+    reused between requests; the async transport belongs to the event loop
+    that created it, so there is one model per loop (just one under ASGI).
+    """
+
+    def __init__(self, model_name=None, timeout=None):
+        import google.generativeai as genai
+        try:
+            from myproject.config import GEMINI_API_KEY
+        except ImportError:
+            GEMINI_API_KEY = None
+
+        if not GEMINI_API_KEY:
+            raise AINotConfigured('Please set GEMINI_API_KEY in .env.')
+        genai.configure(api_key=GEMINI_API_KEY)
+        self.genai = genai
+        self.model_name = model_name or settings.AI_MODEL
+        self.timeout = timeout or settings.AI_REQUEST_TIMEOUT
+        self.models = weakref.WeakKeyDictionary()
+
+    def model(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self.models:
+            self.models[loop] = self.genai.GenerativeModel(self.model_name)
+        return self.models[loop]
+
+    async def call(self, prompt, stream):
+        try:
+            return await asyncio.wait_for(
+                self.model().generate_content_async(prompt, stream=stream, request_options={'timeout': self.timeout}),
+                self.timeout,
+            )
+        except asyncio.TimeoutError as e:
+            raise AITimeout(f'No answer within {self.timeout:g} seconds') from e
+        except Exception as e:
+            if type(e).__name__ == 'DeadlineExceeded':
+                raise AITimeout(str(e)) from e
+            raise
+
+    @staticmethod
+    def text_of(response):
+        try:
+            return response.text or ""
+        except ValueError:
+            # Responses without text parts (e.g. only safety ratings)
+            return ""
+
+    async def generate(self, prompt):
+        return self.text_of(await self.call(prompt, stream=False))
+
+    async def stream(self, prompt):
+        chunks = (await self.call(prompt, stream=True)).__aiter__()
+        while True:
+            # The timeout applies to every wait for the next chunk, not the whole answer
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError as e:
+                raise AITimeout(f'Stream stalled for {self.timeout:g} seconds') from e
+            text = self.text_of(chunk)
+            if text:
+                yield text
+
+
+class StubProvider(AIProvider):
+    """
+    Offline stand-in for load tests and benchmarks: answers after
+    AI_STUB_LATENCY seconds with text derived only from the prompt, so the
+    same prompt always gets the same answer. Counts requests in flight.
+    """
+
+    def __init__(self, latency=None):
+        self.latency = settings.AI_STUB_LATENCY if latency is None else latency
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def answer(self, prompt):
+        text_parts = [part for part in prompt if isinstance(part, str)]
+        digest = hashlib.sha256("\n".join(text_parts).encode()).hexdigest()
+        return (
+            f"💊 **Stub answer {digest[:8]}**\n\n"
+            f"Prompt: {len(text_parts)} text parts ({sum(map(len, text_parts))} characters), "
+            f"{len(prompt) - len(text_parts)} images.\n\n"
+            "⏰ Take as directed. [Reminder: 8:00 AM]\n\n"
+            "📝 *Generated offline by the stub AI provider. This is not medical advice.*"
+        )
+
+    async def generate(self, prompt):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            return self.answer(prompt)
+        finally:
+            self.in_flight -= 1
+
+    async def stream(self, prompt):
+        words = self.answer(prompt).split(" ")
+        chunks = [(" " if i else "") + " ".join(words[i:i + 5]) for i in range(0, len(words), 5)]
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            # Half the latency before the first chunk, the rest spread over the others
+            await asyncio.sleep(self.latency / 2)
+            for chunk in chunks:
+                yield chunk
+                await asyncio.sleep(self.latency / 2 / len(chunks))
+        finally:
+            self.in_flight -= 1
+
+
+_provider = None
+
+
+def get_provider():
+    """The process-wide provider named by AI_PROVIDER, created on first use"""
+    global _provider
+    if _provider is None:
+        _provider = import_string(settings.AI_PROVIDER)()
+    return _provider
+
+
+@receiver(setting_changed)
+def reset_provider(setting, **kwargs):
+    global _provider
+    if setting.startswith('AI_'):
+        _provider = None
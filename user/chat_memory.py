@@ -0,0 +1,86 @@
+from django.conf import settings
+from django.core.cache import caches
+
+
+# Rough size of a token in characters; close enough for budgeting without a tokenizer
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def memory_key(session_key):
+    return f"chat:{session_key}"
+
+
+def memory_tokens(memory):
+    return estimate_tokens(memory['summary']) + sum(estimate_tokens(turn['text']) for turn in memory['turns'])
+
+
+async def load_memory(session_key):
+    """A session's conversation so far: a rolling summary of older turns and the recent turns verbatim"""
+    memory = await caches['chat_memory'].aget(memory_key(session_key))
+    return memory or {'summary': '', 'turns': []}
+
+
+async def aforget_memory(session_key):
+    await caches['chat_memory'].adelete(memory_key(session_key))
+
+
+def forget_memory(session_key):
+    caches['chat_memory'].delete(memory_key(session_key))
+
+
+def memory_prompt(memory):
+    """Prompt parts that give the model the conversation so far"""
+    parts = []
+    if memory['summary']:
+        parts.append(f"\nSummary of the earlier conversation: {memory['summary']}\n")
+    if memory['turns']:
+        lines = [f"{'User' if turn['role'] == 'user' else 'Assistant'}: {turn['text']}" for turn in memory['turns']]
+        parts.append("\nRecent conversation:\n" + "\n".join(lines) + "\n")
+    return parts
+
+
+async def summarize(provider, summary, turns):
+    """Fold `turns` into the running summary with one model call; on failure the old summary is kept"""
+    max_tokens = settings.CHAT_MEMORY_SUMMARY_TOKENS
+    lines = [f"{'User' if turn['role'] == 'user' else 'Assistant'}: {turn['text']}" for turn in turns]
+    prompt = [
+        "Update the running summary of a conversation between a patient and a medication assistant. "
+        "Keep medication names, doses, timings, and the patient's questions and concerns; drop pleasantries. "
+        f"Answer with the summary only, in at most {max_tokens * CHARS_PER_TOKEN // 6} words.\n",
+        f"\nSummary so far: {summary or '(none)'}\n",
+        "\nNew turns:\n" + "\n".join(lines) + "\n",
+    ]
+    try:
+        new_summary = " ".join((await provider.generate(prompt)).split())
+    except Exception as e:
+        print(f"[AI] Chat summary failed, dropping {len(turns)} old turns: {e}")
+        return summary
+    return new_summary[:max_tokens * CHARS_PER_TOKEN] or summary
+
+
+async def remember_exchange(session_key, memory, question, answer, provider):
+    """
+    Add a question and answer to the session's memory and store it. When the
+    memory outgrows CHAT_MEMORY_TOKEN_BUDGET, the oldest turns are compacted
+    into the rolling summary until the recent turns fit in half the budget,
+    so prompts stay bounded however long the conversation runs. Memories of
+    sessions idle for CHAT_MEMORY_IDLE_TIMEOUT seconds expire from the cache.
+    """
+    budget = settings.CHAT_MEMORY_TOKEN_BUDGET
+    # No single turn may take more than a quarter of the budget
+    max_chars = budget * CHARS_PER_TOKEN // 4
+    memory['turns'].append({'role': 'user', 'text': question[:max_chars]})
+    memory['turns'].append({'role': 'model', 'text': answer[:max_chars]})
+
+    if memory_tokens(memory) > budget:
+        old = []
+        while memory['turns'] and memory_tokens({'summary': '', 'turns': memory['turns']}) > budget // 2:
+            old.append(memory['turns'].pop(0))
+        memory['summary'] = await summarize(provider, memory['summary'], old)
+
+    await caches['chat_memory'].aset(memory_key(session_key), memory)
+    return memory
@@ -0,0 +1,55 @@
+import io
+import time
+from django.conf import settings
+from PIL import Image, ImageOps
+
+
+class InvalidImage(Exception):
+    """The upload could not be decoded as an image"""
+
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+
+
+def prepare_prescription_image(image_bytes, max_dimension=None, image_format=None, quality=None, grayscale=None):
+    """
+    Shrink an uploaded prescription photo to what the model needs for reading
+    it: apply the EXIF orientation, optionally drop colour, fit it within
+    max_dimension pixels and re-encode it as JPEG or WEBP.
+    Returns (bytes, mime type, stats dict).
+    """
+    max_dimension = max_dimension or settings.AI_IMAGE_MAX_DIMENSION
+    image_format = (image_format or settings.AI_IMAGE_FORMAT).upper()
+    quality = quality or settings.AI_IMAGE_QUALITY
+    grayscale = settings.AI_IMAGE_GRAYSCALE if grayscale is None else grayscale
+    started = time.perf_counter()
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        original_size = image.size
+        # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale, far cheaper than decoding
+        # a full phone photo only to throw most of the pixels away
+        image.draft('L' if grayscale else 'RGB', (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise InvalidImage(str(e)) from e
+
+    if grayscale:
+        image = image.convert('L')
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(output, format=image_format, quality=quality, optimize=image_format == 'JPEG')
+    prepared = output.getvalue()
+
+    stats = {
+        'original_bytes': len(image_bytes),
+        'prepared_bytes': len(prepared),
+        'bytes_saved': len(image_bytes) - len(prepared),
+        'original_size': original_size,
+        'prepared_size': image.size,
+        'seconds': time.perf_counter() - started,
+    }
+    return prepared, MIME_TYPES[image_format], stats
@@ -0,0 +1,74 @@
+import base64
+import io
+import time
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageDraw
+from user.imaging import prepare_prescription_image
+
+
+def sample_photo(width=4032, height=3024, quality=92):
+    """A phone-camera-like JPEG of a handwritten page: noisy paper with lines of text, rotated by EXIF"""
+    noise = [Image.effect_noise((width, height), 24) for _ in range(3)]
+    paper = Image.merge('RGB', noise)
+    paper = Image.blend(paper, Image.new('RGB', (width, height), (238, 232, 220)), 0.7)
+    draw = ImageDraw.Draw(paper)
+    for line in range(40):
+        y = 200 + line * (height - 400) // 40
+        draw.text((240, y), f"Rx {line + 1}. Paracetamol 500mg - 1 tab twice daily x 5 days", fill=(30, 30, 60))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: taken holding the phone upright
+    output = io.BytesIO()
+    paper.save(output, format='JPEG', quality=quality, exif=exif)
+    return output.getvalue()
+
+
+def upload_seconds(byte_count, uplink_mbps):
+    return byte_count * 8 / (uplink_mbps * 1_000_000)
+
+
+class Command(BaseCommand):
+    help = "Measure bytes saved and the effect on request latency of preparing prescription photos before AI upload"
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help="Photos to use instead of generated samples")
+        parser.add_argument('--uplink-mbps', type=float, default=20, help="Bandwidth to the AI API")
+        parser.add_argument('--rounds', type=int, default=5, help="Timed rounds per image (median is reported)")
+        parser.add_argument('--max-dimension', type=int)
+        parser.add_argument('--format', choices=['JPEG', 'WEBP'])
+        parser.add_argument('--quality', type=int)
+
+    def handle(self, *args, **options):
+        if options['files']:
+            samples = []
+            for path in options['files']:
+                with open(path, 'rb') as f:
+                    samples.append((path, f.read()))
+        else:
+            samples = [('sample 12MP', sample_photo()), ('sample 8MP', sample_photo(3264, 2448))]
+
+        uplink = options['uplink_mbps']
+        self.stdout.write(
+            f"{'image':<16} {'original':>10} {'sent':>9} {'saved':>6} {'prep ms':>8} "
+            f"{'before ms':>10} {'after ms':>9}   (upload at {uplink:g} Mbit/s, base64 encoded)"
+        )
+        for name, data in samples:
+            prep_times = []
+            for _ in range(options['rounds']):
+                prepared, mime_type, stats = prepare_prescription_image(
+                    data, options['max_dimension'], options['format'], options['quality'],
+                )
+                prep_times.append(stats['seconds'])
+            prep = sorted(prep_times)[len(prep_times) // 2]
+
+            # Before: the original photo was base64 encoded and uploaded as is
+            started = time.perf_counter()
+            encoded_before = base64.b64encode(data)
+            before = time.perf_counter() - started + upload_seconds(len(encoded_before), uplink)
+            started = time.perf_counter()
+            encoded_after = base64.b64encode(prepared)
+            after = prep + time.perf_counter() - started + upload_seconds(len(encoded_after), uplink)
+
+            self.stdout.write(
+                f"{name[-16:]:<16} {len(data) // 1024:>8}KB {len(prepared) // 1024:>7}KB "
+                f"{stats['bytes_saved'] * 100 // len(data):>5}% {prep * 1000:>8.0f} {before * 1000:>10.0f} {after * 1000:>9.0f}"
+            )
@@ -0,0 +1,146 @@
+import asyncio
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from django.utils.crypto import get_random_string
+from user.ai import get_provider
+from user.models import User
+
+
+def request_body(endpoint, i):
+    # Distinct prescriptions, so no analysis is answered from the cache
+    if endpoint == 'analyze':
+        return json.dumps({'prescription': f'Paracetamol 500mg twice daily (load test {i})'}).encode()
+    return json.dumps({'message': f'What is paracetamol for? ({i})'}).encode()
+
+
+def run_wsgi(path, bodies, cookie, csrf_token, threads):
+    """Drive the WSGI handler from a pool of `threads`, like a threaded WSGI server"""
+    handler = WSGIHandler()
+
+    def call(body):
+        environ = {
+            'REQUEST_METHOD': 'POST', 'PATH_INFO': path, 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+            'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+            'HTTP_COOKIE': cookie, 'HTTP_X_CSRFTOKEN': csrf_token,
+            'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        }
+        status = []
+        started = time.perf_counter()
+        response = handler(environ, lambda line, headers, exc_info=None: status.append(int(line.split()[0])))
+        b''.join(response)
+        response.close()
+        return status[0], time.perf_counter() - started
+
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(call, bodies))
+
+
+def run_asgi(path, bodies, cookie, csrf_token):
+    """Drive the ASGI handler with every request in flight at once on one event loop"""
+    handler = ASGIHandler()
+
+    async def call(body):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+            'headers': [
+                (b'host', b'testserver'), (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'cookie', cookie.encode()), (b'x-csrftoken', csrf_token.encode()),
+            ],
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        status = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Event().wait()  # the client never disconnects
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        started = time.perf_counter()
+        await handler(scope, receive, send)
+        return status[0], time.perf_counter() - started
+
+    async def main():
+        return await asyncio.gather(*(call(body) for body in bodies))
+
+    return asyncio.run(main())
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the AI endpoints against the offline stub provider with a fixed latency, comparing "
+        "a threaded WSGI server with a single ASGI event loop. Runs against a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=['chat', 'analyze'], default='chat')
+        parser.add_argument('--requests', type=int, default=200, help="Concurrent requests per server model")
+        parser.add_argument('--threads', type=int, default=8, help="WSGI worker threads")
+        parser.add_argument('--latency', type=float, default=0.5, help="Stub provider latency in seconds")
+
+    def handle(self, *args, **options):
+        path = {'chat': '/chat-prescription/', 'analyze': '/analyze-prescription/'}[options['endpoint']]
+        count = options['requests']
+
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            user = User.objects.create(name='Load Test', email='loadtest@example.com')
+            session = SessionStore()
+            session['user_id'] = user.id
+            session.save()
+            csrf_token = get_random_string(32)
+            cookie = f"{settings.SESSION_COOKIE_NAME}={session.session_key}; {settings.CSRF_COOKIE_NAME}={csrf_token}"
+
+            # Cookie sessions: hundreds of concurrent writes to one session row
+            # would measure SQLite's write lock rather than the server model
+            overrides = {
+                'SESSION_ENGINE': 'django.contrib.sessions.backends.signed_cookies',
+                'AI_PROVIDER': 'user.ai.StubProvider',
+                'AI_STUB_LATENCY': options['latency'],
+                'AI_USER_BURST': count * 2, 'AI_USER_RATE_PER_MINUTE': count * 60,
+                'AI_GLOBAL_BURST': count * 2, 'AI_GLOBAL_RATE_PER_MINUTE': count * 60,
+            }
+            self.stdout.write(
+                f"{count} requests to {path}, stub provider latency {options['latency']:.2f}s\n"
+                f"{'server':<18} {'wall':>7} {'req/s':>8} {'p50':>7} {'p95':>7} {'peak in flight':>15} {'errors':>7}"
+            )
+            runs = [
+                (f"WSGI, {options['threads']} threads",
+                 lambda bodies: run_wsgi(path, bodies, cookie, csrf_token, options['threads'])),
+                ("ASGI, 1 loop", lambda bodies: run_asgi(path, bodies, cookie, csrf_token)),
+            ]
+            for offset, (label, run) in enumerate(runs):
+                bodies = [request_body(options['endpoint'], offset * count + i) for i in range(count)]
+                with override_settings(**overrides):
+                    stub = get_provider()
+                    started = time.perf_counter()
+                    results = run(bodies)
+                    wall = time.perf_counter() - started
+
+                latencies = sorted(seconds for _, seconds in results)
+                errors = sum(1 for status, _ in results if status != 200)
+                self.stdout.write(
+                    f"{label:<18} {wall:>6.2f}s {count / wall:>8.1f} {latencies[len(latencies) // 2]:>6.2f}s "
+                    f"{latencies[int(len(latencies) * 0.95) - 1]:>6.2f}s {stub.peak_in_flight:>15} {errors:>7}"
+                )
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 21:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0003_prescription_history_indexes'),
+        ('user', '0003_appointment'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'status', 'appointment_date', 'appointment_time'], name='user_appoin_doctor__6e9041_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctor', '0003_prescription_history_indexes'),
+        ('user', '0004_appointment_doctor_feed_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['user', 'appointment_date', 'appointment_time'], name='user_appoin_user_id_c2d288_idx'),
+        ),
+    ]
@@ -65,6 +65,12 @@ class Appointment(models.Model):
     
     class Meta:
         ordering = ['-appointment_date', '-appointment_time']
+        # The doctor dashboard's feeds are date ranges within one doctor and status;
+        # the patient dashboard lists a user's latest appointments
+        indexes = [
+            models.Index(fields=['doctor', 'status', 'appointment_date', 'appointment_time']),
+            models.Index(fields=['user', 'appointment_date', 'appointment_time']),
+        ]
     
     def __str__(self):
         return f"Appointment #{self.id} - {self.user.name} with Dr. {self.doctor.name} on {self.appointment_date}"
\ No newline at end of file
@@ -1,3 +1,509 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import threading
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from hello.models import TokenBucket
+from doctor.models import Doctor, Prescription
+from medicalshop.models import MedicalShop, Medicine, PrescriptionMedicineMatch
+from .models import Appointment, User
+from .chat_memory import load_memory, memory_tokens, remember_exchange
+from .imaging import InvalidImage, prepare_prescription_image
+from .views import (
+    analysis_cache_key, attach_availability, decode_history_cursor, extract_medications, prescription_history_page,
+    stream_generation,
+)
 
-# Create your tests here.
+
+@override_settings(
+    AI_USER_BURST=2, AI_USER_RATE_PER_MINUTE=1, AI_GLOBAL_BURST=10, AI_GLOBAL_RATE_PER_MINUTE=60,
+    AI_PROVIDER='user.ai.StubProvider', AI_STUB_LATENCY=0,
+)
+class AiRateLimitTests(TestCase):
+    def login(self, email):
+        user = User.objects.create(name=email, email=email)
+        session = self.client.session
+        session['user_id'] = user.id
+        session['user_email'] = email
+        session.save()
+
+    def chat(self, message='What is paracetamol for?'):
+        return self.client.post('/chat-prescription/', json.dumps({'message': message}), content_type='application/json')
+
+    def test_over_limit_gets_429_with_retry_after_instead_of_waiting(self):
+        self.login('ravi@example.com')
+
+        self.assertEqual([self.chat().status_code for _ in range(2)], [200, 200])
+        response = self.chat()
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual(response.json()['retry_after'], 60)
+
+    def test_limit_is_per_user(self):
+        self.login('ravi@example.com')
+        for _ in range(3):
+            self.chat()
+
+        self.client.cookies.clear()
+        self.login('meena@example.com')
+
+        self.assertEqual(self.chat().status_code, 200)
+
+    def test_invalid_requests_do_not_spend_tokens(self):
+        self.login('ravi@example.com')
+
+        self.assertEqual([self.chat('').status_code for _ in range(3)], [400, 400, 400])
+        self.assertEqual(self.chat('x' * 100_000).status_code, 400)
+        self.assertEqual([self.chat().status_code for _ in range(3)], [200, 200, 429])
+
+
+class AnalysisCacheTests(TestCase):
+    def setUp(self):
+        caches['ai_analysis'].clear()
+        user = User.objects.create(name='Ravi', email='ravi@example.com')
+        session = self.client.session
+        session['user_id'] = user.id
+        session.save()
+        self.result = {
+            'analysis': 'Paracetamol ... [Reminder: 8:00 AM]',
+            'image_summary': 'Image-based prescription uploaded by user.',
+            'reminder_times': ['8:00 AM'],
+        }
+
+    def test_key_ignores_case_and_spacing_but_not_content(self):
+        self.assertEqual(analysis_cache_key('Paracetamol  500mg\ntwice'), analysis_cache_key(' paracetamol 500MG twice'))
+        self.assertNotEqual(analysis_cache_key('Paracetamol 500mg'), analysis_cache_key('Paracetamol 650mg'))
+        self.assertNotEqual(analysis_cache_key('', b'photo-1'), analysis_cache_key('', b'photo-2'))
+
+    def test_repeat_upload_is_served_from_cache_without_api_or_tokens(self):
+        image = b'\x89PNG same photo bytes'
+        caches['ai_analysis'].set(analysis_cache_key('', image), self.result)
+
+        response = self.client.post('/analyze-prescription/', {
+            'prescription_image': SimpleUploadedFile('rx.png', image, content_type='image/png'),
+        })
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['cached'])
+        self.assertEqual(data['reminder_times'], ['8:00 AM'])
+        self.assertEqual(self.client.session['image_summary'], self.result['image_summary'])
+        self.assertFalse(TokenBucket.objects.exists())
+
+
+def parse_events(body):
+    """[(event, data)] from a text/event-stream body"""
+    events = []
+    for block in body.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((fields.get('event', 'message'), json.loads(fields['data'])))
+    return events
+
+
+async def chunks(texts, fail_after=None):
+    for i, text in enumerate(texts):
+        if i == fail_after:
+            raise RuntimeError('connection reset')
+        yield text
+
+
+async def collect(events):
+    return ''.join([event if isinstance(event, str) else event.decode() async for event in events])
+
+
+class StreamingResponseTests(TestCase):
+    async def finish(self, text):
+        return {'success': True, 'reply': text}
+
+    async def login(self):
+        user = await User.objects.acreate(name='Ravi', email='ravi@example.com')
+        session = await self.async_client.asession()
+        await session.aset('user_id', user.id)
+        await session.asave()
+
+    async def test_chunks_are_relayed_as_deltas_then_done(self):
+        texts = chunks(['Take **Para', 'cetamol**\n\n', '[Reminder: 8:00 AM]'])
+        events = parse_events(await collect(stream_generation(texts, self.finish)))
+
+        self.assertEqual([name for name, _ in events], ['delta', 'delta', 'delta', 'done'])
+        self.assertEqual(events[1][1]['text'], 'cetamol**\n\n')
+        self.assertEqual(events[-1][1]['reply'], 'Take **Paracetamol**\n\n[Reminder: 8:00 AM]')
+
+    async def test_failure_mid_stream_ends_with_error_event(self):
+        texts = chunks(['Take ', 'more'], fail_after=1)
+        events = parse_events(await collect(stream_generation(texts, self.finish)))
+
+        self.assertEqual(events, [('delta', {'text': 'Take '}), ('error', {'error': 'connection reset'})])
+
+    async def test_cached_analysis_is_streamed_as_a_single_done_event(self):
+        await caches['ai_analysis'].aclear()
+        await self.login()
+        await caches['ai_analysis'].aset(analysis_cache_key('Paracetamol 500mg'), {
+            'analysis': 'Paracetamol ...', 'image_summary': 'Paracetamol 500mg', 'reminder_times': [],
+        })
+
+        response = await self.async_client.post(
+            '/analyze-prescription/', json.dumps({'prescription': 'Paracetamol 500mg'}),
+            content_type='application/json', headers={'Accept': 'text/event-stream'},
+        )
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        events = parse_events(await collect(response.streaming_content))
+        self.assertEqual(events[0][0], 'done')
+        self.assertTrue(events[0][1]['cached'])
+
+    @override_settings(AI_PROVIDER='user.ai.StubProvider', AI_STUB_LATENCY=0)
+    async def test_chat_answers_as_json_or_stream_from_the_stub_provider(self):
+        await self.login()
+        body = json.dumps({'message': 'What is paracetamol for?'})
+
+        response = await self.async_client.post('/chat-prescription/', body, content_type='application/json')
+        streamed = await self.async_client.post(
+            '/chat-prescription/', body, content_type='application/json', headers={'Accept': 'text/event-stream'},
+        )
+        events = parse_events(await collect(streamed.streaming_content))
+
+        self.assertIn('**Stub answer', response.json()['reply'])
+        self.assertGreater(len(events), 2)
+        reply = ''.join(data['text'] for name, data in events if name == 'delta')
+        self.assertEqual(events[-1], ('done', {
+            'success': True, 'reply': reply, 'reminder_time': None, 'reminder_medication': None,
+        }))
+
+
+
+class GatedProvider:
+    """Streams one chunk, then holds the rest back until the test releases it"""
+    released = threading.Event()
+    finished = threading.Event()
+
+    async def stream(self, prompt):
+        yield 'Take '
+        await asyncio.to_thread(self.released.wait, 5)
+        yield 'with food'
+        self.finished.set()
+
+
+@override_settings(AI_PROVIDER='user.tests.GatedProvider')
+class WsgiStreamingTests(TestCase):
+    def setUp(self):
+        GatedProvider.released.clear()
+        GatedProvider.finished.clear()
+        user = User.objects.create(name='Ravi', email='ravi@example.com')
+        session = self.client.session
+        session['user_id'] = user.id
+        session.save()
+
+    def test_first_delta_arrives_before_generation_finishes(self):
+        response = self.client.post(
+            '/chat-prescription/', json.dumps({'message': 'What is paracetamol for?'}),
+            content_type='application/json', headers={'Accept': 'text/event-stream'},
+        )
+        events = iter(response.streaming_content)
+
+        first = next(events)
+        self.assertFalse(GatedProvider.finished.is_set())
+        GatedProvider.released.set()
+        rest = b''.join(events)
+
+        self.assertEqual(parse_events(first.decode()), [('delta', {'text': 'Take '})])
+        self.assertTrue(GatedProvider.finished.is_set())
+        self.assertEqual(parse_events(rest.decode())[-1][1]['reply'], 'Take with food')
+
+
+def photo_bytes(width, height, orientation=None):
+    output = io.BytesIO()
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    Image.new('RGB', (width, height), (200, 120, 40)).save(output, format='JPEG', quality=95, exif=exif)
+    return output.getvalue()
+
+
+@override_settings(AI_IMAGE_MAX_DIMENSION=800, AI_IMAGE_FORMAT='JPEG', AI_IMAGE_QUALITY=80, AI_IMAGE_GRAYSCALE=True)
+class ImagePreparationTests(TestCase):
+    def test_photo_is_oriented_shrunk_and_grayscale(self):
+        # Landscape sensor data that EXIF says to rotate to portrait
+        prepared, mime_type, stats = prepare_prescription_image(photo_bytes(3200, 2400, orientation=6))
+
+        image = Image.open(io.BytesIO(prepared))
+        self.assertEqual(mime_type, 'image/jpeg')
+        self.assertEqual((image.format, image.mode, image.size), ('JPEG', 'L', (600, 800)))
+        self.assertEqual(stats['bytes_saved'], stats['original_bytes'] - len(prepared))
+        self.assertGreater(stats['bytes_saved'], 0)
+
+    def test_webp_and_colour_can_be_configured(self):
+        prepared, mime_type, _ = prepare_prescription_image(photo_bytes(400, 300), image_format='webp', grayscale=False)
+
+        image = Image.open(io.BytesIO(prepared))
+        self.assertEqual((mime_type, image.format, image.mode, image.size), ('image/webp', 'WEBP', 'RGB', (400, 300)))
+
+    def test_undecodable_upload_is_rejected(self):
+        with self.assertRaises(InvalidImage):
+            prepare_prescription_image(b'\x89PNG not really')
+
+
+class FailingProvider:
+    async def generate(self, prompt):
+        raise RuntimeError('quota exceeded')
+
+
+@override_settings(
+    AI_PROVIDER='user.ai.StubProvider', AI_STUB_LATENCY=0, CHAT_MEMORY_TOKEN_BUDGET=200, CHAT_MEMORY_SUMMARY_TOKENS=60,
+    AI_USER_BURST=50, AI_GLOBAL_BURST=50,
+)
+class ChatMemoryTests(TestCase):
+    def setUp(self):
+        caches['chat_memory'].clear()
+
+    async def login(self):
+        user = await User.objects.acreate(name='Ravi', email='ravi@example.com')
+        self.session = await self.async_client.asession()
+        await self.session.aset('user_id', user.id)
+        await self.session.aset('image_summary', 'Paracetamol 500mg twice daily')
+        await self.session.asave()
+
+    async def chat(self, message):
+        response = await self.async_client.post(
+            '/chat-prescription/', json.dumps({'message': message}), content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['reply']
+
+    async def test_long_conversation_is_compacted_into_a_bounded_summary(self):
+        await self.login()
+        for i in range(12):
+            await self.chat(f'Question {i}: can I take paracetamol with food and what about the evening dose?')
+
+        memory = await load_memory(self.session.session_key)
+        self.assertTrue(memory['summary'].startswith('💊 **Stub answer'))
+        self.assertLessEqual(len(memory['summary']), 60 * 4)
+        self.assertLessEqual(memory_tokens(memory), 200)
+        # The latest exchange is always kept verbatim
+        self.assertIn('Question 11', memory['turns'][-2]['text'])
+
+    async def test_failed_summary_keeps_old_summary_and_drops_old_turns(self):
+        memory = {'summary': 'Asked about paracetamol.', 'turns': []}
+        for i in range(6):
+            memory = await remember_exchange('abc', memory, f'Question {i} ' + 'x' * 150, 'Answer ' + 'y' * 150, FailingProvider())
+
+        self.assertEqual(memory['summary'], 'Asked about paracetamol.')
+        self.assertLessEqual(memory_tokens(memory), 200)
+
+    async def test_new_analysis_starts_a_new_conversation(self):
+        await self.login()
+        await self.chat('Is paracetamol safe for me?')
+        self.assertTrue((await load_memory(self.session.session_key))['turns'])
+
+        await self.async_client.post('/analyze-prescription/', json.dumps({'prescription': 'Amoxicillin 250mg'}), content_type='application/json')
+
+        self.assertEqual(await load_memory(self.session.session_key), {'summary': '', 'turns': []})
+
+
+SCRIPTED_ANALYSIS = """💊 **Paracetamol** for fever. [Reminder: 8:00 AM]
+
+📝 AI-generated, not medical advice.
+
+```medications
+[{"name": "Paracetamol", "strength": "500mg", "dosage": "1 tablet", "frequency": "Twice daily", "duration": "5 days"},
+ {"name": "Amoxicillin", "strength": "500mg", "dosage": null, "frequency": "Thrice daily", "duration": null},
+ {"name": "Unknownol", "strength": null},
+ {"strength": "10mg"}]
+```"""
+
+
+class ScriptedProvider:
+    async def generate(self, prompt):
+        return SCRIPTED_ANALYSIS
+
+
+@override_settings(AI_PROVIDER='user.tests.ScriptedProvider')
+class AnalysisMedicationsTests(TestCase):
+    def setUp(self):
+        caches['ai_analysis'].clear()
+        user = User.objects.create(name='Ravi', email='ravi@example.com')
+        session = self.client.session
+        session['user_id'] = user.id
+        session.save()
+        for i, (stock, prices) in enumerate([
+            ({'Paracetamol 500 Tab': 5, 'Amoxicillin 250mg': 3}, {'Paracetamol 500 Tab': 12, 'Amoxicillin 250mg': 30}),
+            ({'Paracetamol 500mg': 0, 'Cetirizine 10': 4}, {'Paracetamol 500mg': 9, 'Cetirizine 10': 5}),
+        ]):
+            shop = MedicalShop.objects.create(shop_name=f'Shop {i}', email=f'shop{i}@example.com', owner_name='Owner', location='Town')
+            for name, quantity in stock.items():
+                Medicine.objects.create(shop=shop, name=name, quantity=quantity, price=prices[name])
+
+    def test_analysis_returns_medications_with_availability(self):
+        response = self.client.post('/analyze-prescription/', json.dumps({'prescription': 'Paracetamol 500mg, Amoxicillin'}), content_type='application/json')
+
+        data = response.json()
+        self.assertNotIn('```medications', data['analysis'])
+        self.assertEqual(data['reminder_times'], ['8:00 AM'])
+        paracetamol, amoxicillin, unknownol = data['medications']
+        # The out-of-stock cheaper offer is not listed
+        self.assertEqual((paracetamol['in_stock'], paracetamol['exact_strength'], paracetamol['lowest_price']), (True, True, 12.0))
+        self.assertEqual([offer['shop_name'] for offer in paracetamol['offers']], ['Shop 0'])
+        # No 500mg in stock, so the other strengths are offered
+        self.assertEqual((amoxicillin['in_stock'], amoxicillin['exact_strength']), (True, False))
+        self.assertEqual(amoxicillin['offers'][0]['medicine_name'], 'Amoxicillin 250mg')
+        self.assertEqual((unknownol['in_stock'], unknownol['offers'], unknownol['strength']), (False, [], None))
+
+    def test_lookup_is_two_queries_for_any_number_of_medications(self):
+        _, medications = extract_medications(SCRIPTED_ANALYSIS)
+        many = medications + [{**medications[0], 'name': f'Medicine {i}'} for i in range(15)]
+
+        with self.assertNumQueries(2):
+            available = attach_availability(many)
+        self.assertEqual(len(available), 18)
+
+    def test_malformed_block_gives_no_medications(self):
+        markdown, medications = extract_medications('Take rest.\n```medications\n[{"name": "Para')
+
+        self.assertEqual((markdown, medications), ('Take rest.', []))
+
+
+@override_settings(USER_DASHBOARD_PRESCRIPTIONS=5, USER_DASHBOARD_APPOINTMENTS=4, USER_DASHBOARD_DOCTORS=6)
+class UserDashboardTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(name='Ravi', email='ravi@example.com')
+        session = self.client.session
+        session['user_id'] = self.user.id
+        session['user_email'] = self.user.email
+        session.save()
+        self.shops = [
+            MedicalShop.objects.create(shop_name=f'Shop {i}', email=f'shop{i}@example.com', owner_name='Owner', location='Town')
+            for i in range(2)
+        ]
+        self.medicines = [Medicine.objects.create(shop=shop, name='Paracetamol 500', quantity=5, price=10) for shop in self.shops]
+
+    def add_history(self, count):
+        start = Doctor.objects.count()
+        for i in range(start, start + count):
+            doctor = Doctor.objects.create(name=f'Doctor {i}', email=f'doctor{i}@example.com')
+            prescription = Prescription.objects.create(
+                doctor=doctor, patient_name='Ravi', patient_email=self.user.email, age=40,
+                medications=[{'name': 'Paracetamol 500mg'}],
+            )
+            PrescriptionMedicineMatch.objects.bulk_create([
+                PrescriptionMedicineMatch(prescription=prescription, medicine=medicine, shop=medicine.shop, medicine_name='Paracetamol 500mg')
+                for medicine in self.medicines
+            ])
+            Appointment.objects.create(user=self.user, doctor=doctor, appointment_date='2026-01-01', appointment_time='10:00')
+
+    def dashboard_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/udashboard/')
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_does_not_grow_with_history(self):
+        self.add_history(2)
+        _, few = self.dashboard_queries()
+        self.add_history(30)
+        response, many = self.dashboard_queries()
+
+        self.assertEqual(few, many)
+        self.assertEqual(response.context['prescription_count'], 32)
+        self.assertEqual(len(response.context['prescriptions']), 5)
+
+    def test_each_medicine_and_shop_is_listed_once_from_the_newest_match(self):
+        self.add_history(3)
+        response, _ = self.dashboard_queries()
+
+        matches = list(response.context['matched_medicines'])
+        self.assertEqual(sorted((match.medicine_id, match.shop_id) for match in matches),
+                         sorted((medicine.id, medicine.shop_id) for medicine in self.medicines))
+        newest = Prescription.objects.order_by('-id').first()
+        self.assertTrue(all(match.prescription_id == newest.id for match in matches))
+
+    def history(self, **params):
+        return self.client.get('/prescription-history/', params)
+
+    def test_history_pages_walk_every_prescription_once_even_with_equal_timestamps(self):
+        self.add_history(12)
+        # Half the prescriptions share one timestamp, so ordering falls back to the id
+        Prescription.objects.filter(id__in=Prescription.objects.order_by('id').values('id')[:6]).update(
+            created_at=Prescription.objects.order_by('id').first().created_at
+        )
+        expected = list(Prescription.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+        seen, cursor = [], None
+        while True:
+            data = self.history(**({'cursor': cursor, 'limit': 4} if cursor else {'limit': 4})).json()
+            seen += [prescription['id'] for prescription in data['prescriptions']]
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+
+        self.assertEqual(seen, expected)
+        self.assertEqual(data['prescriptions'][-1]['medications'][0]['name'], 'Paracetamol 500mg')
+
+    def test_dashboard_renders_only_the_first_page(self):
+        self.add_history(7)
+        response = self.client.get('/udashboard/')
+
+        first_page = [prescription.id for prescription in response.context['prescriptions']]
+        rest = self.history(cursor=response.context['next_cursor']).json()
+        self.assertEqual(first_page + [prescription['id'] for prescription in rest['prescriptions']],
+                         list(Prescription.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+        self.assertIsNone(rest['next_cursor'])
+
+    def test_appointments_and_doctors_are_capped_and_doctors_searchable(self):
+        self.add_history(10)
+        response = self.client.get('/udashboard/')
+
+        self.assertEqual(len(response.context['appointments']), 4)
+        self.assertTrue(response.context['more_appointments'])
+        self.assertEqual([doctor.name for doctor in response.context['available_doctors']],
+                         sorted(f'Doctor {i}' for i in range(10))[:6])
+        self.assertTrue(response.context['more_doctors'])
+
+        found = self.client.get('/search-doctors/', {'q': 'doctor 9'}).json()
+        self.assertEqual([doctor['name'] for doctor in found['doctors']], ['Doctor 9'])
+        self.assertEqual(self.client.get('/search-doctors/', {'limit': 'x'}).status_code, 400)
+
+    def test_history_merges_account_and_email_prescriptions_each_read_by_index(self):
+        self.add_history(4)
+        doctor = Doctor.objects.first()
+        # Linked to the account under another email, and to both
+        for email, user in [('old@example.com', self.user), (self.user.email, self.user)] * 2:
+            Prescription.objects.create(doctor=doctor, user=user, patient_name='Ravi', patient_email=email, age=40)
+        expected = list(Prescription.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+        seen, cursor = [], None
+        with CaptureQueriesContext(connection) as queries:
+            while True:
+                page, next_cursor = prescription_history_page(self.user.id, self.user.email, cursor, 3)
+                seen += [prescription.id for prescription in page]
+                if not next_cursor:
+                    break
+                cursor = decode_history_cursor(next_cursor)
+
+        self.assertEqual(seen, expected)
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as explain:
+                for query in queries:
+                    explain.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                    plan = ' '.join(row[-1] for row in explain.fetchall())
+                    self.assertRegex(plan, r'USING INDEX doctor_pres_(user_id|patient)_\w+_idx')
+                    self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_history_rejects_bad_cursors_and_other_patients(self):
+        self.add_history(1)
+        self.assertEqual(self.history(cursor='not-a-cursor').status_code, 400)
+
+        self.client.cookies.clear()
+        self.assertEqual(self.history().status_code, 401)
+        other = User.objects.create(name='Meena', email='meena@example.com')
+        session = self.client.session
+        session['user_id'] = other.id
+        session['user_email'] = other.email
+        session.save()
+        self.assertEqual(self.history().json()['prescriptions'], [])
@@ -1,28 +1,133 @@
 from django.shortcuts import render, redirect
 from django.contrib import messages
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import caches
 from django.core.mail import EmailMessage
 from django.db import models, IntegrityError
 from django.utils import timezone
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from datetime import datetime
+import asyncio
 import json
-import time
+import math
+import queue
+import threading
+from asgiref.sync import sync_to_async
+from .ai import AINotConfigured, AITimeout, get_provider
+from .chat_memory import aforget_memory, forget_memory, load_memory, memory_prompt, remember_exchange
 from .models import User, Order
 from doctor.models import Prescription
 from medicalshop.models import Medicine, PrescriptionMedicineMatch
 from hello.models import LoginLog
+from hello.ratelimit import take_tokens
 
-# Rate limiting for API calls
-last_api_call = 0
-rate_limit_delay = 2  # seconds
+def rate_limit_api_call(request):
+    """
+    Take a token from the user's and the global AI token bucket. The buckets
+    live in the database so the limits hold across workers; when either is
+    empty the caller gets a 429 with Retry-After straight away.
+    """
+    from django.conf import settings
+    
+    allowed, retry_after = take_tokens([
+        (f"ai:user:{request.session.get('user_id')}", settings.AI_USER_RATE_PER_MINUTE / 60, settings.AI_USER_BURST),
+        ('ai:global', settings.AI_GLOBAL_RATE_PER_MINUTE / 60, settings.AI_GLOBAL_BURST),
+    ])
+    if allowed:
+        return None
+    
+    response = JsonResponse(
+        {'error': f'Too many AI requests. Please try again in {retry_after} seconds.', 'retry_after': retry_after},
+        status=429,
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+def wants_event_stream(request):
+    """True when the client asked for server-sent events instead of one JSON reply"""
+    return 'text/event-stream' in request.META.get('HTTP_ACCEPT', '') or request.GET.get('stream') == '1'
+
+def sse_event(data, event=None):
+    """One server-sent event; the payload is JSON so newlines in model text cannot break the framing"""
+    lines = [f"event: {event}"] if event else []
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+def threaded_events(events):
+    """
+    Drive an async event iterator on its own event loop in a worker thread
+    and hand each event over as soon as it is produced. WSGI servers only
+    take sync iterators, and Django would otherwise collect an async one
+    completely before sending its first byte. Closing the iterator (the
+    client went away) stops the worker after its current event.
+    """
+    handoff = queue.Queue()
+    stopped = threading.Event()
+    finished = object()
+
+    async def pump():
+        try:
+            async for event in events:
+                handoff.put(event)
+                if stopped.is_set():
+                    break
+        finally:
+            await events.aclose()
+
+    def run():
+        try:
+            asyncio.run(pump())
+        except Exception as e:
+            print(f"[AI] Event stream worker failed: {e}")
+        finally:
+            handoff.put(finished)
 
-def rate_limit_api_call():
-    global last_api_call
-    current_time = time.time()
-    if current_time - last_api_call < rate_limit_delay:
-        time.sleep(rate_limit_delay - (current_time - last_api_call))
-    last_api_call = time.time()
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while (event := handoff.get()) is not finished:
+            yield event
+    finally:
+        stopped.set()
+
+def event_stream_response(request, events):
+    """SSE response for an async event iterator, streamed as it is produced under both ASGI and WSGI"""
+    if not isinstance(request, ASGIRequest):
+        events = threaded_events(events)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream until it is complete
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+async def stream_generation(chunks, on_complete):
+    """
+    Relay streamed model output as SSE: one 'delta' event per chunk of text,
+    then a 'done' event with whatever on_complete(full_text) returns, or an
+    'error' event if generation fails or comes back empty.
+    """
+    text = []
+    try:
+        async for chunk in chunks:
+            text.append(chunk)
+            yield sse_event({"text": chunk}, event="delta")
+        
+        done = await on_complete("".join(text))
+    except Exception as e:
+        print(f"[AI] Streaming generation failed: {e}")
+        yield sse_event({"error": str(e)}, event="error")
+        return
+    if 'error' in done:
+        yield sse_event(done, event="error")
+    else:
+        yield sse_event(done, event="done")
+
+async def replay_events(events):
+    """Already-built events as an async iterator, so ASGI servers can stream them without a thread"""
+    for event in events:
+        yield event
 
 def userLogin(request):
     # If already logged in, redirect to dashboard
@@ -66,6 +171,8 @@ def userLogin(request):
 
 def userLogout(request):
     """Logout user and redirect to home"""
+    if request.session.session_key:
+        forget_memory(request.session.session_key)
     request.session.flush()
     return redirect('home')
 
@@ -96,6 +203,70 @@ def registerUser(request):
     
     return render(request,"resisteru.html")
 
+def encode_history_cursor(prescription):
+    """Opaque keyset cursor pointing just past `prescription` in newest-first order"""
+    return urlsafe_base64_encode(f"{prescription.created_at.isoformat()}|{prescription.id}".encode())
+
+def decode_history_cursor(cursor):
+    """(created_at, id) of a cursor from encode_history_cursor; ValueError if it is not one"""
+    try:
+        created_at, prescription_id = urlsafe_base64_decode(cursor).decode().split('|')
+        return datetime.fromisoformat(created_at), int(prescription_id)
+    except (TypeError, UnicodeDecodeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+def prescription_history_page(user_id, user_email, cursor=None, limit=None):
+    """
+    One page of a patient's prescriptions, newest first, and the cursor of
+    the next page (None on the last). Pages are keyed on (created_at, id)
+    rather than an offset, so every page costs the same however deep it is
+    and prescriptions written meanwhile never shift or repeat rows.
+    
+    A prescription belongs to the patient through their account or their
+    email. Each of the two is paged on its own (user, created_at, id) or
+    (patient_email, created_at, id) index, limit + 1 rows each, and the two
+    short lists are merged; one OR-ed query would fall back to the plain
+    foreign key index and sort every matching row.
+    """
+    from django.conf import settings
+    limit = limit or settings.USER_DASHBOARD_PRESCRIPTIONS
+    branches = [models.Q(user_id=user_id)]
+    if user_email:
+        branches.append(models.Q(patient_email=user_email))
+    
+    merged = {}
+    for branch in branches:
+        prescriptions = Prescription.objects.filter(branch).select_related('doctor').order_by('-created_at', '-id')
+        if cursor is not None:
+            created_at, last_id = cursor
+            # The range on created_at is what the index seeks on; the id only breaks ties
+            prescriptions = prescriptions.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=last_id)
+        for prescription in prescriptions[:limit + 1]:
+            merged[prescription.id] = prescription
+    page = sorted(merged.values(), key=lambda prescription: (prescription.created_at, prescription.id), reverse=True)[:limit + 1]
+    next_cursor = encode_history_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
+
+def prescription_summary(prescription):
+    """What the dashboard shows of a prescription, as JSON"""
+    return {
+        'id': prescription.id,
+        'doctor_name': prescription.doctor.name,
+        'created_at': prescription.created_at.isoformat(),
+        'date': timezone.localtime(prescription.created_at).strftime('%B %d, %Y'),
+        'patient_name': prescription.patient_name,
+        'age': prescription.age,
+        'weight': prescription.weight,
+        'height': prescription.height,
+        'diagnosis': prescription.diagnosis or '',
+        'notes': prescription.notes or '',
+        'sent_via_email': prescription.sent_via_email,
+        'medications': [
+            {field: str(med.get(field) or '') for field in ('name', 'dosage', 'frequency', 'duration')}
+            for med in prescription.medications if isinstance(med, dict)
+        ],
+    }
+
 def userDashboard(request):
     if 'user_id' not in request.session:
         return redirect('userLogin')
@@ -103,46 +274,102 @@ def userDashboard(request):
     user_id = request.session.get('user_id')
     user_email = request.session.get('user_email')
     
-    # Get prescriptions for this user
+    # Get prescriptions for this user; only the first page is rendered, the rest is fetched on scroll
     from doctor.models import Prescription
     from medicalshop.models import PrescriptionMedicineMatch
-    prescriptions = Prescription.objects.filter(
+    from django.conf import settings
+    user_prescriptions = Prescription.objects.filter(
         models.Q(user_id=user_id) | models.Q(patient_email=user_email)
-    ).order_by('-created_at')
+    )
+    prescription_count = user_prescriptions.count()
+    prescriptions, next_cursor = prescription_history_page(user_id, user_email)
     
     # Get matched medicines for user's prescriptions - prevent duplicates
-    # Use distinct on medicine_id and shop_id to avoid showing same medicine-shop combination twice
-    all_matches = PrescriptionMedicineMatch.objects.filter(
-        prescription__in=prescriptions
-    ).select_related('shop', 'medicine', 'prescription').order_by('-matched_at')
-    
-    # Deduplicate by medicine and shop combination
-    seen = set()
-    matched_medicines = []
-    for match in all_matches:
-        key = (match.medicine_id, match.shop_id)
-        if key not in seen:
-            seen.add(key)
-            matched_medicines.append(match)
-    
-    # Get available doctors for appointments
+    # The database keeps the newest match per medicine and shop combination,
+    # so only the rows shown are ever loaded
+    latest_matches = PrescriptionMedicineMatch.objects.filter(
+        prescription__in=user_prescriptions.values('id')
+    ).values('medicine_id', 'shop_id').annotate(latest=models.Max('id')).values('latest')
+    matched_medicines = PrescriptionMedicineMatch.objects.filter(
+        id__in=latest_matches
+    ).select_related('shop', 'medicine').order_by('-matched_at', '-id')[:settings.USER_DASHBOARD_MATCHES]
+    
+    # Get available doctors for appointments; past the first page the booking form searches for them
     from doctor.models import Doctor
-    available_doctors = Doctor.objects.all().order_by('name')
+    available_doctors = list(Doctor.objects.only('id', 'name', 'specialty').order_by('name', 'id')[:settings.USER_DASHBOARD_DOCTORS + 1])
+    more_doctors = len(available_doctors) > settings.USER_DASHBOARD_DOCTORS
     
-    # Get user's appointments
+    # Get user's most recent appointments, read backwards along the (user, date, time) index
     from .models import Appointment
-    appointments = Appointment.objects.filter(user_id=user_id).order_by('-appointment_date', '-appointment_time')
+    appointments = list(
+        Appointment.objects.filter(user_id=user_id).select_related('doctor')
+        .order_by('-appointment_date', '-appointment_time')[:settings.USER_DASHBOARD_APPOINTMENTS + 1]
+    )
+    more_appointments = len(appointments) > settings.USER_DASHBOARD_APPOINTMENTS
     
     context = {
         'prescriptions': prescriptions,
+        'prescription_count': prescription_count,
+        'next_cursor': next_cursor,
         'user_name': request.session.get('user_name', 'User'),
         'matched_medicines': matched_medicines,
-        'available_doctors': available_doctors,
-        'appointments': appointments,
+        'available_doctors': available_doctors[:settings.USER_DASHBOARD_DOCTORS],
+        'more_doctors': more_doctors,
+        'appointments': appointments[:settings.USER_DASHBOARD_APPOINTMENTS],
+        'more_appointments': more_appointments,
     }
     
     return render(request,"dashu.html", context)
 
+@require_http_methods(["GET"])
+def prescriptionHistory(request):
+    """A page of the patient's prescriptions: GET ?cursor=<next_cursor of the previous page>&limit=<n>"""
+    if 'user_id' not in request.session:
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
+    
+    from django.conf import settings
+    try:
+        cursor = request.GET.get('cursor')
+        cursor = decode_history_cursor(cursor) if cursor else None
+        limit = min(max(int(request.GET.get('limit', settings.USER_DASHBOARD_PRESCRIPTIONS)), 1), 50)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    prescriptions, next_cursor = prescription_history_page(
+        request.session['user_id'], request.session.get('user_email'), cursor, limit
+    )
+    
+    return JsonResponse({
+        'success': True,
+        'prescriptions': [prescription_summary(prescription) for prescription in prescriptions],
+        'next_cursor': next_cursor,
+    })
+
+@require_http_methods(["GET"])
+def searchDoctors(request):
+    """Doctors to book with whose name or specialty starts with q: GET ?q=<prefix>&limit=<n>"""
+    if 'user_id' not in request.session:
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
+    
+    try:
+        prefix = request.GET.get('q', '').strip()
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 50)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+    
+    from doctor.models import Doctor
+    doctors = Doctor.objects.only('id', 'name', 'specialty').order_by('name', 'id')
+    if prefix:
+        doctors = doctors.filter(models.Q(name__istartswith=prefix) | models.Q(specialty__istartswith=prefix))
+    
+    return JsonResponse({
+        'success': True,
+        'doctors': [
+            {'id': doctor.id, 'name': doctor.name, 'specialty': doctor.specialty or ''}
+            for doctor in doctors[:limit]
+        ],
+    })
+
 @require_http_methods(["POST"])
 def placeOrder(request):
     if 'user_id' not in request.session:
@@ -242,41 +469,100 @@ def bookAppointment(request):
         return JsonResponse({'error': str(e)}, status=500)
 
 # AI Assistant and Prescription Analysis functions remain the same
+# Bump when the analysis prompt or model changes so cached analyses are not reused
+ANALYSIS_PROMPT_VERSION = 2
+
+MEDICATION_FIELDS = ('name', 'strength', 'dosage', 'frequency', 'duration')
+
+def analysis_cache_key(prescription_text, image_bytes=None):
+    """Cache key for an analysis: prompt version plus a hash of the image bytes and the normalized text"""
+    import hashlib
+    
+    digest = hashlib.sha256(f"v{ANALYSIS_PROMPT_VERSION}\n".encode())
+    if image_bytes:
+        digest.update(b"image:" + hashlib.sha256(image_bytes).digest())
+    # Case and spacing differences in typed prescriptions do not change the analysis
+    normalized = " ".join(prescription_text.split()).lower()
+    digest.update(b"text:" + normalized.encode("utf-8"))
+    return f"analysis:{digest.hexdigest()}"
+
+def extract_medications(analysis_text):
+    """
+    Split the analysis into its Markdown and the ```medications JSON block the
+    prompt asks for at the end. Returns (markdown, medications); a missing or
+    malformed block gives no medications rather than an error.
+    """
+    import re
+    
+    match = re.search(r"```medications\s*(.*?)(?:```|$)", analysis_text, re.DOTALL)
+    if not match:
+        return analysis_text, []
+    markdown = (analysis_text[:match.start()] + analysis_text[match.end():]).strip()
+    try:
+        items = json.loads(match.group(1))
+    except json.JSONDecodeError:
+        return markdown, []
+    
+    medications = []
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict) or not str(item.get('name') or '').strip():
+            continue
+        medications.append({
+            field: str(item[field]).strip() if item.get(field) not in (None, '') else None
+            for field in MEDICATION_FIELDS
+        })
+    return markdown, medications[:20]
+
+def attach_availability(medications):
+    """
+    The medications with their in-stock offers. Every name is looked up in
+    one batch, with and without its strength, so a prescribed strength that
+    no shop has still shows the other strengths that are available.
+    """
+    from medicalshop.search import availability_for_names
+    
+    def full_name(med):
+        return f"{med['name']} {med['strength']}" if med['strength'] else med['name']
+    
+    offers = availability_for_names(
+        [med['name'] for med in medications] + [full_name(med) for med in medications]
+    )
+    available = []
+    for med in medications:
+        exact = offers[full_name(med)]
+        rows = exact or offers[med['name']]
+        available.append({
+            **med,
+            'in_stock': bool(rows),
+            'exact_strength': bool(exact),
+            'lowest_price': rows[0]['price'] if rows else None,
+            'offers': rows,
+        })
+    return available
+
 def aiAssistant(request):
     if 'user_id' not in request.session:
         return redirect('userLogin')
     return render(request, "ai_assistant.html")
 
 @require_http_methods(["POST"])
-def analyzePrescription(request):
+async def analyzePrescription(request):
     """
     Analyze a prescription sent either as:
     - multipart/form-data with 'prescription_image' and/or 'prescription_text'
     - application/json with 'prescription' field
+    Async so that, under ASGI, a request waiting on Gemini does not hold a worker thread.
     """
-    if 'user_id' not in request.session:
+    if await request.session.aget('user_id') is None:
         return JsonResponse({'error': 'Unauthorized'}, status=401)
 
-    # Simple rate limit
-    rate_limit_api_call()
-
     try:
-        import google.generativeai as genai
-        from myproject.config import GEMINI_API_KEY
-        import base64
         import re
-
-        if not GEMINI_API_KEY:
-            return JsonResponse(
-                {'error': 'AI analysis is not configured. Please set GEMINI_API_KEY in .env.'},
-                status=500,
-            )
-
-        genai.configure(api_key=GEMINI_API_KEY)
+        from .imaging import InvalidImage, prepare_prescription_image
 
         content_type = request.META.get("CONTENT_TYPE", "")
         prescription_text = ""
-        image_parts = None
+        image_bytes = None
 
         # Multipart form: handle image + optional text
         if content_type.startswith("multipart/form-data"):
@@ -296,14 +582,6 @@ def analyzePrescription(request):
                     )
 
                 image_bytes = uploaded_file.read()
-                image_parts = [
-                    {
-                        "inline_data": {
-                            "mime_type": uploaded_file.content_type,
-                            "data": base64.b64encode(image_bytes).decode("utf-8"),
-                        }
-                    }
-                ]
 
         # JSON body: text-only analysis
         else:
@@ -314,12 +592,55 @@ def analyzePrescription(request):
                 return JsonResponse({'error': 'Invalid JSON'}, status=400)
             prescription_text = (data.get("prescription") or "").strip()
 
-        if not prescription_text and not image_parts:
+        if not prescription_text and not image_bytes:
             return JsonResponse(
                 {'error': 'Please upload an image or enter prescription text.'},
                 status=400,
             )
 
+        # A new prescription starts a new conversation
+        if request.session.session_key:
+            await aforget_memory(request.session.session_key)
+
+        # Re-uploads of the same prescription are answered from the cache,
+        # without spending rate-limit tokens or API quota
+        cache_key = analysis_cache_key(prescription_text, image_bytes)
+        cached = await caches['ai_analysis'].aget(cache_key)
+        if cached is not None:
+            await request.session.aset("image_summary", cached["image_summary"] or "")
+            # Stock changes, so availability is looked up fresh even for a cached analysis
+            hit = {"success": True, "cached": True, **cached,
+                   "medications": await sync_to_async(attach_availability)(cached.get("medications", []))}
+            if wants_event_stream(request):
+                return event_stream_response(request, replay_events([sse_event(hit, event="done")]))
+            return JsonResponse(hit)
+
+        image_parts = None
+        if image_bytes:
+            # Downscaling is CPU work; keep it off the event loop
+            try:
+                prepared, mime_type, stats = await sync_to_async(prepare_prescription_image, thread_sensitive=False)(image_bytes)
+            except InvalidImage:
+                return JsonResponse({'error': 'Could not read the image. Please upload a JPG, PNG or WEBP photo.'}, status=400)
+            print(
+                f"[AI] Prescription image {stats['original_bytes'] // 1024} KB -> {stats['prepared_bytes'] // 1024} KB "
+                f"({stats['bytes_saved'] // 1024} KB saved, {stats['seconds'] * 1000:.0f} ms)"
+            )
+            # Raw bytes: the client library encodes them for the wire itself
+            image_parts = [{"inline_data": {"mime_type": mime_type, "data": prepared}}]
+
+        limited = await sync_to_async(rate_limit_api_call)(request)
+        if limited:
+            return limited
+
+        try:
+            provider = get_provider()
+        except AINotConfigured:
+            return JsonResponse(
+                {'error': 'AI analysis is not configured. Please set GEMINI_API_KEY in .env.'},
+                status=500,
+            )
+
         # Build prompt parts similar to your Flask logic
         prompt_parts = [
             "You are a helpful AI assistant specializing in explaining medical prescriptions. "
@@ -336,6 +657,11 @@ def analyzePrescription(request):
             "7.  🚨 **Recommendation:** Recommend if a reminder is needed in the format "
             "[Reminder: 8:00 AM].\n"
             "8.  📝 **Disclaimer:** Add a clear disclaimer that this is AI-generated and not medical advice.\n\n"
+            "After the disclaimer, end with a fenced code block whose language is `medications`, holding a JSON "
+            "array with one object per medication: "
+            '{"name": ..., "strength": ..., "dosage": ..., "frequency": ..., "duration": ...}. '
+            "Put the strength (e.g. \"500mg\") only in `strength`, use null for anything not stated, "
+            "and do not mention this block in the text.\n\n"
             "Prescription Details:\n",
         ]
 
@@ -358,49 +684,55 @@ def analyzePrescription(request):
             prompt_parts.append(prescription_text)
             image_summary = prescription_text
 
-        # Use a multimodal-capable Gemini 2.5 Flash model
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content(prompt_parts)
-        analysis_text = getattr(response, "text", "") or ""
+        async def finish_analysis(analysis_text):
+            if not analysis_text:
+                return {'error': 'AI did not return any analysis. Please try again.'}
 
-        if not analysis_text:
-            return JsonResponse(
-                {'error': 'AI did not return any analysis. Please try again.'},
-                status=500,
+            # Extract reminder times like [Reminder: 8:00 AM]
+            reminder_times = re.findall(
+                r"\[Reminder: (\d{1,2}:\d{2} (?:AM|PM))\]", analysis_text
             )
-
-        # Extract reminder times like [Reminder: 8:00 AM]
-        reminder_times = re.findall(
-            r"\[Reminder: (\d{1,2}:\d{2} (?:AM|PM))\]", analysis_text
-        )
-
-        # Store summary in session for optional use
-        request.session["image_summary"] = image_summary or ""
-
-        return JsonResponse(
-            {
-                "success": True,
+            analysis_text, medications = extract_medications(analysis_text)
+            result = {
                 "analysis": analysis_text,
                 "image_summary": image_summary,
                 "reminder_times": reminder_times,
+                "medications": medications,
             }
-        )
+            await caches['ai_analysis'].aset(cache_key, result)
+            return {"success": True, "cached": False, **result,
+                    "medications": await sync_to_async(attach_availability)(medications)}
+
+        # Store summary in session for optional use (before streaming starts,
+        # since the session is saved when the response headers go out)
+        await request.session.aset("image_summary", image_summary or "")
+
+        if wants_event_stream(request):
+            return event_stream_response(request, stream_generation(provider.stream(prompt_parts), finish_analysis))
+
+        result = await finish_analysis(await provider.generate(prompt_parts))
+        if 'error' in result:
+            return JsonResponse(result, status=500)
+        return JsonResponse(result)
+    except AITimeout:
+        return JsonResponse({'error': 'The AI service took too long to answer. Please try again.'}, status=504)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
 @require_http_methods(["POST"])
-def chatPrescription(request):
+async def chatPrescription(request):
     """
     Chat about a previously analyzed prescription.
-    Frontend sends JSON: { message, history, image_summary }
+    Frontend sends JSON: { message }. The conversation so far is kept on the
+    server per session (see chat_memory); image_summary defaults to the one
+    stored by the last analysis.
     """
-    if 'user_id' not in request.session:
+    if await request.session.aget('user_id') is None:
         return JsonResponse({'error': 'Unauthorized'}, status=401)
 
-    # Simple rate limit
-    rate_limit_api_call()
-
     try:
+        from django.conf import settings
+
         body = request.body or b"{}"
         try:
             data = json.loads(body.decode("utf-8"))
@@ -408,23 +740,28 @@ def chatPrescription(request):
             return JsonResponse({'error': 'Invalid JSON'}, status=400)
 
         user_message = (data.get("message") or "").strip()
-        image_summary = (data.get("image_summary") or "").strip()
+        image_summary = (data.get("image_summary") or await request.session.aget("image_summary") or "").strip()
 
         if not user_message:
             return JsonResponse({'error': 'Message is required'}, status=400)
+        if len(user_message) > settings.CHAT_MESSAGE_MAX_CHARS:
+            return JsonResponse(
+                {'error': f'Message is too long. Please keep it under {settings.CHAT_MESSAGE_MAX_CHARS} characters.'},
+                status=400,
+            )
 
-        import google.generativeai as genai
-        from myproject.config import GEMINI_API_KEY
+        limited = await sync_to_async(rate_limit_api_call)(request)
+        if limited:
+            return limited
 
-        if not GEMINI_API_KEY:
+        try:
+            provider = get_provider()
+        except AINotConfigured:
             return JsonResponse(
                 {'error': 'AI chat is not configured. Please set GEMINI_API_KEY in .env.'},
                 status=500,
             )
 
-        genai.configure(api_key=GEMINI_API_KEY)
-        model = genai.GenerativeModel("gemini-2.5-flash")
-
         # Build prompt with optional context
         prompt = [
             "You are an AI assistant knowledgeable about medications. "
@@ -438,61 +775,153 @@ def chatPrescription(request):
                 f"\nPrescription Context (from previous analysis): {image_summary}\n"
             )
 
+        session_key = request.session.session_key
+        memory = await load_memory(session_key) if session_key else None
+        if memory:
+            prompt.extend(memory_prompt(memory))
+
         prompt.append(f"User question: {user_message}\n")
         prompt.append(
             "Answer in a short, structured way using Markdown, and end with a disclaimer."
         )
 
-        response = model.generate_content(prompt)
-        answer = getattr(response, "text", "") or "Sorry, I could not generate a response."
-
-        return JsonResponse(
-            {
+        async def finish_reply(answer):
+            if answer and memory is not None:
+                await remember_exchange(session_key, memory, user_message, answer, provider)
+            return {
                 "success": True,
-                "reply": answer,
+                "reply": answer or "Sorry, I could not generate a response.",
                 # Optional fields kept for frontend compatibility
                 "reminder_time": None,
                 "reminder_medication": None,
             }
-        )
+
+        if wants_event_stream(request):
+            return event_stream_response(request, stream_generation(provider.stream(prompt), finish_reply))
+
+        return JsonResponse(await finish_reply(await provider.generate(prompt)))
+    except AITimeout:
+        return JsonResponse({'error': 'The AI service took too long to answer. Please try again.'}, status=504)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
 @require_http_methods(["POST"])
 def searchMedicine(request):
-    """Search for medicines across all medical shops"""
+    """
+    Search for medicines across all medical shops.
+    
+    JSON body: { search_term, mode, limit, latitude, longitude, radius_km, k }
+    - mode "exact" (default): every medicine whose name contains the term, by name
+    - mode "fuzzy": medicines for the `limit` names closest to the term, by edit distance
+    - latitude/longitude ("near me"): only in-stock results within radius_km
+      (default 10, max 50) or the k nearest, sorted by distance
+    """
     if 'user_id' not in request.session:
         return JsonResponse({'error': 'Unauthorized'}, status=401)
     
     try:
         data = json.loads(request.body)
         search_term = data.get('search_term', '').strip().lower()
+        mode = data.get('mode', 'exact')
+        latitude = data.get('latitude')
+        longitude = data.get('longitude')
         
         if not search_term:
             return JsonResponse({'error': 'Search term is required'}, status=400)
         
-        from medicalshop.models import Medicine
-        # Search medicines by name (case-insensitive)
-        medicines = Medicine.objects.filter(
-            name__icontains=search_term
-        ).select_related('shop').order_by('name')
+        if mode not in ['exact', 'fuzzy']:
+            return JsonResponse({'error': 'Invalid search mode'}, status=400)
+        
+        near_me = latitude not in (None, '') and longitude not in (None, '')
+        if near_me:
+            try:
+                latitude = float(latitude)
+                longitude = float(longitude)
+            except (TypeError, ValueError):
+                return JsonResponse({'error': 'Invalid coordinates'}, status=400)
+            # NaN fails every comparison, so it is rejected here too
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                return JsonResponse({'error': 'Invalid coordinates'}, status=400)
+        
+        from medicalshop.geo import encode_geohash, geohash_center
+        from medicalshop.search import NEARBY_DEFAULT_RADIUS_KM, NEARBY_MAX_RADIUS_KM, get_search_cache, rank_nearby, search_medicines
+        
+        try:
+            limit = min(max(int(data.get('limit', 10)), 1), 50) if mode == 'fuzzy' else None
+        except (TypeError, ValueError, OverflowError):
+            return JsonResponse({'error': 'Invalid limit'}, status=400)
+        radius_km = k = cell = None
+        if near_me:
+            if data.get('k'):
+                try:
+                    k = min(max(int(data['k']), 1), 50)
+                except (TypeError, ValueError, OverflowError):
+                    return JsonResponse({'error': 'k must be a whole number'}, status=400)
+            else:
+                try:
+                    radius_km = data.get('radius_km')
+                    radius_km = NEARBY_DEFAULT_RADIUS_KM if radius_km in (None, '') else float(radius_km)
+                except (TypeError, ValueError):
+                    return JsonResponse({'error': 'Invalid radius'}, status=400)
+                if not math.isfinite(radius_km) or radius_km <= 0:
+                    return JsonResponse({'error': 'Invalid radius'}, status=400)
+                radius_km = min(radius_km, NEARBY_MAX_RADIUS_KM)
+            cell = encode_geohash(latitude, longitude)
+        
+        # Results are cached per normalized term and location cell; near-me
+        # entries hold every candidate for the cell and are ranked per caller
+        search_cache = get_search_cache()
+        cache_key = (mode, search_term, limit, cell, radius_km, k)
+        cached = search_cache.get(cache_key)
+        if cached is None:
+            cached = search_medicines(
+                search_term, mode=mode, limit=limit,
+                center=geohash_center(cell) if near_me else None,
+                radius_km=radius_km, k=k,
+            )
+            search_cache.set(cache_key, cached)
         
-        results = []
-        for medicine in medicines:
-            results.append({
-                'medicine_id': medicine.id,
-                'medicine_name': medicine.name,
-                'shop_id': medicine.shop.id,
-                'shop_name': medicine.shop.shop_name,
-                'shop_location': medicine.shop.location,
-                'quantity': medicine.quantity,
-                'price': float(medicine.price),
-            })
+        if near_me:
+            results = rank_nearby(cached.rows, latitude, longitude, radius_km=radius_km, k=k)
+        else:
+            results = cached.rows
         
         return JsonResponse({
             'success': True,
+            'mode': mode,
             'results': results,
             'count': len(results)
         })
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+@require_http_methods(["GET"])
+def autocompleteMedicine(request):
+    """Type-ahead suggestions for medicine names: GET ?q=<prefix>&limit=<n>"""
+    if 'user_id' not in request.session:
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
+    
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), 20)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+    
+    try:
+        prefix = request.GET.get('q', '')
+        
+        from medicalshop.search import get_name_index
+        name_index = get_name_index()
+        suggestions = [
+            {'name': name_index.display_name(normalized), 'shops': weight}
+            for normalized, weight in name_index.complete(prefix, limit=limit)
+        ]
+        
+        return JsonResponse({'success': True, 'suggestions': suggestions})
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@staff_member_required
+def searchCacheStats(request):
+    """Hit/miss counters of this worker's search result cache, for sizing it"""
+    from medicalshop.search import get_search_cache
+    return JsonResponse({'success': True, 'cache': get_search_cache().stats()})